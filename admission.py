@@ -0,0 +1,159 @@
+"""Контроль допуска запросов на анализ и памяти под изображения.
+
+Когда работы принято больше, чем сервер успевает выполнять, новые
+запросы не ставятся в бесконечную очередь (потоки Flask повисают на
+запросах к API), а сразу отклоняются с 429 и заголовком Retry-After.
+Время повтора считается по фактической пропускной способности:
+сколько работы впереди и сколько её выполняется в секунду.
+
+Отдельно ограничивается память: каждое изображение в обработке держит
+несколько копий (файл, base64, JSON-тело запроса), и без общего бюджета
+всплеск крупных загрузок может исчерпать память процесса.
+"""
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class AdmissionController:
+    """Ограничивает число активных HTTP-запросов и объём принятой работы.
+
+    Работа измеряется в парах изображение x модель. Пропускная способность -
+    выполненная работа за последние window секунд в единицу времени.
+    """
+
+    def __init__(self, max_requests, max_pending_work, window=60, default_retry_after=5, max_retry_after=120):
+        self.max_requests = max_requests
+        self.max_pending_work = max_pending_work
+        self.window = window
+        self.default_retry_after = default_retry_after
+        self.max_retry_after = max_retry_after
+        self.active_requests = 0
+        self.pending_work = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._completed = deque()
+        self._lock = threading.Lock()
+
+    def _throughput(self, now):
+        while self._completed and self._completed[0][0] < now - self.window:
+            self._completed.popleft()
+        if not self._completed:
+            return 0.0
+        done = sum(units for _, units in self._completed)
+        # После простоя окно короче window - делим на фактический интервал
+        return done / max(1.0, now - self._completed[0][0])
+
+    def _retry_after(self, work, now):
+        """Через сколько секунд освободится место для work единиц работы"""
+        throughput = self._throughput(now)
+        if throughput <= 0:
+            return self.default_retry_after
+        if self.active_requests >= self.max_requests:
+            # Ждём завершения одного из активных запросов
+            excess = self.pending_work / max(1, self.active_requests)
+        else:
+            excess = self.pending_work + work - self.max_pending_work
+        return max(1, min(self.max_retry_after, math.ceil(max(1, excess) / throughput)))
+
+    def try_admit(self, work):
+        """Принимает запрос с work единицами работы; возвращает (принят, Retry-After)"""
+        now = time.time()
+        with self._lock:
+            # Запрос больше лимита целиком принимается только на пустой сервер
+            over_work = self.pending_work > 0 and self.pending_work + work > self.max_pending_work
+            if self.active_requests >= self.max_requests or over_work:
+                self.rejected += 1
+                return False, self._retry_after(work, now)
+            self.active_requests += 1
+            self.pending_work += work
+            self.admitted += 1
+            return True, 0
+
+    def release(self, work, completed=True):
+        """Запрос завершён; completed=False - работа не выполнялась (ошибка, отмена)"""
+        now = time.time()
+        with self._lock:
+            self.active_requests -= 1
+            self.pending_work -= work
+            if completed:
+                self._completed.append((now, work))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_requests': self.max_requests,
+                'max_pending_work': self.max_pending_work,
+                'active_requests': self.active_requests,
+                'pending_work': self.pending_work,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'throughput_per_second': round(self._throughput(time.time()), 3)
+            }
+
+
+class MemoryBudget:
+    """Семафор, взвешенный байтами: ограничивает память под изображения в обработке.
+
+    Резерв больше всего бюджета выдаётся только когда других резервов нет,
+    чтобы одно крупное изображение не блокировалось навсегда.
+    """
+
+    def __init__(self, capacity_bytes):
+        self.capacity_bytes = capacity_bytes
+        self.in_use = 0
+        self.peak = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def _fits(self, nbytes):
+        return self.in_use == 0 or self.in_use + nbytes <= self.capacity_bytes
+
+    def acquire(self, nbytes, timeout=None, check=None):
+        """Ждёт, пока освободится nbytes; False - не дождались за timeout секунд.
+
+        check() вызывается во время ожидания и может прервать его исключением.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while not self._fits(nbytes):
+                    if check is not None:
+                        check()
+                    remaining = 0.5 if deadline is None else min(0.5, deadline - time.time())
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+            return True
+
+    def release(self, nbytes):
+        with self._cond:
+            self.in_use -= nbytes
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes, check=None):
+        self.acquire(nbytes, check=check)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'capacity_mb': round(self.capacity_bytes / 1024 ** 2, 1),
+                'in_use_mb': round(self.in_use / 1024 ** 2, 1),
+                'peak_mb': round(self.peak / 1024 ** 2, 1),
+                'waiting': self.waiting,
+                'rejected': self.rejected
+            }
@@ -1,228 +1,733 @@
-from flask import Flask, request, jsonify, render_template
+import time
+# Начало запуска - для отчёта о времени старта (см. STARTUP_SECONDS)
+STARTUP_STARTED = time.perf_counter()
+
+from flask import Flask, request, jsonify, render_template, g
 import requests
 import base64
 import os
-import time
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
-from sklearn.metrics import confusion_matrix
-import numpy as np
 from flask_cors import CORS
+import threading
+import sys
+import re
+import math
+import json
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from backends import create_backend, ModelNotLoadedError, short_model_name
+from jobs import Job, JobRegistry, JobCancelledError, DisconnectWatcher
+from fair_queue import FairScheduler
+from admission import AdmissionController, MemoryBudget
+from warmup import ModelWarmup
+from cost_model import CostPredictor
+from label_matcher import matcher_for, normalize_answer
 
 # Загрузка переменных окружения из .env файла
 load_dotenv()
 
-# Получение API ключа из переменных окружения
-API_KEY = os.getenv('API_KEY')
-
 app = Flask(__name__)
 CORS(app, origins=["*"], allow_headers=["*"], methods=["*"])  # Разрешаем все origins, headers и methods для CORS
 app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 # Создаем папку для загрузок, если её нет
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# Настройки корпоративного API
-LM_STUDIO_BASE_URL = "https://llama.sndi.my"
-LM_STUDIO_URL = f"{LM_STUDIO_BASE_URL}/api/v1/chat/completions"
-LM_STUDIO_MODELS_URL = f"{LM_STUDIO_BASE_URL}/api/v1/models"
-HEADERS = {"Authorization": f"Bearer {API_KEY}"}
-MODELS = []  # Будет заполняться динамически из API
+# Бэкенд инференса: corporate (по умолчанию), lmstudio-rest или lmstudio-sdk
+backend = create_backend()
+
+# Задания клиентов: дедлайны и отмена (клиент продлевает аренду heartbeat-запросами)
+jobs = JobRegistry(lease_seconds=int(os.getenv('JOB_LEASE_SECONDS', '30')))
+# Запрос, клиент которого закрыл соединение (отмена, закрытая вкладка), отменяется сразу
+disconnect_watcher = DisconnectWatcher()
+# Дедлайн одного HTTP-запроса клиента по умолчанию, секунд (0 - только дедлайн задания)
+REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', '0'))
+
+def parse_tenant_weights(value):
+    """TENANT_WEIGHTS вида "alice:2,bob:1" -> {'alice': 2.0, 'bob': 1.0}"""
+    weights = {}
+    for item in value.split(','):
+        if ':' in item:
+            tenant, weight = item.rsplit(':', 1)
+            weights[tenant.strip()] = float(weight)
+    return weights
+
+# Контроль допуска: сверх лимитов запросы на анализ сразу получают 429 с Retry-After
+# (работа - пары изображение x модель, принятые, но ещё не выполненные)
+admission = AdmissionController(
+    int(os.getenv('MAX_ACTIVE_REQUESTS', '32')),
+    int(os.getenv('MAX_PENDING_WORK', '256'))
+)
+
+# Бюджет памяти под изображения в обработке: тела загрузок при разборе и копии
+# изображений (файл, base64, JSON-тело) на время запроса к модели
+memory_budget = MemoryBudget(int(float(os.getenv('MAX_INFLIGHT_IMAGE_MB', '512')) * 1024 ** 2))
+# Сколько ждать памяти под загрузку, прежде чем ответить 429
+MEMORY_WAIT_SECONDS = float(os.getenv('MEMORY_WAIT_SECONDS', '5'))
+# Копий изображения в памяти на время запроса: байты файла, base64 (~4/3) и JSON-тело (~4/3)
+IMAGE_MEMORY_FACTOR = 4
+
+# Справедливая очередь запросов к API между пользователями. Локальные бэкенды
+# обрабатывают пакет моделью целиком под своей блокировкой, поэтому очередь
+# нужна только транспортам с параллельными запросами
+fair_scheduler = None
+if backend.capabilities()['parallel_requests']:
+    fair_scheduler = FairScheduler(
+        int(os.getenv('UPSTREAM_CONCURRENCY', '8')),
+        parse_tenant_weights(os.getenv('TENANT_WEIGHTS', ''))
+    )
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
+# Лимиты датасета в интерфейсе: изображения отправляются частями, поэтому
+# ограничение - память браузера под список файлов и миниатюры (0 - без ограничения)
+MAX_UPLOAD_FILES = int(os.getenv('MAX_UPLOAD_FILES', '20000'))
+MAX_UPLOAD_TOTAL_MB = int(os.getenv('MAX_UPLOAD_TOTAL_MB', '0'))
 
-def load_vision_models():
-    """Загружает список моделей с поддержкой vision из корпоративного API"""
-    global MODELS
-    max_retries = 3
-    retry_delay = 2
-    
-    # Если модели уже загружены, возвращаем их
-    if MODELS:
-        return MODELS
-    
-    for attempt in range(max_retries):
+# Поиск почти-дубликатов: порог расстояния Хэмминга для dHash (64 бита)
+NEAR_DUPLICATE_THRESHOLD = int(os.getenv('NEAR_DUPLICATE_THRESHOLD', '5'))
+NEAR_DUPLICATE_MAX_ITEMS = int(os.getenv('NEAR_DUPLICATE_MAX_ITEMS', '10000'))
+# Индексов не больше NEAR_DUPLICATE_MAX_INDEXES (вытесняется давно не
+# использованный), индекс без обращений дольше TTL секунд удаляется
+NEAR_DUPLICATE_MAX_INDEXES = int(os.getenv('NEAR_DUPLICATE_MAX_INDEXES', '64'))
+NEAR_DUPLICATE_INDEX_TTL = int(os.getenv('NEAR_DUPLICATE_INDEX_TTL', '3600'))
+# Отдельный индекс на каждую комбинацию пользователь + модель + режим + классы,
+# т.к. результат переиспользуется только для того же самого запроса и
+# ответы одного пользователя не должны попадать к другому
+near_duplicate_indexes = OrderedDict()  # ключ -> (индекс, время последнего обращения)
+near_duplicate_lock = threading.Lock()
+# Перцептивные хеши загруженных файлов: считаются один раз на файл,
+# а не для каждой модели запроса (путь -> хеш, удаляется вместе с файлом)
+upload_hashes = {}
+upload_hashes_lock = threading.Lock()
+
+# Упаковка нескольких изображений в один запрос к API (режим по выбору)
+DEFAULT_PACK_SIZE = int(os.getenv('DEFAULT_PACK_SIZE', '4'))
+MAX_PACK_SIZE = int(os.getenv('MAX_PACK_SIZE', '8'))
+
+# Лимит тела запроса следует за упаковкой: пачка до MAX_PACK_SIZE изображений
+# (чанки ансамбля и каскада того же размера) по MAX_IMAGE_MB плюс поля формы.
+# Клиент делит пачки так, чтобы изображения укладывались в max_request_mb
+MAX_IMAGE_MB = float(os.getenv('MAX_IMAGE_MB', '16'))
+MAX_REQUEST_MB = MAX_IMAGE_MB * MAX_PACK_SIZE
+app.config['MAX_CONTENT_LENGTH'] = int((MAX_REQUEST_MB + 1) * 1024 ** 2)
+
+# Каскад разрешений: первый проход по уменьшенной копии (максимальная сторона, px)
+CASCADE_LOW_RES_SIZE = int(os.getenv('CASCADE_LOW_RES_SIZE', '384'))
+# Признаки неуверенного ответа - такие ответы перепроверяются в полном разрешении
+LOW_CONFIDENCE_MARKERS = ('возможно', 'вероятно', 'похоже', 'не уверен', 'неясно', 'не могу', 'трудно сказать', 'maybe', 'possibly', 'unclear', '?')
+# Вероятность положительного класса ближе к 0.5, чем на эту величину, считается неуверенной
+SCORING_UNCERTAIN_MARGIN = float(os.getenv('SCORING_UNCERTAIN_MARGIN', '0.2'))
+
+# Прогноз токенов и времени ответа по размеру изображения (онлайн-регрессия по ответам)
+cost_predictor = CostPredictor(min_samples=int(os.getenv('COST_MIN_SAMPLES', '5')))
+
+# Прогрев моделей: проба - запрос на один токен с белым изображением 32x32
+WARMUP_IMAGE_B64 = "iVBORw0KGgoAAAANSUhEUgAAACAAAAAgCAIAAAD8GO2jAAAAKElEQVR42u3NQQEAAAQEMPTvfErw2wqsk9SnqWcCgUAgEAgEAoHgygLH8QM9BsqtpQAAAABJRU5ErkJggg=="
+WARMUP_TIMEOUT = float(os.getenv('WARMUP_TIMEOUT', '60'))
+
+def warmup_probe(model_name):
+    """Крошечный запрос к модели для прогрева, возвращает время ответа"""
+    content = [
+        {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/png;base64,{WARMUP_IMAGE_B64}"
+            }
+        },
+        {
+            "type": "text",
+            "text": "Ответь одним словом: готов"
+        }
+    ]
+    # Пробы занимают общие слоты API наравне с пользователями
+    with fair_scheduler.slot('warmup') if fair_scheduler else nullcontext():
+        job = Job(deadline=time.time() + WARMUP_TIMEOUT, tenant='warmup')
         try:
-            print(f"🔄 Попытка {attempt + 1}/{max_retries} загрузки моделей...")
-            response = requests.get(LM_STUDIO_MODELS_URL, headers=HEADERS, timeout=15)
-            response.raise_for_status()
-            models_data = response.json()
-            
-            # Получаем все модели и фильтруем только с vision
-            all_models = models_data.get('data', [])
-            vision_models = []
-            
-            for model in all_models:
-                info = model.get('info', {})
-                meta = info.get('meta', {})
-                capabilities = meta.get('capabilities', {})
-                
-                if capabilities.get('vision', False):
-                    vision_models.append(model['id'])
-            
-            MODELS = vision_models
-            print(f"✓ Загружено {len(MODELS)} моделей с поддержкой vision: {MODELS}")
-            return MODELS  # Успешно загрузили, возвращаем список
-            
-        except Exception as e:
-            print(f"✗ Попытка {attempt + 1} не удалась: {e}")
-            if attempt < max_retries - 1:
-                print(f"⏳ Ждем {retry_delay} секунд перед следующей попыткой...")
-                time.sleep(retry_delay)
-            else:
-                print("❌ Все попытки исчерпаны, используем fallback модели")
-    
-    # Fallback на известные модели
-    MODELS = ["Qwen3-VL-235B-A22B-Instruct", "google/gemma-3-27b-it"]
-    print(f"⚠ Используем fallback модели: {MODELS}")
-    return MODELS
+            _, processing_time = backend.infer(model_name, content, 1, job=job)
+        finally:
+            job.close()
+    return processing_time
+
+warmup = ModelWarmup(
+    warmup_probe,
+    concurrency=fair_scheduler.capacity if fair_scheduler else 1,
+    # Тёплая задержка пробы, выше которой модель помечается degraded, секунд
+    slow_latency=float(os.getenv('WARMUP_SLOW_SECONDS', '10'))
+)
+
+def warm_catalog(catalog):
+    """Прогревает модели, не требующие загрузки, при появлении или смене каталога"""
+    warmup.schedule([model['id'] for model in catalog if model['loaded']])
+
+backend.on_catalog_change(warm_catalog)
+warmup_started = threading.Event()
+
+def start_warmup():
+    """Запускает фоновые задачи бэкенда и загрузку каталога (идемпотентно)
+
+    Прогрев начинается, когда каталог появится (снимок или ответ API).
+    """
+    if warmup_started.is_set():
+        return
+    warmup_started.set()
+    backend.start()
+    threading.Thread(target=backend.catalog, name='catalog-load', daemon=True).start()
+
+def is_reloader_parent():
+    """Родительский процесс перезагрузчика Werkzeug (python app.py с debug=True)
+
+    Он только следит за файлами и перезапускает дочерний процесс
+    (WERKZEUG_RUN_MAIN=true), который и обслуживает запросы.
+    """
+    script = os.path.basename(getattr(sys.modules.get('__main__'), '__file__', None) or '')
+    return os.environ.get('WERKZEUG_RUN_MAIN') != 'true' and script in ('app.py', 'app_rest.py', 'app_sdk.py')
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def get_loaded_model():
-    """Для корпоративного API модели всегда доступны - возвращаем первую из списка"""
-    return MODELS[0] if MODELS else None
+def get_near_duplicate_index(tenant, model_name, mode, classification_settings, variant=None):
+    """Возвращает индекс перцептивных хешей пользователя для данной конфигурации запроса
+
+    variant разделяет результаты, полученные по разным версиям изображения
+    (например, уменьшенной копии в каскаде), с одинаковым хешем.
+    """
+    settings = classification_settings or {}
+    key = (tenant, model_name, mode, settings.get('positiveClass'), settings.get('negativeClass'), settings.get('scoring', False), variant)
+    now = time.time()
+    with near_duplicate_lock:
+        # OrderedDict упорядочен по последнему обращению - устаревшие индексы в начале
+        while near_duplicate_indexes and next(iter(near_duplicate_indexes.values()))[1] < now - NEAR_DUPLICATE_INDEX_TTL:
+            near_duplicate_indexes.popitem(last=False)
+        if key in near_duplicate_indexes:
+            index = near_duplicate_indexes.pop(key)[0]
+        else:
+            # numpy и Pillow импортируются при первом использовании - не на старте
+            from image_hash import PerceptualIndex
+            index = PerceptualIndex(max_items=NEAR_DUPLICATE_MAX_ITEMS)
+            if len(near_duplicate_indexes) >= NEAR_DUPLICATE_MAX_INDEXES:
+                near_duplicate_indexes.popitem(last=False)
+        near_duplicate_indexes[key] = (index, now)
+        return index
 
-def test_model_availability(model_name):
-    """Для корпоративного API модели всегда доступны"""
-    return model_name in MODELS
+def upload_hash(filepath):
+    """Перцептивный хеш загруженного файла (считается один раз на файл)"""
+    with upload_hashes_lock:
+        if filepath in upload_hashes:
+            return upload_hashes[filepath]
+    from image_hash import dhash
+    image_hash = dhash(filepath)
+    with upload_hashes_lock:
+        upload_hashes[filepath] = image_hash
+    return image_hash
 
-def check_if_model_actually_loaded(model_name):
-    """Для корпоративного API модели всегда загружены"""
-    return model_name in MODELS
+def remove_upload(filepath):
+    """Удаляет временный файл загрузки и его перцептивный хеш"""
+    with upload_hashes_lock:
+        upload_hashes.pop(filepath, None)
+    if os.path.exists(filepath):
+        os.remove(filepath)
 
-def load_model(model_name):
-    """Для корпоративного API модели всегда доступны"""
-    if model_name in MODELS:
-        print(f"✓ Модель {model_name} доступна в корпоративном API")
-        return True
+def find_near_duplicate_result(image_hash, index, threshold):
+    """Ищет уже полученный результат для почти-дубликата изображения"""
+    match = index.find(image_hash, threshold)
+    if match is None:
+        return None
+
+    source, distance = match
+    # Копируем ответ представителя; вызова к API не было, поэтому время и токены нулевые
+    result = dict(source['result'])
+    result.update({
+        "processing_time": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "total_tokens": 0,
+        "near_duplicate_of": source['filename'],
+        "hamming_distance": distance,
+        "reused_result": True
+    })
+    result.pop("tokens_per_second", None)
+    return result
+
+def encode_image(image_path):
+    """Читает изображение и возвращает (base64, MIME-тип)"""
+    with open(image_path, "rb") as img_file:
+        img_b64 = base64.b64encode(img_file.read()).decode("utf-8")
+
+    ext = image_path.rsplit('.', 1)[1].lower()
+    mime_type = f"image/{ext if ext != 'jpg' else 'jpeg'}"
+    return img_b64, mime_type
+
+@contextmanager
+def upstream_slot(job, nbytes):
+    """Место в очереди к API (см. FairScheduler) и nbytes памяти на время запроса"""
+    check = job.check if job else None
+    if fair_scheduler is None:
+        slot = nullcontext()
     else:
-        print(f"✗ Модель {model_name} не найдена в списке доступных")
-        return False
+        slot = fair_scheduler.slot(
+            job.tenant if job else 'anonymous',
+            interactive=job.interactive if job else False,
+            check=check
+        )
+    with slot, memory_budget.reserve(nbytes, check=check):
+        yield
+
+# Дубликаты хеджирования занимают очередь и память наравне с остальными запросами
+backend.use_request_slot(upstream_slot)
 
-def unload_model():
-    """Для корпоративного API выгрузка не требуется"""
-    print("Корпоративный API: выгрузка моделей не требуется")
-    return True
+def dispatch_slot(image_paths, job=None):
+    """Место в очереди к API и память под изображения на время кодирования и запроса
 
-def get_entity_from_image(image_path, model_name, mode='description', classification_settings=None):
-    """Определяет сущность на изображении через корпоративный API"""
+    Сначала ждём своей очереди (см. FairScheduler), потом резервируем память:
+    изображения кодируются в base64 только тогда, когда запрос действительно
+    уходит к модели, а не копятся в памяти, пока ждут очереди.
+    """
+    nbytes = sum(os.path.getsize(image_path) for image_path in image_paths) * IMAGE_MEMORY_FACTOR
+    return upstream_slot(job, nbytes)
+
+def build_prompt_text(mode='description', classification_settings=None):
+    """Формирует текст промпта в зависимости от режима"""
+    if mode == 'classification' and classification_settings:
+        positive_class = classification_settings.get('positiveClass', 'Самолет')
+        negative_class = classification_settings.get('negativeClass', 'Не самолет')
+        return f"Определи, что изображено на картинке. Это {positive_class} или {negative_class}? Ответь только одним словом: '{positive_class}' или '{negative_class}'."
+    if mode == 'combined' and classification_settings:
+        positive_class = classification_settings.get('positiveClass', 'Самолет')
+        negative_class = classification_settings.get('negativeClass', 'Не самолет')
+        return (
+            "Определи, что изображено на картинке, и классифицируй изображение. "
+            "Ответь только JSON-объектом без пояснений и без markdown в формате: "
+            f'{{"description": "<одно слово или короткая фраза - название сущности>", "classification": "{positive_class}" или "{negative_class}"}}'
+        )
+    return "Определи, что изображено на картинке. Ответь только одним словом или короткой фразой — только название сущности, без пояснений."
+
+def build_packed_prompt_text(count, mode='description', classification_settings=None):
+    """Промпт для нескольких пронумерованных изображений в одном сообщении"""
+    if mode == 'classification' and classification_settings:
+        positive_class = classification_settings.get('positiveClass', 'Самолет')
+        negative_class = classification_settings.get('negativeClass', 'Не самолет')
+        task = f"Для каждого изображения определи: это {positive_class} или {negative_class}? Ответ - только '{positive_class}' или '{negative_class}'."
+    else:
+        task = "Для каждого изображения определи, что на нём изображено. Ответ - одно слово или короткая фраза, только название сущности, без пояснений."
+
+    lines = "\n".join(f"{i}. <ответ для изображения {i}>" for i in range(1, count + 1))
+    return f"Выше {count} пронумерованных изображений. {task}\nОтветь строго в формате, по одной строке на изображение:\n{lines}"
+
+def call_chat_api(model_name, content, max_tokens, extra_params=None, job=None):
+    """Отправляет запрос к модели через текущий бэкенд, возвращает (ответ, время обработки)"""
+    result, processing_time = backend.infer(model_name, content, max_tokens, extra_params=extra_params, job=job)
+
+    # Логируем полный ответ API для отладки
+    print("[DEBUG] API Response:", result)
+
+    # Логируем ошибки, если они есть
+    if "error" in result:
+        print("[ERROR] API Error:", result["error"])
+
+    return result, processing_time
+
+def build_metrics(entity, model_name, mode, processing_time, max_tokens, usage=None, load_time=None):
+    """Собирает метрики ответа модели"""
+    metrics = {
+        "entity": entity,
+        "model": model_name,
+        "processing_time": processing_time,
+        "temperature": 0.2,
+        "max_tokens": max_tokens,
+        "mode": mode,
+        "model_info": {
+            "name": model_name,
+            "provider": model_name.split('/')[0] if '/' in model_name else backend.name,
+            "model_short": short_model_name(model_name),
+            "api_endpoint": backend.endpoint,
+            "request_type": "vision-language"
+        }
+    }
+
+    # Время загрузки модели (локальные бэкенды) не входит в processing_time
+    if load_time:
+        metrics["model_load_time"] = load_time
+
+    # Добавляем информацию о токенах, если доступна
+    if usage is not None:
+        metrics["prompt_tokens"] = usage.get("prompt_tokens", 0)
+        metrics["completion_tokens"] = usage.get("completion_tokens", 0)
+        metrics["total_tokens"] = usage.get("total_tokens", 0)
+
+        # Вычисляем скорость генерации (токенов в секунду)
+        if processing_time > 0 and metrics["completion_tokens"] > 0:
+            metrics["tokens_per_second"] = round(metrics["completion_tokens"] / processing_time, 2)
+
+    return metrics
+
+def model_not_loaded_error(error):
+    """Результат-ошибка для модели, которую локальный LM Studio не смог активировать"""
+    print(f"⚠ Модель {error.model_name} не является активной, сейчас: {error.current_model}")
+    return {
+        "error": str(error),
+        "requires_manual_load": True,
+        "current_loaded": error.current_model
+    }
+
+def job_cancelled_error(error):
+    """Результат-ошибка для изображения, обработка которого отменена или не уложилась в дедлайн"""
+    return {
+        "error": str(error),
+        "cancelled": True
+    }
+
+def get_entity_from_image(image_path, model_name, mode='description', classification_settings=None, job=None):
+    """Определяет сущность на изображении через текущий бэкенд"""
     try:
-        # Загружаем модели, если они еще не загружены
-        load_vision_models()
-        
         # Проверяем, что модель поддерживается
-        if model_name not in MODELS:
+        if not backend.is_available(model_name):
             return {
-                "error": f"Модель {model_name} не поддерживается в корпоративном API"
+                "error": f"Модель {model_name} не поддерживается: {backend.title}"
             }
 
-        # Читаем и кодируем изображение в base64
-        with open(image_path, "rb") as img_file:
-            img_b64 = base64.b64encode(img_file.read()).decode("utf-8")
-
-        # Определяем MIME-тип
-        ext = image_path.rsplit('.', 1)[1].lower()
-        mime_type = f"image/{ext if ext != 'jpg' else 'jpeg'}"
+        with dispatch_slot([image_path], job):
+            # Читаем и кодируем изображение в base64
+            img_b64, mime_type = encode_image(image_path)
 
-        # Формируем промпт в зависимости от режима
-        if mode == 'classification' and classification_settings:
-            positive_class = classification_settings.get('positiveClass', 'Самолет')
-            negative_class = classification_settings.get('negativeClass', 'Не самолет')
-            prompt_text = f"Определи, что изображено на картинке. Это {positive_class} или {negative_class}? Ответь только одним словом: '{positive_class}' или '{negative_class}'."
-        else:
-            prompt_text = "Определи, что изображено на картинке. Ответь только одним словом или короткой фразой — только название сущности, без пояснений."
-
-        # Формируем запрос к корпоративному API
-        payload = {
-            "model": model_name,
-            "messages": [
+            content = [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime_type};base64,{img_b64}"
+                    }
+                },
                 {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{mime_type};base64,{img_b64}"
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": prompt_text
-                        }
-                    ]
+                    "type": "text",
+                    "text": build_prompt_text(mode, classification_settings)
                 }
-            ],
-            "max_tokens": 30,
-            "temperature": 0.2
+            ]
+
+            result, processing_time = call_chat_api(model_name, content, 30, job=job)
+
+        # Извлекаем ответ модели и метрики
+        entity = result["choices"][0]["message"]["content"].strip()
+        metrics = build_metrics(entity, model_name, mode, processing_time, 30, result.get("usage"), result.get("model_load_time"))
+
+        # Добавляем информацию о запросе
+        metrics["request_info"] = {
+            "image_size": len(img_b64),
+            "mime_type": mime_type,
+            "api_response_time": processing_time,
+            "status": "success"
         }
 
-        # Засекаем время начала запроса
-        start_time = time.time()
+        return metrics
 
-        response = requests.post(LM_STUDIO_URL, json=payload, headers=HEADERS, timeout=120)
-        response.raise_for_status()
-        result = response.json()
+    except JobCancelledError as e:
+        return job_cancelled_error(e)
+    except ModelNotLoadedError as e:
+        return model_not_loaded_error(e)
+    except requests.exceptions.RequestException as e:
+        return {"error": f"Ошибка подключения ({backend.title}): {str(e)}"}
+    except Exception as e:
+        return {"error": f"Ошибка обработки изображения: {str(e)}"}
 
-        # Логируем полный ответ API для отладки
-        print("[DEBUG] API Response:", result)
+def build_scoring_prompt_text(classification_settings):
+    """Промпт для оценки вероятности: ответ - одна цифра"""
+    positive_class = classification_settings.get('positiveClass', 'Самолет')
+    negative_class = classification_settings.get('negativeClass', 'Не самолет')
+    return f"На картинке {positive_class} или {negative_class}? Ответь одной цифрой: 1 - {positive_class}, 0 - {negative_class}."
 
-        # Логируем ошибки, если они есть
-        if "error" in result:
-            print("[ERROR] API Error:", result["error"])
+def positive_probability_from_logprobs(result):
+    """Вероятность ответа "1" по top_logprobs первого токена (None, если logprobs нет)"""
+    try:
+        top_logprobs = result["choices"][0]["logprobs"]["content"][0]["top_logprobs"]
+    except (KeyError, IndexError, TypeError):
+        return None
 
-        # Вычисляем время обработки
-        end_time = time.time()
-        processing_time = round(end_time - start_time, 3)
+    probabilities = {'1': 0.0, '0': 0.0}
+    for candidate in top_logprobs:
+        token = candidate.get("token", "").strip()
+        if token in probabilities:
+            probabilities[token] += math.exp(candidate.get("logprob", float('-inf')))
 
-        # Извлекаем ответ модели и метрики
-        entity = result["choices"][0]["message"]["content"].strip()
+    total = probabilities['1'] + probabilities['0']
+    if total == 0:
+        return None
+    # Нормируем на два допустимых ответа - остальные токены не учитываются
+    return probabilities['1'] / total
 
-        # Собираем метрики
-        metrics = {
-            "entity": entity,
-            "model": model_name,
-            "processing_time": processing_time,
-            "temperature": 0.2,
-            "max_tokens": 30,
-            "mode": mode,
-            "model_info": {
-                "name": model_name,
-                "provider": model_name.split('/')[0] if '/' in model_name else 'corporate',
-                "model_short": model_name.split('/')[1] if '/' in model_name else model_name,
-                "api_endpoint": LM_STUDIO_URL,
-                "request_type": "vision-language"
+def get_score_from_image(image_path, model_name, classification_settings, job=None):
+    """Классификация одним токеном с вероятностью положительного класса
+
+    Если бэкенд возвращает logprobs, вероятность берётся из них,
+    иначе - 1.0 или 0.0 по сгенерированной цифре.
+    """
+    try:
+        if not backend.is_available(model_name):
+            return {
+                "error": f"Модель {model_name} не поддерживается: {backend.title}"
             }
-        }
 
-        # Добавляем информацию о токенах, если доступна
-        if "usage" in result:
-            usage = result["usage"]
-            metrics["prompt_tokens"] = usage.get("prompt_tokens", 0)
-            metrics["completion_tokens"] = usage.get("completion_tokens", 0)
-            metrics["total_tokens"] = usage.get("total_tokens", 0)
+        with dispatch_slot([image_path], job):
+            img_b64, mime_type = encode_image(image_path)
+            content = [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime_type};base64,{img_b64}"
+                    }
+                },
+                {
+                    "type": "text",
+                    "text": build_scoring_prompt_text(classification_settings)
+                }
+            ]
 
-            # Вычисляем скорость генерации (токенов в секунду)
-            if processing_time > 0 and metrics["completion_tokens"] > 0:
-                metrics["tokens_per_second"] = round(metrics["completion_tokens"] / processing_time, 2)
+            extra_params = {"logprobs": True, "top_logprobs": 5} if backend.capabilities().get('logprobs') else None
+            result, processing_time = call_chat_api(model_name, content, 1, extra_params, job)
 
-        # Добавляем информацию о запросе
+        answer = result["choices"][0]["message"]["content"].strip()
+        probability = positive_probability_from_logprobs(result)
+        scoring = 'logprobs'
+        if probability is None:
+            if answer[:1] not in ('0', '1'):
+                return {"error": f"Модель не ответила цифрой 0 или 1: '{answer}'"}
+            probability = float(answer[:1] == '1')
+            scoring = 'token'
+
+        entity = classification_settings['positiveClass'] if probability >= 0.5 else classification_settings['negativeClass']
+        metrics = build_metrics(entity, model_name, 'classification', processing_time, 1, result.get("usage"), result.get("model_load_time"))
+        metrics["positive_probability"] = round(probability, 4)
+        metrics["scoring"] = scoring
+        metrics["raw_answer"] = answer
         metrics["request_info"] = {
             "image_size": len(img_b64),
             "mime_type": mime_type,
             "api_response_time": processing_time,
             "status": "success"
         }
-
         return metrics
 
+    except JobCancelledError as e:
+        return job_cancelled_error(e)
+    except ModelNotLoadedError as e:
+        return model_not_loaded_error(e)
     except requests.exceptions.RequestException as e:
-        return {"error": f"Ошибка подключения к корпоративному API: {str(e)}"}
+        return {"error": f"Ошибка подключения ({backend.title}): {str(e)}"}
     except Exception as e:
         return {"error": f"Ошибка обработки изображения: {str(e)}"}
 
+def parse_combined_answer(content, classification_settings):
+    """Разбирает JSON-ответ комбинированного режима, возвращает (описание, класс) или None"""
+    text = content.strip()
+    # Модели часто оборачивают JSON в ```json ... ``` или добавляют текст вокруг
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end <= start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    description = data.get('description')
+    classification = data.get('classification')
+    if not isinstance(description, str) or not isinstance(classification, str):
+        return None
+    description, classification = description.strip(), classification.strip()
+    if not description or not classification:
+        return None
+
+    # Класс должен соответствовать одному из заданных
+    if matcher_for(classification_settings).match(classification) is None:
+        return None
+    return description, classification
+
+def merge_separate_results(description_result, classification_result, failed_time=0, failed_usage=None):
+    """Объединяет результаты двух отдельных запросов в результат комбинированного режима
+
+    Время и токены неудачного комбинированного запроса тоже учитываются,
+    чтобы стоимость режима не занижалась.
+    """
+    for result in (description_result, classification_result):
+        if "error" in result:
+            return result
+
+    failed_usage = failed_usage or {}
+    merged = dict(description_result)
+    merged["mode"] = "combined"
+    merged["classification"] = classification_result["entity"]
+    merged["processing_time"] = round(description_result["processing_time"] + classification_result["processing_time"] + failed_time, 3)
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        if key in description_result or key in classification_result:
+            merged[key] = description_result.get(key, 0) + classification_result.get(key, 0) + failed_usage.get(key, 0)
+    merged.pop("tokens_per_second", None)
+    if merged["processing_time"] > 0 and merged.get("completion_tokens", 0) > 0:
+        merged["tokens_per_second"] = round(merged["completion_tokens"] / merged["processing_time"], 2)
+    merged["combined_fallback"] = True
+    return merged
+
+def get_combined_from_image(image_path, model_name, classification_settings, job=None):
+    """Описание и классификация одним запросом со структурированным (JSON) ответом
+
+    Если ответ не удалось разобрать или класс не совпал ни с одним из заданных,
+    делаются два отдельных запроса - описание и классификация.
+    """
+    failed_time, failed_usage = 0, None
+    try:
+        if not backend.is_available(model_name):
+            return {
+                "error": f"Модель {model_name} не поддерживается: {backend.title}"
+            }
+
+        with dispatch_slot([image_path], job):
+            img_b64, mime_type = encode_image(image_path)
+            content = [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime_type};base64,{img_b64}"
+                    }
+                },
+                {
+                    "type": "text",
+                    "text": build_prompt_text('combined', classification_settings)
+                }
+            ]
+
+            result, processing_time = call_chat_api(model_name, content, 120, job=job)
+        failed_time, failed_usage = processing_time, result.get("usage")
+        parsed = parse_combined_answer(result["choices"][0]["message"]["content"], classification_settings)
+        if parsed is not None:
+            description, classification = parsed
+            metrics = build_metrics(description, model_name, 'combined', processing_time, 120, result.get("usage"), result.get("model_load_time"))
+            metrics["classification"] = classification
+            metrics["request_info"] = {
+                "image_size": len(img_b64),
+                "mime_type": mime_type,
+                "api_response_time": processing_time,
+                "status": "success"
+            }
+            return metrics
+
+        print(f"⚠ {model_name}: не удалось разобрать JSON-ответ, выполняем отдельные запросы")
+    except JobCancelledError as e:
+        return job_cancelled_error(e)
+    except ModelNotLoadedError as e:
+        return model_not_loaded_error(e)
+    except requests.exceptions.RequestException as e:
+        return {"error": f"Ошибка подключения ({backend.title}): {str(e)}"}
+    except Exception as e:
+        print(f"⚠ {model_name}: ошибка комбинированного запроса ({e}), выполняем отдельные запросы")
+
+    description_result = get_entity_from_image(image_path, model_name, 'description', job=job)
+    classification_result = get_entity_from_image(image_path, model_name, 'classification', classification_settings, job)
+    return merge_separate_results(description_result, classification_result, failed_time, failed_usage)
+
+PACKED_ANSWER_RE = re.compile(r'^\s*(?:[*#>\-]\s*)*(?:изображение|image)?\s*№?\s*(\d+)\s*[.):\-—–]\s*(.+?)\s*$', re.IGNORECASE)
+
+def parse_packed_answers(content, count):
+    """Разбирает нумерованные ответы модели: {номер (с 0): ответ}
+
+    Строки с номером вне диапазона, пустым ответом или повторным номером
+    игнорируются - для таких изображений будет сделан отдельный запрос.
+    """
+    answers = {}
+    duplicates = set()
+    for line in content.splitlines():
+        match = PACKED_ANSWER_RE.match(line)
+        if not match:
+            continue
+        number = int(match.group(1))
+        answer = match.group(2).strip().strip('*_`"\'«»').strip()
+        if not 1 <= number <= count or not answer:
+            continue
+        if number - 1 in answers:
+            duplicates.add(number - 1)
+        answers[number - 1] = answer
+
+    for index in duplicates:
+        answers.pop(index, None)
+    return answers
+
+def get_entities_from_images_packed(image_paths, model_name, mode='description', classification_settings=None, job=None):
+    """Анализирует несколько изображений одним запросом к API.
+
+    Время и токены запроса делятся поровну между изображениями пачки, чтобы
+    метрики оставались сопоставимыми с одиночными запросами. Изображения,
+    ответ для которых не удалось разобрать, обрабатываются отдельными запросами.
+    """
+    if len(image_paths) == 1:
+        return [get_entity_from_image(image_paths[0], model_name, mode, classification_settings, job)]
+
+    count = len(image_paths)
+    answers = {}
+    packed_result = None
+    processing_time = 0
+    max_tokens = 30 * count
+
+    try:
+        if not backend.is_available(model_name):
+            error = {"error": f"Модель {model_name} не поддерживается: {backend.title}"}
+            return [dict(error) for _ in image_paths]
+
+        with dispatch_slot(image_paths, job):
+            content = []
+            encoded = []
+            for i, image_path in enumerate(image_paths, start=1):
+                img_b64, mime_type = encode_image(image_path)
+                encoded.append((img_b64, mime_type))
+                content.append({"type": "text", "text": f"Изображение {i}:"})
+                content.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime_type};base64,{img_b64}"
+                    }
+                })
+            content.append({
+                "type": "text",
+                "text": build_packed_prompt_text(count, mode, classification_settings)
+            })
+
+            packed_result, processing_time = call_chat_api(model_name, content, max_tokens, job=job)
+        answers = parse_packed_answers(packed_result["choices"][0]["message"]["content"], count)
+    except JobCancelledError as e:
+        return [job_cancelled_error(e) for _ in image_paths]
+    except Exception as e:
+        print(f"✗ Пакетный запрос к {model_name} не удался, переходим на одиночные запросы: {e}")
+
+    usage = packed_result.get("usage") if packed_result else None
+    per_image_usage = None
+    if usage is not None:
+        per_image_usage = {
+            key: round(usage.get(key, 0) / count)
+            for key in ("prompt_tokens", "completion_tokens", "total_tokens")
+        }
+    per_image_time = round(processing_time / count, 3)
+
+    results = []
+    for i, image_path in enumerate(image_paths):
+        if i not in answers:
+            print(f"⚠ Ответ для изображения {i + 1} из пачки не разобран, отдельный запрос")
+            single = get_entity_from_image(image_path, model_name, mode, classification_settings, job)
+            if "error" not in single:
+                single["pack_fallback"] = True
+            results.append(single)
+            continue
+
+        metrics = build_metrics(answers[i], model_name, mode, per_image_time, max_tokens, per_image_usage)
+        img_b64, mime_type = encoded[i]
+        metrics["packed"] = True
+        metrics["pack_size"] = count
+        metrics["request_info"] = {
+            "image_size": len(img_b64),
+            "mime_type": mime_type,
+            "api_response_time": processing_time,
+            "status": "success"
+        }
+        results.append(metrics)
+
+    return results
+
 @app.route('/')
 def index():
     """Главная страница"""
@@ -230,101 +735,87 @@ def index():
 
 @app.route('/api/vlm-models', methods=['GET'])
 def get_vlm_models():
-    """Получить список всех VLM (vision) моделей из корпоративного API"""
+    """Получить список всех VLM (vision) моделей текущего бэкенда"""
     try:
-        # Загружаем модели, если они еще не загружены
-        load_vision_models()
-        
-        response = requests.get(LM_STUDIO_MODELS_URL, headers=HEADERS, timeout=10)
-        response.raise_for_status()
-        models_data = response.json()
-        
-        # Получаем все модели и фильтруем только с vision
-        all_models = models_data.get('data', [])
-        vlm_models = []
-        
-        for model in all_models:
-            info = model.get('info', {})
-            meta = info.get('meta', {})
-            capabilities = meta.get('capabilities', {})
-            
-            if capabilities.get('vision', False):
-                vlm_models.append({
-                    'id': model['id'],
-                    'name': model['id'],
-                    'publisher': model['id'].split('/')[0] if '/' in model['id'] else 'unknown',
-                    'arch': 'unknown',
-                    'state': 'loaded',
-                    'quantization': '',
-                    'max_context': model.get('max_model_len', 0),
-                    'loaded': True
-                })
+        # Каталог запрашиваем заново - состояние моделей могло измениться
+        vlm_models = backend.fetch_catalog()
         
         return jsonify({
             'status': 'ok',
             'models': vlm_models,
             'total': len(vlm_models),
-            'loaded_count': len(vlm_models)
+            'loaded_count': sum(1 for m in vlm_models if m['loaded']),
+            'backend': backend.describe(),
+            'upload_limits': {
+                'max_files': MAX_UPLOAD_FILES,
+                'max_total_mb': MAX_UPLOAD_TOTAL_MB,
+                'max_pack_size': MAX_PACK_SIZE,
+                'max_request_mb': MAX_REQUEST_MB
+            }
         })
     except requests.exceptions.Timeout:
         return jsonify({
             'status': 'error',
-            'message': 'Таймаут подключения к корпоративному API'
+            'message': f'Таймаут подключения: {backend.title}'
         }), 504
     except requests.exceptions.ConnectionError:
         return jsonify({
             'status': 'error',
-            'message': 'Не удалось подключиться к корпоративному API'
+            'message': f'Не удалось подключиться: {backend.title}'
         }), 503
     except Exception as e:
         return jsonify({
             'status': 'error',
-            'message': f'Корпоративный API недоступен: {str(e)}'
+            'message': f'{backend.title} недоступен: {str(e)}'
         }), 500
 
 @app.route('/api/check-models', methods=['GET'])
 def check_models():
-    """Проверка доступности моделей в корпоративном API"""
+    """Проверка доступности моделей текущего бэкенда"""
     try:
-        # В корпоративном API все модели всегда доступны
+        model_names = backend.model_names()
+        active_models = backend.active_models()
         available_models = []
-        for model_name in MODELS:
+        for model_name in model_names:
             available_models.append({
                 'name': model_name,
-                'short_name': model_name.split('/')[1] if '/' in model_name else model_name,
+                'short_name': short_model_name(model_name),
                 'available': True,
-                'currently_loaded': True  # Все модели доступны
+                'currently_loaded': model_name in active_models
             })
         
         return jsonify({
             'status': 'ok',
             'models': available_models,
-            'loaded_count': len(MODELS),
-            'total_count': len(MODELS),
-            'all_loaded': True,
-            'current_model': MODELS[0],
+            'loaded_count': len(active_models),
+            'total_count': len(model_names),
+            'all_loaded': len(active_models) == len(model_names),
+            'current_model': active_models[0] if active_models else None,
             'auto_switching': True,
-            'note': 'Все модели доступны в корпоративном API'
+            'backend': backend.describe(),
+            'note': 'Все модели доступны' if len(active_models) == len(model_names) else 'Модели будут загружены при анализе'
         })
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': str(e),
-            'suggestion': 'Проверьте подключение к корпоративному API'
+            'suggestion': f'Проверьте подключение: {backend.title}'
         }), 500
 
 @app.route('/api/active-model', methods=['GET'])
 def get_active_model():
     """Получить текущую активную модель"""
     try:
-        current = get_loaded_model()
+        active_models = backend.active_models()
+        current = active_models[0] if active_models else None
         
         return jsonify({
             'success': True,
             'active_model': current,
-            'active_model_short': current.split('/')[1] if current and '/' in current else current,
-            'available_models': MODELS,
-            'manual_switching_required': False,  # В корпоративном API переключение автоматическое
+            'active_model_short': short_model_name(current),
+            'active_models': active_models,
+            'available_models': backend.model_names(),
+            'manual_switching_required': False,  # Модели переключаются бэкендом автоматически
             'instructions': {}
         })
     except Exception as e:
@@ -335,18 +826,23 @@ def get_active_model():
 
 @app.route('/api/load-model', methods=['POST'])
 def api_load_model():
-    """В корпоративном API модели всегда доступны"""
+    """Проверка доступности модели перед обработкой
+
+    Локальные бэкенды загружают модель при первом запросе к ней (один раз
+    на пакет), поэтому здесь модель только проверяется, а не загружается.
+    """
     data = request.get_json()
     model_id = data.get('model_id')
     
     if not model_id:
         return jsonify({'success': False, 'error': 'model_id обязателен'}), 400
     
-    if model_id in MODELS:
+    if backend.is_available(model_id):
+        already_loaded = model_id in backend.active_models()
         return jsonify({
             'success': True,
-            'message': f'Модель {model_id} доступна в корпоративном API',
-            'already_loaded': True
+            'message': f'Модель {model_id} доступна' + ('' if already_loaded else ' и будет загружена при анализе'),
+            'already_loaded': already_loaded
         })
     else:
         return jsonify({
@@ -356,18 +852,290 @@ def api_load_model():
 
 @app.route('/api/unload-model', methods=['POST'])
 def api_unload_model():
-    """В корпоративном API выгрузка не требуется"""
+    """Выгрузка модели (для бэкендов без загрузки - ничего не делает)"""
     data = request.get_json()
     model_id = data.get('model_id')
     
     if not model_id:
         return jsonify({'success': False, 'error': 'model_id обязателен'}), 400
     
+    if not backend.capabilities()['load_unload']:
+        return jsonify({
+            'success': True,
+            'message': f'Модель {model_id} доступна: {backend.title}, выгрузка не требуется',
+            'already_unloaded': True
+        })
+    
+    unloaded = backend.unload(model_id)
     return jsonify({
+        'success': unloaded,
+        'message': f'Модель {model_id} выгружена' if unloaded else f'Не удалось выгрузить модель {model_id}'
+    })
+
+def save_upload(file):
+    """Сохраняет загруженный файл под уникальным именем, возвращает (filename, filepath)
+
+    Уникальное имя нужно, т.к. одно и то же изображение может одновременно
+    обрабатываться несколькими моделями. Расширение берётся из MIME-типа
+    загрузки: браузер может перекодировать файл (например, PNG -> WebP),
+    сохранив исходное имя. Исходное имя возвращается для сопоставления
+    с ground truth на клиенте.
+    """
+    ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
+    mime_ext = (file.mimetype or '').split('/')[-1].lower()
+    if mime_ext == 'jpeg':
+        mime_ext = 'jpg'
+    if mime_ext in ALLOWED_EXTENSIONS:
+        ext = mime_ext
+
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{secure_filename(file.filename) or 'image'}.{ext}")
+    file.save(filepath)
+    return file.filename, filepath
+
+def build_result_entry(index, filename, result, model_name, mode, ground_truth, classification_settings):
+    """Формирует элемент списка results для ответа /api/analyze и /api/analyze-batch"""
+    if "error" in result:
+        return {
+            'index': index,
+            'filename': filename,
+            'success': False,
+            'error': result["error"],
+            'current_loaded': result.get("current_loaded"),
+            'requires_manual_switch': result.get("requires_manual_load", False),
+            'cancelled': result.get("cancelled", False),
+            'context_exceeded': result.get("context_exceeded", False)
+        }
+
+    # Определяем правильность ответа в режиме классификации
+    # (в комбинированном режиме проверяется классификационная часть ответа)
+    is_correct = None
+    if mode in ('classification', 'combined') and ground_truth:
+        is_correct = matcher_for(classification_settings).is_correct(
+            result.get('classification', result.get('entity', '')), ground_truth
+        )
+
+    return {
+        'index': index,
+        'filename': filename,
         'success': True,
-        'message': f'Модель {model_id} доступна в корпоративном API',
-        'already_unloaded': True
+        'entity': result.get('entity', 'N/A'),
+        'classification': result.get('classification'),
+        'combined_fallback': result.get('combined_fallback', False),
+        'processing_time': result.get('processing_time', 0),
+        'tokens_per_second': result.get('tokens_per_second'),
+        'total_tokens': result.get('total_tokens'),
+        'prompt_tokens': result.get('prompt_tokens'),
+        'completion_tokens': result.get('completion_tokens'),
+        'model': model_name,
+        'mode': mode,
+        'classification_correct': is_correct,
+        'ground_truth': ground_truth if mode in ('classification', 'combined') else None,
+        'near_duplicate_of': result.get('near_duplicate_of'),
+        'hamming_distance': result.get('hamming_distance'),
+        'packed': result.get('packed', False),
+        'pack_size': result.get('pack_size', 1),
+        'resolution': result.get('resolution'),
+        'cascade_escalated': result.get('cascade_escalated', False),
+        'escalation_reason': result.get('escalation_reason'),
+        'low_res_answer': result.get('low_res_answer'),
+        'positive_probability': result.get('positive_probability'),
+        'scoring': result.get('scoring')
+    }
+
+def parse_analysis_options(form):
+    """Разбирает общие параметры анализа из формы запроса"""
+    mode = form.get('mode', 'description')
+    classification_settings = None
+    if mode in ('classification', 'combined'):
+        classification_settings = {
+            'positiveClass': form.get('positiveClass', 'Самолет'),
+            'negativeClass': form.get('negativeClass', 'Не самолет'),
+            # Синонимы классов через запятую - учитываются при проверке ответов
+            'positiveSynonyms': form.get('positiveSynonyms', ''),
+            'negativeSynonyms': form.get('negativeSynonyms', '')
+        }
+        # Оценка вероятности одним токеном (только для чистой классификации)
+        if mode == 'classification':
+            classification_settings['scoring'] = form.get('scoring', 'false') == 'true'
+
+    near_duplicate_threshold = None
+    if form.get('reuseNearDuplicates', 'false') == 'true':
+        near_duplicate_threshold = int(form.get('nearDuplicateThreshold', NEAR_DUPLICATE_THRESHOLD))
+
+    return mode, classification_settings, near_duplicate_threshold
+
+def parse_cascade_size(form):
+    """Размер уменьшенной копии для каскада или None, если каскад выключен"""
+    if form.get('cascade', 'false') != 'true':
+        return None
+    return max(32, int(form.get('cascadeSize') or CASCADE_LOW_RES_SIZE))
+
+def parse_job_options(form, work):
+    """Параметры задания клиента для текущего HTTP-запроса (аргументы jobs.begin)
+
+    jobId связывает запросы одного запуска (его можно отменить через
+    /api/jobs/<jobId>/cancel), jobDeadline и requestDeadline - лимиты
+    времени задания и запроса в секундах, tenant - чья очередь в
+    справедливой очереди. Приоритет решает сервер, а не клиент: по
+    приоритетной полосе идёт только разовая проверка - одно изображение
+    одной моделью (work - число пар изображение x модель в запросе).
+    """
+    job_deadline = float(form.get('jobDeadline') or 0) or None
+    request_deadline = float(form.get('requestDeadline') or 0) or REQUEST_DEADLINE or None
+    # Пользователь - идентификатор клиента из браузера, иначе адрес
+    tenant = form.get('tenant') or request.headers.get('X-Tenant-Id') or request.remote_addr or 'anonymous'
+    interactive = work == 1
+    return {
+        'job_id': form.get('jobId'),
+        'job_deadline': job_deadline,
+        'request_deadline': request_deadline,
+        'tenant': tenant,
+        'interactive': interactive
+    }
+
+def overload_response(retry_after):
+    """Ответ 429 с заголовком Retry-After"""
+    response = jsonify({
+        'success': False,
+        'error': f'Сервер перегружен, повторите через {retry_after} с',
+        'retry_after': retry_after
     })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def admit_work(work):
+    """Контроль допуска: None, если запрос принят, иначе ответ 429 с Retry-After"""
+    admitted, retry_after = admission.try_admit(work)
+    if admitted:
+        return None
+    print(f"⚠ Перегрузка: запрос на {work} ед. работы отклонён, повтор через {retry_after} с")
+    return overload_response(retry_after)
+
+# Эндпоинты, чьи тела (изображения) учитываются в бюджете памяти при разборе
+UPLOAD_ENDPOINTS = {'analyze_image', 'analyze_batch', 'analyze_ensemble'}
+
+@app.before_request
+def reserve_upload_memory():
+    """Резервирует память под тело загрузки до его разбора (или отвечает 429)"""
+    if request.endpoint not in UPLOAD_ENDPOINTS:
+        return None
+    nbytes = request.content_length or 0
+    if not memory_budget.acquire(nbytes, timeout=MEMORY_WAIT_SECONDS):
+        print(f"⚠ Нет памяти под загрузку {nbytes / 1024 ** 2:.1f} МБ, запрос отклонён")
+        return overload_response(max(1, math.ceil(MEMORY_WAIT_SECONDS)))
+    g.upload_memory = nbytes
+    return None
+
+def release_upload_memory():
+    """Освобождает резерв под тело загрузки - после сохранения файлов на диск"""
+    nbytes = g.pop('upload_memory', 0)
+    if nbytes:
+        memory_budget.release(nbytes)
+
+@app.teardown_request
+def release_upload_memory_on_teardown(error=None):
+    release_upload_memory()
+
+@app.errorhandler(413)
+def request_too_large(error):
+    """Слишком большое тело запроса - JSON-ответ вместо HTML-страницы Flask"""
+    return jsonify({
+        'success': False,
+        'error': f'Запрос больше {MAX_REQUEST_MB:g} МБ - уменьшите пачку или включите сжатие изображений'
+    }), 413
+
+def image_features(filepath):
+    """(пиксели, байты) файла изображения; размеры читаются из заголовка без декодирования"""
+    from PIL import Image
+
+    nbytes = os.path.getsize(filepath)
+    try:
+        with Image.open(filepath) as image:
+            width, height = image.size
+        return width * height, nbytes
+    except Exception:
+        return None, nbytes
+
+def model_max_context(model_name):
+    """Размер контекста модели из каталога (0 - неизвестен)"""
+    return next((model.get('max_context', 0) for model in backend.catalog() if model['id'] == model_name), 0)
+
+def analyze_saved_images(uploads, model_name, mode, classification_settings, near_duplicate_threshold=None, pack_size=1, index_variant=None, job=None):
+    """Анализирует сохранённые файлы [(filename, filepath)], возвращает список результатов
+
+    После отмены задания (job) оставшиеся изображения не отправляются.
+    """
+    results = [None] * len(uploads)
+    hashes = [None] * len(uploads)
+    near_duplicate_index = None
+
+    # Почти-дубликаты: переиспользуем результат уже обработанного похожего изображения
+    if near_duplicate_threshold is not None:
+        tenant = job.tenant if job else 'anonymous'
+        near_duplicate_index = get_near_duplicate_index(tenant, model_name, mode, classification_settings, index_variant)
+        for i, (filename, filepath) in enumerate(uploads):
+            try:
+                hashes[i] = upload_hash(filepath)
+            except Exception as e:
+                print(f"⚠ Не удалось вычислить перцептивный хеш для {filename}: {e}")
+                continue
+            results[i] = find_near_duplicate_result(hashes[i], near_duplicate_index, near_duplicate_threshold)
+            if results[i] is not None:
+                print(f"♻ {filename}: почти-дубликат {results[i]['near_duplicate_of']} (расстояние {results[i]['hamming_distance']})")
+
+    # Остальные изображения отправляем пачками по pack_size в одном запросе
+    # (комбинированный режим и оценка вероятности всегда идут по одному изображению)
+    scoring = mode == 'classification' and bool(classification_settings and classification_settings.get('scoring'))
+    if mode == 'combined' or scoring:
+        pack_size = 1
+
+    # Изображения, которые по прогнозу не поместятся в контекст модели, не отправляем
+    features = {i: image_features(uploads[i][1]) for i, result in enumerate(results) if result is None}
+    max_context = model_max_context(model_name)
+    for i, (pixels, nbytes) in features.items():
+        predicted = cost_predictor.check_context(model_name, pixels, nbytes, max_context)
+        if predicted is not None:
+            print(f"✗ {uploads[i][0]}: ~{predicted} токенов не помещается в контекст {model_name} ({max_context})")
+            results[i] = {
+                "error": f"Изображение не поместится в контекст модели: ~{predicted} токенов при лимите {max_context}",
+                "context_exceeded": True,
+                "predicted_prompt_tokens": predicted
+            }
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    for start in range(0, len(pending), max(pack_size, 1)):
+        chunk = pending[start:start + max(pack_size, 1)]
+        chunk_paths = [uploads[i][1] for i in chunk]
+        try:
+            if job is not None:
+                job.check()
+        except JobCancelledError as e:
+            for i in pending[start:]:
+                results[i] = job_cancelled_error(e)
+            break
+
+        if mode == 'combined':
+            chunk_results = [get_combined_from_image(chunk_paths[0], model_name, classification_settings, job)]
+        elif scoring:
+            chunk_results = [get_score_from_image(chunk_paths[0], model_name, classification_settings, job)]
+        elif len(chunk) == 1:
+            chunk_results = [get_entity_from_image(chunk_paths[0], model_name, mode, classification_settings, job)]
+        else:
+            chunk_results = get_entities_from_images_packed(chunk_paths, model_name, mode, classification_settings, job)
+
+        # Регрессию учим только на одиночных запросах: в пачке и комбинированном
+        # режиме prompt_tokens относятся к нескольким изображениям или запросам
+        if len(chunk) == 1 and mode != 'combined' and "error" not in chunk_results[0] and chunk_results[0].get("prompt_tokens"):
+            pixels, nbytes = features[chunk[0]]
+            cost_predictor.observe(model_name, pixels, nbytes, chunk_results[0]["prompt_tokens"], chunk_results[0]["processing_time"])
+
+        for i, result in zip(chunk, chunk_results):
+            results[i] = result
+            if hashes[i] is not None and "error" not in result:
+                near_duplicate_index.add(hashes[i], {'filename': uploads[i][0], 'result': result})
+
+    return results
 
 @app.route('/api/analyze', methods=['POST'])
 def analyze_image():
@@ -377,10 +1145,13 @@ def analyze_image():
     
     file = request.files['image']
     model_name = request.form.get('model')
-    mode = request.form.get('mode', 'description')
-    positive_class = request.form.get('positiveClass', 'Самолет')
-    negative_class = request.form.get('negativeClass', 'Не самолет')
     ground_truth = request.form.get('groundTruth', '')  # Для режима классификации
+    try:
+        mode, classification_settings, near_duplicate_threshold = parse_analysis_options(request.form)
+        cascade_size = parse_cascade_size(request.form)
+        job_options = parse_job_options(request.form, 1)
+    except ValueError:
+        return jsonify({'error': 'Некорректные параметры анализа'}), 400
     
     if file.filename == '':
         return jsonify({'error': 'Файл не выбран'}), 400
@@ -389,86 +1160,31 @@ def analyze_image():
         return jsonify({'error': 'Модель не указана'}), 400
     
     # Проверяем модель
-    if model_name not in MODELS:
+    if not backend.is_available(model_name):
         return jsonify({'error': f'Модель {model_name} не поддерживается'}), 400
+
+    rejection = admit_work(1)
+    if rejection is not None:
+        return rejection
+    job = jobs.begin(**job_options)
+    disconnect_watcher.watch(request.environ, job)
     
     try:
         # Сохраняем файл
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        filename, filepath = save_upload(file)
+        release_upload_memory()
         
         try:
-            # Настройки классификации
-            classification_settings = None
-            if mode == 'classification':
-                classification_settings = {
-                    'positiveClass': positive_class,
-                    'negativeClass': negative_class
-                }
-            
             # Анализируем изображение выбранной моделью
-            result = get_entity_from_image(filepath, model_name, mode, classification_settings)
-            
-            if "error" in result:
-                response_data = {
-                    'success': False,
-                    'results': [{
-                        'index': 0,
-                        'filename': filename,
-                        'success': False,
-                        'error': result["error"],
-                        'current_loaded': result.get("current_loaded"),
-                        'requires_manual_switch': result.get("requires_manual_load", False)
-                    }]
-                }
+            if cascade_size:
+                result = run_cascade([(filename, filepath)], [model_name], mode, classification_settings, cascade_size, near_duplicate_threshold, job=job)[0][model_name][0]
             else:
-                # Определяем правильность ответа в режиме классификации
-                is_correct = None
-                if mode == 'classification' and ground_truth:
-                    entity_lower = result.get('entity', '').lower().strip()
-                    positive_lower = positive_class.lower().strip()
-                    negative_lower = negative_class.lower().strip()
-                    
-                    print(f"[DEBUG] Classification check:")
-                    print(f"  Entity: '{entity_lower}'")
-                    print(f"  Ground truth: '{ground_truth}'")
-                    print(f"  Positive class: '{positive_lower}'")
-                    print(f"  Negative class: '{negative_lower}'")
-                    
-                    # Логика: проверяем, к какому классу ближе ответ модели
-                    if ground_truth == 'positive':
-                        # Ожидаем положительный класс
-                        # Проверяем, что ответ больше похож на положительный класс
-                        positive_match = positive_lower in entity_lower and not (negative_lower in entity_lower and entity_lower.startswith(negative_lower.split()[0]))
-                        is_correct = positive_match
-                    elif ground_truth == 'negative':
-                        # Ожидаем отрицательный класс
-                        # Проверяем, что ответ больше похож на отрицательный класс
-                        negative_match = negative_lower in entity_lower or entity_lower.startswith(negative_lower.split()[0])
-                        is_correct = negative_match
-                    else:
-                        is_correct = False
-                    
-                    print(f"  Result: is_correct = {is_correct}")
-                
-                
-                response_data = {
-                    'success': True,
-                    'results': [{
-                        'index': 0,
-                        'filename': filename,
-                        'success': True,
-                        'entity': result.get('entity', 'N/A'),
-                        'processing_time': result.get('processing_time', 0),
-                        'tokens_per_second': result.get('tokens_per_second'),
-                        'total_tokens': result.get('total_tokens'),
-                        'model': model_name,
-                        'mode': mode,
-                        'classification_correct': is_correct,
-                        'ground_truth': ground_truth if mode == 'classification' else None
-                    }]
-                }
+                result = analyze_saved_images([(filename, filepath)], model_name, mode, classification_settings, near_duplicate_threshold, job=job)[0]
+            entry = build_result_entry(0, filename, result, model_name, mode, ground_truth, classification_settings)
+            response_data = {
+                'success': entry['success'],
+                'results': [entry]
+            }
                 
         except Exception as e:
             response_data = {
@@ -482,8 +1198,7 @@ def analyze_image():
             }
         finally:
             # Удаляем временный файл
-            if os.path.exists(filepath):
-                os.remove(filepath)
+            remove_upload(filepath)
         
         return jsonify(response_data)
         
@@ -492,6 +1207,385 @@ def analyze_image():
             'success': False,
             'error': str(e)
         }), 500
+    finally:
+        admission.release(1, completed=not job.cancelled)
+        disconnect_watcher.unwatch(job)
+        job.close()
+
+@app.route('/api/analyze-batch', methods=['POST'])
+def analyze_batch():
+    """Анализ нескольких изображений с упаковкой в общие запросы
+
+    packSize изображений отправляются в одном сообщении; groundTruth передаётся
+    JSON-словарём filename -> 'positive' / 'negative'. Вместо model можно
+    передать models (JSON-список) - тогда пакет прогоняется всеми моделями
+    через batch_infer бэкенда (локальные модели загружаются по одному разу).
+    cascade=true включает каскад разрешений (см. run_cascade).
+    """
+    files = request.files.getlist('images')
+
+    if not files or any(file.filename == '' for file in files):
+        return jsonify({'error': 'Изображения не найдены'}), 400
+
+    try:
+        model_names = json.loads(request.form['models']) if request.form.get('models') else [request.form.get('model')]
+        mode, classification_settings, near_duplicate_threshold = parse_analysis_options(request.form)
+        pack_size = max(1, min(int(request.form.get('packSize', DEFAULT_PACK_SIZE)), MAX_PACK_SIZE))
+        cascade_size = parse_cascade_size(request.form)
+        ground_truth_data = json.loads(request.form.get('groundTruth') or '{}')
+        job_options = parse_job_options(request.form, len(files) * len(model_names))
+    except ValueError:
+        return jsonify({'error': 'Некорректные параметры пакетного анализа'}), 400
+
+    if not model_names or not all(model_names):
+        return jsonify({'error': 'Модель не указана'}), 400
+
+    unsupported = [model_name for model_name in model_names if not backend.is_available(model_name)]
+    if unsupported:
+        return jsonify({'error': f'Модель {unsupported[0]} не поддерживается'}), 400
+
+    work = len(files) * len(model_names)
+    rejection = admit_work(work)
+    if rejection is not None:
+        return rejection
+    job = jobs.begin(**job_options)
+    disconnect_watcher.watch(request.environ, job)
+
+    uploads = []
+    try:
+        for file in files:
+            uploads.append(save_upload(file))
+        release_upload_memory()
+
+        if cascade_size:
+            results_by_model, scheduler_stats = run_cascade(
+                uploads, model_names, mode, classification_settings, cascade_size, near_duplicate_threshold, pack_size, job
+            )
+        else:
+            results_by_model, scheduler_stats = backend.batch_infer(
+                model_names,
+                len(uploads),
+                lambda model_name: analyze_saved_images(uploads, model_name, mode, classification_settings, near_duplicate_threshold, pack_size, job=job),
+                job
+            )
+        entries = [
+            build_result_entry(i, filename, result, model_name, mode, ground_truth_data.get(filename, ''), classification_settings)
+            for model_name in model_names
+            for i, ((filename, _), result) in enumerate(zip(uploads, results_by_model[model_name]))
+        ]
+
+        return jsonify({
+            'success': any(entry['success'] for entry in entries),
+            'results': entries,
+            'pack_size': pack_size,
+            'scheduler_stats': scheduler_stats
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+    finally:
+        admission.release(work, completed=not job.cancelled)
+        disconnect_watcher.unwatch(job)
+        job.close()
+        # Удаляем временные файлы
+        for _, filepath in uploads:
+            remove_upload(filepath)
+
+def answer_label(result, mode, classification_settings):
+    """Метка ответа для голосования ансамбля
+
+    В режимах с классификацией - 'positive' / 'negative' (или None, если ответ
+    не похож ни на один класс), в режиме описания - нормализованный ответ,
+    как при сравнении ответов в /api/model-comparison.
+    """
+    if "error" in result:
+        return None
+    if mode in ('classification', 'combined'):
+        return matcher_for(classification_settings).match(result.get('classification') or result.get('entity', ''))
+    return normalize_answer(result.get('entity')) or None
+
+def run_quorum_ensemble(uploads, model_names, mode, classification_settings, quorum, near_duplicate_threshold=None, pack_size=1, job=None):
+    """Ансамбль с ранней остановкой: модели вызываются в порядке приоритета,
+    пока quorum моделей не согласятся.
+
+    Первая волна - первые quorum моделей по всем изображениям, дальше по одной
+    следующей модели только для изображений без кворума. Изображение выбывает,
+    когда кворум набран или уже недостижим оставшимися моделями. Волны идут
+    через batch_infer бэкенда, поэтому работают упаковка и почти-дубликаты.
+    Возвращает (results[i][model_name], votes[i][label], consensus[i] или None).
+    """
+    results = [{} for _ in uploads]
+    votes = [{} for _ in uploads]
+    consensus = [None] * len(uploads)
+    undecided = list(range(len(uploads)))
+    wave = model_names[:quorum]
+    next_model = len(wave)
+
+    while undecided and wave:
+        subset = [uploads[i] for i in undecided]
+        by_model, _ = backend.batch_infer(
+            wave,
+            len(subset),
+            lambda model_name: analyze_saved_images(subset, model_name, mode, classification_settings, near_duplicate_threshold, pack_size, job=job),
+            job
+        )
+        for model_name in wave:
+            for i, result in zip(undecided, by_model[model_name]):
+                results[i][model_name] = result
+                label = answer_label(result, mode, classification_settings)
+                if label is not None:
+                    votes[i][label] = votes[i].get(label, 0) + 1
+
+        remaining = len(model_names) - next_model
+        still_undecided = []
+        for i in undecided:
+            leader = max(votes[i], key=votes[i].get) if votes[i] else None
+            leader_votes = votes[i].get(leader, 0)
+            if leader_votes >= quorum:
+                consensus[i] = leader
+            elif leader_votes + remaining >= quorum:
+                still_undecided.append(i)
+        undecided = still_undecided
+        wave = model_names[next_model:next_model + 1]
+        next_model += len(wave)
+
+    return results, votes, consensus
+
+def make_low_res_copy(filepath, max_side):
+    """Сохраняет уменьшенную копию изображения для первого прохода каскада
+
+    Возвращает путь к копии или None, если изображение и так не больше max_side.
+    """
+    from PIL import Image
+
+    with Image.open(filepath) as image:
+        if max(image.size) <= max_side:
+            return None
+        # draft() позволяет JPEG-декодеру сразу декодировать в уменьшенном масштабе
+        image.draft('RGB', (max_side, max_side))
+        # Декодированные пиксели (RGB) учитываются в бюджете памяти
+        with memory_budget.reserve(image.size[0] * image.size[1] * 3):
+            small = image.convert('RGB')
+            small.thumbnail((max_side, max_side), Image.LANCZOS)
+            low_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_low.jpg")
+            small.save(low_path, 'JPEG', quality=85)
+    return low_path
+
+def escalation_reason(result, mode, classification_settings):
+    """Почему ответ по уменьшенной копии нужно перепроверить в полном разрешении (или None)"""
+    if "error" in result:
+        return 'error'
+    if mode in ('classification', 'combined') and answer_label(result, mode, classification_settings) is None:
+        return 'no_class_match'
+    # При оценке вероятности неуверенность видна по самой вероятности
+    probability = result.get('positive_probability')
+    if probability is not None and abs(probability - 0.5) < SCORING_UNCERTAIN_MARGIN:
+        return 'low_confidence'
+    answer = (result.get('classification') or result.get('entity') or '').lower()
+    if any(marker in answer for marker in LOW_CONFIDENCE_MARKERS):
+        return 'low_confidence'
+    return None
+
+def merge_cascade_results(low_result, full_result, reason):
+    """Итог после эскалации: ответ полного разрешения, время и токены обоих проходов"""
+    if "error" in full_result:
+        return full_result
+
+    merged = dict(full_result)
+    if "error" not in low_result:
+        merged["processing_time"] = round(full_result.get("processing_time", 0) + low_result.get("processing_time", 0), 3)
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            if key in full_result or key in low_result:
+                merged[key] = full_result.get(key, 0) + low_result.get(key, 0)
+        merged.pop("tokens_per_second", None)
+        if merged["processing_time"] > 0 and merged.get("completion_tokens", 0) > 0:
+            merged["tokens_per_second"] = round(merged["completion_tokens"] / merged["processing_time"], 2)
+        merged["low_res_answer"] = low_result.get("classification") or low_result.get("entity")
+    merged["resolution"] = 'full'
+    merged["cascade_escalated"] = True
+    merged["escalation_reason"] = reason
+    return merged
+
+def run_cascade(uploads, model_names, mode, classification_settings, low_res_size, near_duplicate_threshold=None, pack_size=1, job=None):
+    """Каскад разрешений: сначала уменьшенная копия, полное разрешение - только при сомнениях
+
+    Изображение перепроверяется в полном разрешении моделью, если её ответ
+    ошибочный, не совпал ни с одним классом или неуверенный, а в режимах с
+    классификацией - ещё и всеми моделями, если они разошлись в ответах.
+    В каждом результате записано, каким разрешением получен ответ.
+    Возвращает (results[model_name], статистика проходов).
+    """
+    low_paths = []
+    try:
+        for filename, filepath in uploads:
+            try:
+                low_paths.append(make_low_res_copy(filepath, low_res_size))
+            except Exception as e:
+                print(f"⚠ Не удалось уменьшить {filename}, используем оригинал: {e}")
+                low_paths.append(None)
+        low_uploads = [(filename, low_path or filepath) for (filename, filepath), low_path in zip(uploads, low_paths)]
+
+        low_results, low_stats = backend.batch_infer(
+            model_names,
+            len(uploads),
+            lambda model_name: analyze_saved_images(low_uploads, model_name, mode, classification_settings, near_duplicate_threshold, pack_size, f'low-{low_res_size}', job),
+            job
+        )
+    finally:
+        for low_path in low_paths:
+            if low_path:
+                remove_upload(low_path)
+
+    escalate = {model_name: {} for model_name in model_names}
+    for i, low_path in enumerate(low_paths):
+        if low_path is None:
+            # Изображение и так маленькое - ответ уже получен в полном разрешении
+            continue
+        labels = {answer_label(low_results[m][i], mode, classification_settings) for m in model_names}
+        disagreement = mode in ('classification', 'combined') and len(labels) > 1
+        for model_name in model_names:
+            reason = escalation_reason(low_results[model_name][i], mode, classification_settings)
+            if reason or disagreement:
+                escalate[model_name][i] = reason or 'disagreement'
+
+    def escalate_model(model_name):
+        indexes = sorted(escalate[model_name])
+        full_results = analyze_saved_images([uploads[i] for i in indexes], model_name, mode, classification_settings, near_duplicate_threshold, pack_size, job=job)
+        combined = list(low_results[model_name])
+        for i, result in zip(indexes, full_results):
+            combined[i] = result
+        return combined
+
+    escalated_models = [model_name for model_name in model_names if escalate[model_name]]
+    full_stats = None
+    if escalated_models:
+        full_pass, full_stats = backend.batch_infer(escalated_models, len(uploads), escalate_model, job)
+
+    results = {}
+    for model_name in model_names:
+        results[model_name] = []
+        for i, low_result in enumerate(low_results[model_name]):
+            if i in escalate[model_name]:
+                results[model_name].append(merge_cascade_results(low_result, full_pass[model_name][i], escalate[model_name][i]))
+            else:
+                result = dict(low_result)
+                result["resolution"] = 'low' if low_paths[i] else 'full'
+                result["cascade_escalated"] = False
+                results[model_name].append(result)
+
+    return results, {
+        'low_res_size': low_res_size,
+        'low_res': low_stats,
+        'full_res': full_stats,
+        'escalated': {model_name: len(escalate[model_name]) for model_name in model_names}
+    }
+
+@app.route('/api/ensemble', methods=['POST'])
+def analyze_ensemble():
+    """Ансамбль моделей с остановкой по кворуму
+
+    models - JSON-список моделей в порядке приоритета, quorum - сколько
+    моделей должны дать одинаковый ответ (по умолчанию большинство).
+    Модели, до которых не дошла очередь, перечисляются в models_skipped.
+    """
+    files = request.files.getlist('images')
+
+    if not files or any(file.filename == '' for file in files):
+        return jsonify({'error': 'Изображения не найдены'}), 400
+
+    try:
+        model_names = json.loads(request.form.get('models') or '[]')
+        mode, classification_settings, near_duplicate_threshold = parse_analysis_options(request.form)
+        pack_size = max(1, min(int(request.form.get('packSize', 1)), MAX_PACK_SIZE))
+        quorum = int(request.form.get('quorum') or 0) or len(model_names) // 2 + 1
+        ground_truth_data = json.loads(request.form.get('groundTruth') or '{}')
+        job_options = parse_job_options(request.form, len(files) * len(model_names))
+    except ValueError:
+        return jsonify({'error': 'Некорректные параметры ансамбля'}), 400
+
+    if len(model_names) < 2:
+        return jsonify({'error': 'Для ансамбля нужно хотя бы две модели'}), 400
+
+    unsupported = [model_name for model_name in model_names if not backend.is_available(model_name)]
+    if unsupported:
+        return jsonify({'error': f'Модель {unsupported[0]} не поддерживается'}), 400
+
+    quorum = max(1, min(quorum, len(model_names)))
+
+    # Ансамбль вызывает не все модели, но место резервируется под худший случай
+    work = len(files) * len(model_names)
+    rejection = admit_work(work)
+    if rejection is not None:
+        return rejection
+    job = jobs.begin(**job_options)
+    disconnect_watcher.watch(request.environ, job)
+
+    uploads = []
+    try:
+        for file in files:
+            uploads.append(save_upload(file))
+        release_upload_memory()
+
+        results, votes, consensus = run_quorum_ensemble(
+            uploads, model_names, mode, classification_settings, quorum, near_duplicate_threshold, pack_size, job
+        )
+
+        images = []
+        for i, (filename, _) in enumerate(uploads):
+            ground_truth = ground_truth_data.get(filename, '')
+            label = consensus[i] or (max(votes[i], key=votes[i].get) if votes[i] else None)
+            if mode in ('classification', 'combined') and label in ('positive', 'negative'):
+                answer = classification_settings['positiveClass' if label == 'positive' else 'negativeClass']
+            else:
+                # Ответ первой модели с этой меткой - в исходном написании
+                answer = next(
+                    (result.get('entity') for result in results[i].values()
+                     if answer_label(result, mode, classification_settings) == label),
+                    label
+                )
+
+            images.append({
+                'index': i,
+                'filename': filename,
+                'ensemble_label': label,
+                'ensemble_answer': answer,
+                'agreed': consensus[i] is not None,
+                'votes': votes[i],
+                'ensemble_correct': label == ground_truth if ground_truth and mode in ('classification', 'combined') else None,
+                'models_called': list(results[i]),
+                'models_skipped': [model_name for model_name in model_names if model_name not in results[i]],
+                'results': [
+                    build_result_entry(i, filename, result, model_name, mode, ground_truth, classification_settings)
+                    for model_name, result in results[i].items()
+                ]
+            })
+
+        calls_made = sum(len(image['models_called']) for image in images)
+        calls_max = len(uploads) * len(model_names)
+        return jsonify({
+            'success': True,
+            'images': images,
+            'quorum': quorum,
+            'calls_made': calls_made,
+            'calls_max': calls_max,
+            'calls_saved_percent': round((1 - calls_made / calls_max) * 100, 1) if calls_max else 0
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+    finally:
+        admission.release(work, completed=not job.cancelled)
+        disconnect_watcher.unwatch(job)
+        job.close()
+        # Удаляем временные файлы
+        for _, filepath in uploads:
+            remove_upload(filepath)
 
 @app.route('/api/get-mode-settings', methods=['GET'])
 def get_mode_settings():
@@ -504,9 +1598,91 @@ def get_mode_settings():
         }
     })
 
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Отмена запуска: очередь задания очищается, идущие запросы к API прерываются
+
+    Вызывается кнопкой отмены и через navigator.sendBeacon при закрытии страницы.
+    """
+    cancelled = jobs.cancel(job_id)
+    return jsonify({'success': True, 'cancelled': cancelled})
+
+@app.route('/api/jobs/<job_id>/heartbeat', methods=['POST'])
+def job_heartbeat(job_id):
+    """Продление аренды задания: без heartbeat задание отменяется как брошенное"""
+    return jsonify({'success': True, 'active': jobs.heartbeat(job_id)})
+
+@app.route('/ready', methods=['GET'])
+def readiness():
+    """Проба готовности для балансировщика: 200 - модели прогреты, 503 - ещё нет"""
+    status = warmup.status()
+    status['catalog_source'] = backend.catalog_source
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/api/estimate', methods=['POST'])
+def estimate_run():
+    """Прогноз токенов и длительности запуска до его начала
+
+    Тело: {"models": [...], "images": [{"bytes", "width", "height"}],
+    "concurrency", "perModelConcurrency"}; размеры и байты - того файла,
+    который клиент действительно отправит (после уменьшения), без размеров
+    токены оцениваются по байтам. ETA - оценка без учёта упаковки,
+    ансамбля и каскада. model_order - порядок моделей планировщика бэкенда:
+    клиент локального бэкенда идёт по моделям в этом порядке.
+    """
+    data = request.get_json(silent=True) or {}
+    models = data.get('models') or []
+    images = data.get('images') or []
+    try:
+        concurrency = max(1, int(data.get('concurrency', 4)))
+        per_model_concurrency = max(1, int(data.get('perModelConcurrency', 2)))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Некорректные параметры оценки'}), 400
+
+    estimates = {model_name: cost_predictor.estimate(model_name, images, model_max_context(model_name)) for model_name in models}
+    latencies = [estimate['latency'] for estimate in estimates.values()]
+    eta = None
+    if latencies and None not in latencies:
+        if backend.capabilities()['parallel_requests']:
+            # Упираемся либо в лимит на модель, либо в общий лимит запросов
+            eta = max(max(latencies) / per_model_concurrency, sum(latencies) / concurrency)
+        else:
+            eta = sum(latencies)
+    tokens = [estimate['prompt_tokens'] for estimate in estimates.values()]
+    return jsonify({
+        'success': True,
+        'models': estimates,
+        'prompt_tokens': sum(tokens) if tokens and None not in tokens else None,
+        'eta_seconds': round(eta, 1) if eta is not None else None,
+        'model_order': backend.model_order(models, len(images))
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Рабочие счётчики сервера (хеджирование запросов, задания и т.п.)"""
+    metrics = {
+        'success': True,
+        'backend': backend.name,
+        'jobs': dict(jobs.stats(), **disconnect_watcher.stats()),
+        'admission': admission.stats(),
+        'memory': memory_budget.stats(),
+        'scheduler': fair_scheduler.stats() if fair_scheduler else None,
+        'warmup': warmup.status(),
+        'cost_model': cost_predictor.stats(),
+        'startup': {
+            'init_seconds': STARTUP_SECONDS,
+            'catalog_source': backend.catalog_source
+        }
+    }
+    metrics.update(backend.metrics())
+    return jsonify(metrics)
+
 @app.route('/api/model-comparison', methods=['POST'])
 def get_model_comparison():
     """Вычисляет метрики сравнения моделей на основе результатов анализа"""
+    import numpy as np
+    from classification_metrics import score_report, confusion_report, mcnemar_tests, agreement_counts, MISSING
+
     data = request.get_json()
     results = data.get('results', [])
     mode = data.get('mode', 'description')
@@ -517,34 +1693,72 @@ def get_model_comparison():
         return jsonify({'error': 'Необходимо предоставить результаты анализа'}), 400
 
     try:
-        # Группируем результаты по изображениям
-        image_results = {}
-        model_names = set()
+        def entity(result):
+            # В комбинированном режиме сравниваем классификационную часть ответа
+            if mode == 'combined':
+                return result.get('classification') or result.get('entity') or ''
+            return result.get('entity') or ''
 
+        # Каждый результат - ячейка матрицы изображения x модели. Поля всех
+        # результатов извлекаются за один проход в строки таблицы, дальше все
+        # метрики считаются по столбцам матриц.
+        # Коды нормализованных ответов (-1 - нет ответа); каждый различный
+        # ответ нормализуется один раз, 'Самолёт' и 'самолет' - один код
+        image_index = {}
+        model_index = {}
+        answers = {}
+        raw_answer_codes = {}
+        rows = []
         for result in results:
-            image_name = result.get('filename', 'unknown')
-            model_name = result.get('model', 'unknown')
-            entity = result.get('entity', '')
-            success = result.get('success', False)
-
-            model_names.add(model_name)
-
-            if image_name not in image_results:
-                image_results[image_name] = {}
-
-            image_results[image_name][model_name] = {
-                'entity': entity,
-                'success': success,
-                'processing_time': result.get('processing_time', 0),
-                'tokens_per_second': result.get('tokens_per_second', 0),
-                'total_tokens': result.get('total_tokens', 0)
-            }
+            succeeded = bool(result.get('success', False))
+            code = -1
+            if succeeded:
+                raw = entity(result)
+                if raw not in raw_answer_codes:
+                    raw_answer_codes[raw] = answers.setdefault(normalize_answer(raw), len(answers))
+                code = raw_answer_codes[raw]
+            probability = result.get('positive_probability')
+            rows.append((
+                image_index.setdefault(result.get('filename', 'unknown'), len(image_index)),
+                model_index.setdefault(result.get('model', 'unknown'), len(model_index)),
+                succeeded,
+                code,
+                result.get('processing_time') or 0,
+                result.get('tokens_per_second') or 0,
+                result.get('total_tokens') or 0,
+                result.get('resolution') or '',
+                np.nan if probability is None else probability
+            ))
+        table = np.array(rows, dtype=[
+            ('image', np.int64), ('model', np.int64), ('success', bool), ('code', np.int64),
+            ('processing_time', np.float64), ('tokens_per_second', np.float64), ('total_tokens', np.int64),
+            ('resolution', 'U8'), ('probability', np.float64)
+        ])
+
+        model_names = sorted(model_index)
+        sorted_position = np.empty(len(model_names), dtype=np.int64)
+        sorted_position[[model_index[name] for name in model_names]] = np.arange(len(model_names))
+        columns = sorted_position[table['model']]
+        image_names = list(image_index)
+        shape = (len(image_names), len(model_names))
+
+        def matrix(values, fill):
+            # Повторный результат для той же пары изображение/модель заменяет предыдущий
+            cells = np.full(shape, fill, dtype=values.dtype)
+            cells[table['image'], columns] = values
+            return cells
 
-        model_names = sorted(list(model_names))
+        success = matrix(table['success'], False)
+        codes = np.where(success, matrix(table['code'], -1), -1)
+        processing_times = matrix(table['processing_time'], 0.0)
+        tokens_per_second = matrix(table['tokens_per_second'], 0.0)
+        total_tokens = matrix(table['total_tokens'], 0)
+        resolved = success & matrix(table['resolution'] != '', False)
+        low_resolution = success & matrix(table['resolution'] == 'low', False)
 
         # Вычисляем метрики сравнения
         comparison_metrics = {
-            'total_images': len(image_results),
+            'total_images': len(image_names),
             'models_compared': len(model_names),
             'model_names': model_names,
             'agreement_matrix': [],
@@ -553,7 +1767,7 @@ def get_model_comparison():
         }
 
         # Для режима классификации добавляем информацию о правильности ответов
-        if mode == 'classification':
+        if mode in ('classification', 'combined'):
             positive_class = classification_settings.get('positiveClass', 'Самолет')
             negative_class = classification_settings.get('negativeClass', 'Не самолет')
             comparison_metrics['classification_settings'] = {
@@ -561,83 +1775,86 @@ def get_model_comparison():
                 'negative_class': negative_class
             }
 
-        # Матрица согласия (confusion matrix для ответов)
-        agreement_matrix = []
-        for i, model1 in enumerate(model_names):
-            row = []
-            for j, model2 in enumerate(model_names):
-                if i == j:
-                    # Диагональ - успешные ответы модели
-                    successful_answers = sum(1 for img_results in image_results.values()
-                                           if img_results.get(model1, {}).get('success', False))
-                    row.append(successful_answers)
-                else:
-                    # Сравнение ответов двух моделей
-                    agreements = 0
-                    for img_results in image_results.values():
-                        model1_result = img_results.get(model1, {})
-                        model2_result = img_results.get(model2, {})
-
-                        if (model1_result.get('success', False) and
-                            model2_result.get('success', False) and
-                            model1_result.get('entity', '').lower() == model2_result.get('entity', '').lower()):
-                            agreements += 1
-                    row.append(agreements)
-            agreement_matrix.append(row)
-
-        comparison_metrics['agreement_matrix'] = agreement_matrix
-
-        # Метрики производительности для каждой модели
-        for model_name in model_names:
-            model_times = []
-            model_tokens_per_sec = []
-            model_total_tokens = []
-            successful_count = 0
-            correct_predictions = 0  # Для режима классификации
-
-            for img_name, img_results in image_results.items():
-                model_result = img_results.get(model_name, {})
-                if model_result.get('success', False):
-                    successful_count += 1
-                    model_times.append(model_result.get('processing_time', 0))
-                    if model_result.get('tokens_per_second', 0) > 0:
-                        model_tokens_per_sec.append(model_result.get('tokens_per_second', 0))
-                    model_total_tokens.append(model_result.get('total_tokens', 0))
-
-                    # Для режима классификации проверяем правильность
-                    if mode == 'classification':
-                        ground_truth = ground_truth_data.get(img_name)
-                        if ground_truth:
-                            entity_lower = model_result.get('entity', '').lower().strip()
-                            positive_lower = positive_class.lower()
-                            negative_lower = negative_class.lower()
-                            
-                            # Проверяем, соответствует ли ответ правильному классу
-                            if ground_truth == 'positive':
-                                # Проверяем, что ответ больше похож на положительный класс
-                                positive_match = positive_lower in entity_lower and not (negative_lower in entity_lower and entity_lower.startswith(negative_lower.split()[0]))
-                                if positive_match:
-                                    correct_predictions += 1
-                            elif ground_truth == 'negative':
-                                # Проверяем, что ответ больше похож на отрицательный класс  
-                                negative_match = negative_lower in entity_lower or entity_lower.startswith(negative_lower.split()[0])
-                                if negative_match:
-                                    correct_predictions += 1
+        # Матрица согласия: на диагонали - успешные ответы модели
+        comparison_metrics['agreement_matrix'] = agreement_counts(codes).tolist()
 
+        # Классификация: каждый различный ответ сопоставляется с классом один раз
+        report = None
+        scored = None
+        if mode in ('classification', 'combined'):
+            label_codes = {'positive': 1, 'negative': 0}
+            answer_labels = matcher_for(classification_settings).match_many(list(answers))
+            # Последний элемент - для кода -1 (нет ответа)
+            code_labels = np.array([label_codes.get(label, MISSING) for label in answer_labels] + [MISSING], dtype=np.int8)
+            truth = np.array([label_codes.get(ground_truth_data.get(name), MISSING) for name in image_names], dtype=np.int8)
+            predicted = code_labels[codes]
+            report = confusion_report(truth, predicted)
+            comparison_metrics['mcnemar'] = [
+                dict(test, first=model_names[test['first']], second=model_names[test['second']])
+                for test in mcnemar_tests(truth, predicted)
+            ]
+
+            # Вероятности положительного класса для ROC (режим оценки)
+            probabilities = matrix(table['probability'], np.nan)
+            scored = success & (truth != MISSING)[:, None] & ~np.isnan(probabilities)
+
+        # Метрики производительности для каждой модели - суммы по столбцам
+        successful = success.sum(axis=0)
+        time_sums = np.where(success, processing_times, 0.0).sum(axis=0)
+        speed_measured = success & (tokens_per_second > 0)
+        speed_counts = speed_measured.sum(axis=0)
+        speed_sums = np.where(speed_measured, tokens_per_second, 0.0).sum(axis=0)
+        token_sums = np.where(success, total_tokens, 0).sum(axis=0)
+        resolved_counts = resolved.sum(axis=0)
+        low_counts = low_resolution.sum(axis=0)
+        total_images = len(image_names)
+
+        for model_position, model_name in enumerate(model_names):
+            successful_count = int(successful[model_position])
+            speed_count = int(speed_counts[model_position])
+            token_sum = int(token_sums[model_position])
             comparison_metrics['performance_metrics'][model_name] = {
                 'successful_predictions': successful_count,
-                'total_predictions': len(image_results),
-                'success_rate': round(successful_count / len(image_results) * 100, 2) if image_results else 0,
-                'avg_processing_time': round(sum(model_times) / len(model_times), 3) if model_times else 0,
-                'avg_tokens_per_second': round(sum(model_tokens_per_sec) / len(model_tokens_per_sec), 2) if model_tokens_per_sec else 0,
-                'total_tokens_used': sum(model_total_tokens),
-                'avg_tokens_used': round(sum(model_total_tokens) / len(model_total_tokens), 1) if model_total_tokens else 0
+                'total_predictions': total_images,
+                'success_rate': round(successful_count / total_images * 100, 2) if total_images else 0,
+                'avg_processing_time': round(float(time_sums[model_position]) / successful_count, 3) if successful_count else 0,
+                'avg_tokens_per_second': round(float(speed_sums[model_position]) / speed_count, 2) if speed_count else 0,
+                'total_tokens_used': token_sum,
+                'avg_tokens_used': round(token_sum / successful_count, 1) if successful_count else 0
             }
 
+            # Каскад разрешений: сколько ответов получено по уменьшенной копии
+            resolved_count = int(resolved_counts[model_position])
+            if resolved_count:
+                low_res_answers = int(low_counts[model_position])
+                comparison_metrics['performance_metrics'][model_name]['cascade'] = {
+                    'low_res_answers': low_res_answers,
+                    'full_res_answers': resolved_count - low_res_answers,
+                    'low_res_rate': round(low_res_answers / resolved_count * 100, 2)
+                }
+
             # Добавляем метрики точности для режима классификации
-            if mode == 'classification':
+            if report is not None:
+                correct_predictions = int(report['tp'][model_position] + report['tn'][model_position])
                 comparison_metrics['performance_metrics'][model_name]['correct_predictions'] = correct_predictions
-                comparison_metrics['performance_metrics'][model_name]['accuracy'] = round(correct_predictions / len(image_results) * 100, 2) if image_results else 0
+                comparison_metrics['performance_metrics'][model_name]['accuracy'] = round(correct_predictions / total_images * 100, 2) if total_images else 0
+                comparison_metrics['performance_metrics'][model_name]['classification'] = {
+                    'labeled_images': report['labeled'],
+                    'confusion_matrix': {key: int(report[key][model_position]) for key in ('tp', 'fp', 'fn', 'tn')},
+                    'unmatched_answers': int(report['unmatched'][model_position]),
+                    **{
+                        key: round(float(report[key][model_position]) * 100, 2)
+                        for key in ('precision', 'recall', 'specificity', 'f1')
+                    },
+                    'mcc': round(float(report['mcc'][model_position]), 4)
+                }
+
+            # Вероятности (режим оценки одним токеном): ROC, AUC и подбор порога
+            if scored is not None and scored[:, model_position].any():
+                model_scored = scored[:, model_position]
+                comparison_metrics['performance_metrics'][model_name]['scoring'] = score_report(
+                    truth[model_scored], probabilities[model_scored, model_position]
+                )
 
         return jsonify(comparison_metrics)
 
@@ -686,5 +1903,15 @@ def calculate_comparison(results):
     
     return comparison
 
+# Время импорта и инициализации модуля: сетевых запросов на старте нет,
+# каталог моделей отдаётся из снимка и обновляется в фоне (backend.start)
+STARTUP_SECONDS = round(time.perf_counter() - STARTUP_STARTED, 3)
+print(f"⏱ Приложение инициализировано за {STARTUP_SECONDS * 1000:.0f} мс")
+
+# Прогрев запускается при создании приложения, в том числе под gunicorn,
+# где __main__ не выполняется; /ready только читает его состояние
+if not is_reloader_parent():
+    start_warmup()
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5003)
+    app.run(debug=True, host='0.0.0.0', port=int(os.getenv('PORT', '5003')))
@@ -0,0 +1,963 @@
+"""Бэкенды инференса: корпоративный API, LM Studio REST и LM Studio SDK.
+
+Приложение работает с моделями только через интерфейс Backend: каталог
+моделей, запрос к модели (infer), пакетный прогон по нескольким моделям
+(batch_infer), описание возможностей и хуки загрузки/выгрузки. Бэкенд
+выбирается переменной окружения BACKEND (см. create_backend), поэтому
+кеширование, упаковка запросов и прочие оптимизации в app.py одинаково
+работают для всех транспортов.
+"""
+import base64
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
+
+from hedging import RequestHedger
+from key_pool import APIKeyPool, REKEY_STATUS_CODES
+from local_scheduler import ModelMajorScheduler
+
+# Фрагменты ответов LM Studio, означающие, что запрошенная модель не активна
+MODEL_STATE_ERROR_MARKERS = (
+    'not loaded',
+    'no model',
+    'model_not_found',
+    'insufficient system resources',
+    'failed to load',
+)
+
+DEFAULT_LOCAL_MODELS = "qwen/qwen3-vl-4b,google/gemma-3-4b"
+
+# Таймаут одного запроса к модели, если дедлайн задания не меньше
+REQUEST_TIMEOUT = 120
+
+
+class ModelNotLoadedError(Exception):
+    """Модель не активна в локальном LM Studio и не может быть загружена автоматически"""
+
+    def __init__(self, model_name, current_model=None):
+        self.model_name = model_name
+        self.current_model = current_model
+        super().__init__(
+            f"Модель {model_name} не загружена в память. "
+            f"Выгрузите текущую модель '{current_model}' и загрузите '{model_name}' в LM Studio."
+        )
+
+
+def post_for_job(url, job, **kwargs):
+    """POST к API с таймаутом по дедлайну задания; отмена задания прерывает запрос"""
+    try:
+        if job is None:
+            return requests.post(url, timeout=REQUEST_TIMEOUT, **kwargs)
+        return job.session().post(url, timeout=job.timeout(REQUEST_TIMEOUT), **kwargs)
+    except requests.exceptions.RequestException:
+        # Соединение оборвано отменой или истёк дедлайн - сообщаем именно об этом
+        if job is not None:
+            job.check()
+        raise
+
+
+def parse_retry_after(value):
+    """Retry-After в секундах (форма с HTTP-датой не поддерживается)"""
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+def short_model_name(model_name):
+    return model_name.split('/')[1] if model_name and '/' in model_name else model_name
+
+
+def catalog_entry(model_id, loaded=True, max_context=0):
+    """Элемент каталога моделей в формате /api/vlm-models"""
+    return {
+        'id': model_id,
+        'name': model_id,
+        'publisher': model_id.split('/')[0] if '/' in model_id else 'unknown',
+        'arch': 'unknown',
+        'state': 'loaded' if loaded else 'not-loaded',
+        'quantization': '',
+        'max_context': max_context,
+        'loaded': loaded
+    }
+
+
+class Backend:
+    """Базовый бэкенд. Наследники реализуют fetch_catalog() и infer()."""
+
+    name = 'base'
+    title = 'бэкенд'
+    endpoint = ''
+
+    def __init__(self):
+        self.scheduler = ModelMajorScheduler()
+        self._catalog = None
+        # Откуда взят текущий каталог (network, snapshot, fallback; None - не отслеживается)
+        self.catalog_source = None
+        self._catalog_listeners = []
+        # Место в очереди к API и память для запросов, которые бэкенд отправляет сам
+        self._request_slot = None
+
+    def capabilities(self):
+        """Что умеет транспорт - по этим флагам клиент выбирает стратегию обработки"""
+        return {
+            'parallel_requests': True,   # можно слать запросы к разным моделям одновременно
+            'load_unload': False,        # модели загружаются и выгружаются явно
+            'max_resident_models': None, # сколько моделей одновременно в памяти (None - без ограничения)
+            'token_usage': True,         # ответ содержит статистику токенов
+            'logprobs': True             # можно запросить log-вероятности токенов ответа
+        }
+
+    def describe(self):
+        return {
+            'name': self.name,
+            'title': self.title,
+            'capabilities': self.capabilities()
+        }
+
+    def start(self):
+        """Запуск фоновых задач бэкенда (по умолчанию нет)"""
+
+    def metrics(self):
+        """Счётчики транспорта для /api/metrics"""
+        return {}
+
+    def use_request_slot(self, slot):
+        """slot(job, nbytes) - контекстный менеджер: место в очереди к API и nbytes памяти.
+
+        Под ним идут дополнительные запросы самого бэкенда (дубликаты
+        хеджирования), чтобы они соблюдали те же лимиты, что и остальные.
+        """
+        self._request_slot = slot
+
+    # Каталог моделей
+
+    def fetch_catalog(self):
+        """Запрашивает каталог моделей у источника и обновляет кеш"""
+        raise NotImplementedError
+
+    def catalog(self):
+        """Каталог моделей из кеша (при первом обращении запрашивается)"""
+        if self._catalog is None:
+            self.fetch_catalog()
+        return self._catalog
+
+    def on_catalog_change(self, callback):
+        """callback(catalog) вызывается, когда меняется состав моделей или их загруженность"""
+        self._catalog_listeners.append(callback)
+
+    def _set_catalog(self, catalog, source=None):
+        previous = self._catalog
+        self._catalog = catalog
+        if source is not None:
+            self.catalog_source = source
+        state = [(model['id'], model['loaded']) for model in catalog]
+        if previous is None or state != [(model['id'], model['loaded']) for model in previous]:
+            for callback in self._catalog_listeners:
+                callback(catalog)
+        return catalog
+
+    def model_names(self):
+        return [model['id'] for model in self.catalog()]
+
+    def is_available(self, model_name):
+        return model_name in self.model_names()
+
+    def active_models(self):
+        """Модели, которым не нужна загрузка перед запросом"""
+        return self.model_names()
+
+    # Загрузка и выгрузка
+
+    def load(self, model_name):
+        return self.is_available(model_name)
+
+    def unload(self, model_name=None):
+        return True
+
+    @contextmanager
+    def session(self, model_name):
+        """Держит модель готовой к запросам на время пакета, выдаёт handle"""
+        yield None
+
+    # Инференс
+
+    def infer(self, model_name, content, max_tokens, temperature=0.2, extra_params=None, job=None):
+        """Один запрос к модели в формате OpenAI content.
+
+        extra_params - дополнительные поля запроса (например, logprobs),
+        бэкенды без их поддержки поля игнорируют. job - задание (jobs.Job):
+        его дедлайн ограничивает таймаут, отмена прерывает запрос.
+        Возвращает (ответ в формате chat completions, время в секундах).
+        """
+        raise NotImplementedError
+
+    def model_order(self, models, images_count):
+        """Порядок, в котором batch_infer прогонит модели по пакету из images_count изображений"""
+        return self.scheduler.order_models(models, images_count, self.active_models())
+
+    def batch_infer(self, models, images_count, process, job=None):
+        """Прогоняет пакет всеми моделями: process(model_name) - список результатов.
+
+        По умолчанию модели идут по одной (model-major), каждая загружается
+        один раз, порядок выбирает планировщик. Возвращает
+        (results[model_name], статистика).
+        """
+        return self.scheduler.run_batches(
+            models,
+            images_count,
+            self.session,
+            lambda handle, model_name: process(model_name),
+            loaded_models=self.active_models(),
+            # После отмены задания следующие модели не загружаем
+            cancelled=(lambda: job.cancelled) if job else None
+        )
+
+
+class CorporateAPIBackend(Backend):
+    """Корпоративный OpenAI-совместимый API: все модели всегда доступны"""
+
+    name = 'corporate'
+    title = 'корпоративный API'
+    fallback_models = ["Qwen3-VL-235B-A22B-Instruct", "google/gemma-3-27b-it"]
+
+    def __init__(self, base_url, key_pool, hedger=None, snapshot_path=None):
+        super().__init__()
+        self.base_url = base_url
+        # Файл с последним успешно загруженным каталогом (None - не сохранять)
+        self.snapshot_path = snapshot_path
+        self._refresh_thread = None
+        self._start_lock = threading.Lock()
+        self.endpoint = f"{base_url}/api/v1/chat/completions"
+        self.models_url = f"{base_url}/api/v1/models"
+        # Пул API-ключей (APIKeyPool): запросы распределяются между ключами
+        self.key_pool = key_pool
+        # Хеджирование медленных запросов (None - выключено)
+        self.hedger = hedger
+
+    def metrics(self):
+        return {
+            'hedging': self.hedger.stats() if self.hedger else None,
+            'api_keys': self.key_pool.stats()
+        }
+
+    def _request_with_key(self, send):
+        """Выполняет send(headers) ключом из пула.
+
+        Ответ 401/403/429 отправляет ключ в карантин; если есть другой
+        доступный ключ, запрос повторяется им.
+        """
+        tried = set()
+        while True:
+            key = self.key_pool.acquire(exclude=tried)
+            tried.add(key)
+            status_code = retry_after = None
+            try:
+                response = send({"Authorization": f"Bearer {key}"})
+                status_code = response.status_code
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            finally:
+                self.key_pool.release(key, status_code, retry_after)
+            if status_code not in REKEY_STATUS_CODES or not self.key_pool.has_alternative(tried):
+                return response
+            response.close()
+
+    def fetch_catalog(self):
+        response = self._request_with_key(
+            lambda headers: requests.get(self.models_url, headers=headers, timeout=15)
+        )
+        response.raise_for_status()
+        models_data = response.json()
+
+        # Получаем все модели и фильтруем только с vision
+        catalog = []
+        for model in models_data.get('data', []):
+            info = model.get('info', {})
+            meta = info.get('meta', {})
+            capabilities = meta.get('capabilities', {})
+
+            if capabilities.get('vision', False):
+                catalog.append(catalog_entry(model['id'], max_context=model.get('max_model_len', 0)))
+
+        self._set_catalog(catalog, 'network')
+        self.save_snapshot(catalog)
+        return catalog
+
+    def save_snapshot(self, catalog):
+        """Сохраняет каталог на диск, чтобы следующий запуск не ждал API"""
+        if not self.snapshot_path:
+            return
+        snapshot = {'base_url': self.base_url, 'saved_at': time.time(), 'models': catalog}
+        tmp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"⚠ Не удалось сохранить снимок каталога: {e}")
+
+    def load_snapshot(self):
+        """Каталог из снимка на диске (None - снимка нет или он от другого API)"""
+        if not self.snapshot_path:
+            return None
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if snapshot.get('base_url') != self.base_url or not snapshot.get('models'):
+            return None
+        return snapshot['models']
+
+    def start(self):
+        """Отдаёт каталог из снимка сразу, а актуальный загружает в фоне (идемпотентно)"""
+        with self._start_lock:
+            if self._refresh_thread is not None:
+                return
+            if self._catalog is None:
+                snapshot = self.load_snapshot()
+                if snapshot is not None:
+                    self._set_catalog(snapshot, 'snapshot')
+                    print(f"✓ Каталог из снимка: {len(snapshot)} моделей, обновляем в фоне")
+            self._refresh_thread = threading.Thread(target=self.load_catalog, name='catalog-refresh', daemon=True)
+            self._refresh_thread.start()
+
+    def catalog(self):
+        """Каталог vision-моделей: из кеша, снимка на диске или из API"""
+        if self._catalog is None:
+            self.start()
+            if self._catalog is None:
+                # Снимка нет - ждём загрузки из API
+                self._refresh_thread.join()
+        return self._catalog
+
+    def load_catalog(self):
+        """Загружает каталог из API с повторными попытками и fallback-списком"""
+        max_retries = 3
+        retry_delay = 2
+        for attempt in range(max_retries):
+            try:
+                print(f"🔄 Попытка {attempt + 1}/{max_retries} загрузки моделей...")
+                catalog = self.fetch_catalog()
+                print(f"✓ Загружено {len(catalog)} моделей с поддержкой vision: {[m['id'] for m in catalog]}")
+                return catalog
+            except Exception as e:
+                print(f"✗ Попытка {attempt + 1} не удалась: {e}")
+                if attempt < max_retries - 1:
+                    print(f"⏳ Ждем {retry_delay} секунд перед следующей попыткой...")
+                    time.sleep(retry_delay)
+                else:
+                    print("❌ Все попытки исчерпаны, используем fallback модели")
+
+        if self._catalog is not None:
+            print(f"⚠ Оставляем каталог из снимка ({len(self._catalog)} моделей)")
+            return self._catalog
+        self._set_catalog([catalog_entry(model_id) for model_id in self.fallback_models], 'fallback')
+        print(f"⚠ Используем fallback модели: {self.fallback_models}")
+        return self._catalog
+
+    def infer(self, model_name, content, max_tokens, temperature=0.2, extra_params=None, job=None):
+        payload = {
+            "model": model_name,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": content
+                }
+            ],
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            **(extra_params or {})
+        }
+
+        def send(attempt):
+            return self._request_with_key(
+                lambda headers: post_for_job(self.endpoint, attempt, json=payload, headers=headers)
+            )
+
+        start_time = time.time()
+        if self.hedger:
+            response = self.hedger.call(model_name, send, job, self._duplicate_slot(content))
+        else:
+            response = send(job)
+        response.raise_for_status()
+        return response.json(), round(time.time() - start_time, 3)
+
+    def _duplicate_slot(self, content):
+        """Слот для дубликата запроса: своё тело запроса - ещё одна копия изображений"""
+        if self._request_slot is None:
+            return None
+        nbytes = sum(len(part['image_url']['url']) for part in content if part.get('type') == 'image_url')
+        return lambda attempt: self._request_slot(attempt, nbytes)
+
+    def batch_infer(self, models, images_count, process, job=None):
+        """Модели корпоративного API независимы - прогоняем их параллельно"""
+        stats = {'order': list(models), 'models': {}}
+        started = time.time()
+
+        def run(model_name):
+            model_started = time.time()
+            try:
+                results = process(model_name)
+                stats['models'][model_name] = {'load_time': 0, 'inference_time': round(time.time() - model_started, 3), 'images': len(results)}
+                return results
+            except Exception as e:
+                print(f"✗ Модель {model_name} недоступна: {e}")
+                stats['models'][model_name] = {'load_time': 0, 'inference_time': 0, 'images': 0, 'error': str(e)}
+                return [{"error": f"Модель {model_name} недоступна: {e}", "model": model_name} for _ in range(images_count)]
+
+        with ThreadPoolExecutor(max_workers=max(1, len(models))) as executor:
+            results = dict(zip(models, executor.map(run, models)))
+
+        stats['total_time'] = round(time.time() - started, 3)
+        return results, stats
+
+
+class ActiveModelTracker:
+    """Кеширует активную модель LM Studio, чтобы не спрашивать её на каждом запросе.
+
+    Значение обновляется фоновым потоком, сразу выставляется после
+    load/unload и сбрасывается, когда LM Studio отвечает ошибкой о
+    состоянии модели. Если кеш сброшен или устарел (фоновый поток не
+    запущен), следующий get() перечитывает /v1/models синхронно.
+    """
+
+    def __init__(self, models_url, refresh_interval):
+        self.models_url = models_url
+        self.refresh_interval = refresh_interval
+        self._model = None
+        self._valid = False
+        self._fetched_at = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def refresh(self):
+        """Перечитывает активную модель из LM Studio"""
+        try:
+            response = requests.get(self.models_url, timeout=5)
+            response.raise_for_status()
+            models_data = response.json()
+
+            # LM Studio возвращает список всех доступных моделей,
+            # но только первая в списке фактически загружена в память
+            loaded_models = models_data.get('data', [])
+            model = loaded_models[0].get('id', None) if loaded_models else None
+        except Exception as e:
+            print(f"Ошибка получения загруженной модели: {e}")
+            self.invalidate()
+            return None
+
+        self.set_active(model)
+        return model
+
+    def get(self):
+        with self._lock:
+            fresh = time.time() - self._fetched_at < self.refresh_interval * 2
+            if self._valid and fresh:
+                return self._model
+        return self.refresh()
+
+    def set_active(self, model_name):
+        with self._lock:
+            self._model = model_name
+            self._valid = True
+            self._fetched_at = time.time()
+
+    def invalidate(self):
+        with self._lock:
+            self._valid = False
+
+    def is_model_state_error(self, error_text):
+        """Похож ли ответ LM Studio на ошибку о неактивной модели"""
+        error_text = (error_text or '').lower()
+        return any(marker in error_text for marker in MODEL_STATE_ERROR_MARKERS)
+
+    def start(self):
+        """Запускает фоновое обновление (идемпотентно)"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def loop():
+            while True:
+                self.refresh()
+                time.sleep(self.refresh_interval)
+
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+
+class LMStudioRESTBackend(Backend):
+    """LM Studio через OpenAI-совместимый REST API: активна одна модель"""
+
+    name = 'lmstudio-rest'
+    title = 'LM Studio REST API'
+
+    def __init__(self, base_url, models, refresh_interval):
+        super().__init__()
+        self.base_url = base_url
+        self.endpoint = f"{base_url}/v1/chat/completions"
+        self.models_url = f"{base_url}/v1/models"
+        self.models = models
+        self.tracker = ActiveModelTracker(self.models_url, refresh_interval)
+        # Модель нельзя переключать, пока идёт запрос к текущей
+        self._slot_lock = threading.RLock()
+
+    def capabilities(self):
+        # OpenAI-совместимый сервер LM Studio не возвращает logprobs
+        return dict(
+            super().capabilities(),
+            parallel_requests=False,
+            load_unload=True,
+            max_resident_models=1,
+            logprobs=False
+        )
+
+    def start(self):
+        self.tracker.start()
+
+    def fetch_catalog(self):
+        current = self.tracker.get()
+        return self._set_catalog([catalog_entry(m, loaded=bool(current and m in current)) for m in self.models])
+
+    def active_models(self):
+        current = self.tracker.get()
+        return [m for m in self.models if current and m in current]
+
+    def load(self, model_name):
+        """Загружает модель в LM Studio через API"""
+        print(f"Попытка загрузить модель: {model_name}")
+
+        current_model = self.tracker.get()
+        if current_model and model_name in current_model:
+            print(f"✓ Модель {model_name} уже загружена")
+            return True
+
+        # Формат может отличаться в зависимости от версии LM Studio
+        endpoints_to_try = [
+            f"{self.base_url}/v1/models/load",
+            f"{self.base_url}/api/v0/models/load",
+            f"{self.base_url}/models/load",
+        ]
+
+        for endpoint in endpoints_to_try:
+            try:
+                print(f"Пробую эндпоинт: {endpoint}")
+                response = requests.post(endpoint, json={"model": model_name}, timeout=30)
+
+                if response.status_code == 200:
+                    print(f"✓ Модель {model_name} успешно загружена")
+                    # Даём время модели загрузиться
+                    time.sleep(5)
+                    self.tracker.set_active(model_name)
+                    return True
+                elif response.status_code == 404:
+                    # Этот эндпоинт не существует, пробуем следующий
+                    continue
+                else:
+                    print(f"Ответ сервера ({response.status_code}): {response.text}")
+            except requests.exceptions.RequestException as e:
+                print(f"Ошибка при обращении к {endpoint}: {e}")
+                continue
+
+        print(f"⚠ API загрузки моделей не поддерживается. Загрузите модель вручную.")
+        return False
+
+    def unload(self, model_name=None):
+        """Выгружает текущую модель из LM Studio"""
+        print("Попытка выгрузить текущую модель")
+
+        endpoints_to_try = [
+            f"{self.base_url}/v1/models/unload",
+            f"{self.base_url}/api/v0/models/unload",
+        ]
+
+        for endpoint in endpoints_to_try:
+            try:
+                response = requests.post(endpoint, timeout=10)
+                if response.status_code == 200:
+                    print("✓ Модель выгружена")
+                    time.sleep(2)
+                    self.tracker.invalidate()
+                    return True
+            except requests.exceptions.RequestException:
+                continue
+
+        print("⚠ API выгрузки моделей не поддерживается")
+        return False
+
+    def _ensure_active(self, model_name):
+        current_model = self.tracker.get()
+        if current_model and model_name in current_model:
+            return
+        if not self.load(model_name):
+            raise ModelNotLoadedError(model_name, self.tracker.get())
+
+    @contextmanager
+    def session(self, model_name):
+        with self._slot_lock:
+            self._ensure_active(model_name)
+            yield model_name
+
+    def infer(self, model_name, content, max_tokens, temperature=0.2, extra_params=None, job=None):
+        payload = {
+            "model": model_name,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": content
+                }
+            ],
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            **(extra_params or {})
+        }
+
+        with self._slot_lock:
+            # Активная модель берётся из кеша - на горячем пути только один запрос к LM Studio
+            self._ensure_active(model_name)
+
+            start_time = time.time()
+            response = post_for_job(self.endpoint, job, json=payload)
+            if response.status_code >= 400 and self.tracker.is_model_state_error(response.text):
+                # Модель сменили в LM Studio - кеш устарел, перечитываем актуальную
+                self.tracker.invalidate()
+                raise ModelNotLoadedError(model_name, self.tracker.get())
+            response.raise_for_status()
+            return response.json(), round(time.time() - start_time, 3)
+
+
+class ModelResidencyManager:
+    """Пул загруженных моделей LM Studio с вытеснением по LRU.
+
+    Модель загружается при первом обращении и остаётся в памяти между
+    запросами. Если новая модель не помещается в бюджет памяти, выгружаются
+    давно не использовавшиеся модели, которые сейчас никем не заняты.
+    Безопасен для одновременных запросов из потоков Flask; обращения к
+    LM Studio (размер модели, загрузка, выгрузка) идут вне блокировки.
+    """
+
+    def __init__(self, get_client, budget_bytes, default_model_size, load_config):
+        self.get_client = get_client
+        self.budget_bytes = budget_bytes
+        self.default_model_size = default_model_size
+        self.load_config = load_config
+        self._handles = OrderedDict()  # model_name -> handle, в порядке последнего использования
+        self._sizes = {}
+        self._in_use = {}
+        self._loading = set()
+        self._unloading = {}  # model_name -> размер; память занята, пока выгрузка не завершится
+        self._size_cache = {}
+        self._condition = threading.Condition()
+
+    def _resident_bytes(self):
+        return (
+            sum(self._sizes[name] for name in self._handles)
+            + sum(self._sizes.get(name, 0) for name in self._loading)
+            + sum(self._unloading.values())
+        )
+
+    def _model_size(self, model_name):
+        """Размер модели по данным LM Studio (размер файла весов)"""
+        if model_name not in self._size_cache:
+            size = None
+            try:
+                for downloaded in self.get_client().list_downloaded_models("llm"):
+                    key = getattr(downloaded, 'model_key', None)
+                    info = getattr(downloaded, 'info', None)
+                    if key == model_name and info is not None:
+                        size = getattr(info, 'size_bytes', None)
+                        break
+            except Exception as e:
+                print(f"⚠️  Не удалось получить размер модели {model_name}: {e}")
+            self._size_cache[model_name] = size or self.default_model_size
+        return self._size_cache[model_name]
+
+    def _pick_victims(self, size):
+        """Выбирает свободные модели по LRU, без которых новая модель помещается в бюджет.
+
+        Возвращает [(имя, handle)] для выгрузки вне блокировки или None, если
+        места не хватит, пока заняты другие модели. Выбранные модели сразу
+        убираются из пула, а их память считается занятой до конца выгрузки.
+        Модель больше всего бюджета загружаем, когда остальные свободны.
+        """
+        free_bytes = self.budget_bytes - self._resident_bytes()
+        victims = []
+        for name in self._handles:
+            if free_bytes >= size:
+                break
+            if not self._in_use.get(name):
+                victims.append(name)
+                free_bytes += self._sizes[name]
+        if free_bytes < size and any(self._in_use.values()):
+            return None
+        for name in victims:
+            self._unloading[name] = self._sizes[name]
+        return [(name, self._handles.pop(name)) for name in victims]
+
+    def _unload_victims(self, victims):
+        try:
+            for name, handle in victims:
+                print(f"🔄 Выгружаю модель {name} (вытеснение по LRU)...")
+                try:
+                    handle.unload()
+                    print(f"✓ Модель {name} выгружена")
+                except Exception as e:
+                    print(f"⚠️  Не удалось выгрузить модель {name}: {e}")
+        finally:
+            with self._condition:
+                for name, _ in victims:
+                    self._unloading.pop(name, None)
+                self._condition.notify_all()
+
+    @contextmanager
+    def acquire(self, model_name):
+        """Выдаёт загруженную модель на время запроса: (handle, время загрузки в секундах)"""
+        load_time = 0
+        should_load = False
+        victims = []
+        # Размер узнаём у LM Studio до блокировки, чтобы не задерживать остальные запросы
+        size = self._model_size(model_name)
+        with self._condition:
+            while True:
+                if model_name in self._handles:
+                    self._handles.move_to_end(model_name)
+                    break
+                if model_name in self._loading or model_name in self._unloading:
+                    # Модель загружается или выгружается другим запросом - ждём его
+                    self._condition.wait()
+                    continue
+                self._sizes[model_name] = size
+                # Если все модели в бюджете заняты, ждём освобождения
+                victims = self._pick_victims(size)
+                if victims is not None:
+                    self._loading.add(model_name)
+                    should_load = True
+                    break
+                self._condition.wait()
+            self._in_use[model_name] = self._in_use.get(model_name, 0) + 1
+
+        try:
+            if should_load:
+                try:
+                    self._unload_victims(victims)
+                    print(f"⏳ Загружаю модель {model_name}...")
+                    start_time = time.time()
+                    handle = self.get_client().llm.load_new_instance(model_name, config=self.load_config)
+                except Exception:
+                    with self._condition:
+                        self._loading.discard(model_name)
+                        self._condition.notify_all()
+                    raise
+                load_time = round(time.time() - start_time, 3)
+                print(f"✓ Модель {model_name} загружена за {load_time}с")
+                with self._condition:
+                    self._loading.discard(model_name)
+                    self._handles[model_name] = handle
+                    self._condition.notify_all()
+
+            with self._condition:
+                handle = self._handles[model_name]
+            yield handle, load_time
+        finally:
+            with self._condition:
+                self._in_use[model_name] -= 1
+                self._condition.notify_all()
+
+    def resident_models(self):
+        """Список загруженных моделей от давно использованной к недавней"""
+        with self._condition:
+            return list(self._handles)
+
+    def unload(self, model_name):
+        """Выгружает модель, если она сейчас не занята запросом"""
+        with self._condition:
+            if model_name not in self._handles or self._in_use.get(model_name):
+                return False
+            handle = self._handles.pop(model_name)
+        try:
+            handle.unload()
+            return True
+        except Exception as e:
+            print(f"⚠️  Не удалось выгрузить модель {model_name}: {e}")
+            return False
+
+    def unload_all(self):
+        with self._condition:
+            handles = [(name, self._handles.pop(name)) for name in list(self._handles) if not self._in_use.get(name)]
+        for name, handle in handles:
+            try:
+                handle.unload()
+            except Exception as e:
+                print(f"⚠️  Не удалось выгрузить модель {name}: {e}")
+
+
+class LMStudioSDKBackend(Backend):
+    """LM Studio через Python SDK: несколько моделей в пуле с бюджетом памяти"""
+
+    name = 'lmstudio-sdk'
+    title = 'LM Studio SDK'
+    endpoint = 'lmstudio-sdk'
+
+    def __init__(self, models, budget_bytes, default_model_size, load_config):
+        super().__init__()
+        self.models = models
+        self._client = None
+        self._client_lock = threading.Lock()
+        self.pool = ModelResidencyManager(self.client, budget_bytes, default_model_size, load_config)
+
+    def client(self):
+        """Клиент LM Studio создаётся при первом обращении"""
+        with self._client_lock:
+            if self._client is None:
+                import lmstudio as lms
+                self._client = lms.Client()
+                print("✓ LM Studio клиент инициализирован")
+            return self._client
+
+    def capabilities(self):
+        return dict(
+            super().capabilities(),
+            parallel_requests=False,
+            load_unload=True,
+            logprobs=False,
+            memory_budget_gb=round(self.pool.budget_bytes / 1024 ** 3, 1)
+        )
+
+    def fetch_catalog(self):
+        resident = self.pool.resident_models()
+        return self._set_catalog([catalog_entry(m, loaded=m in resident) for m in self.models])
+
+    def active_models(self):
+        return self.pool.resident_models()
+
+    def load(self, model_name):
+        with self.pool.acquire(model_name):
+            return True
+
+    def unload(self, model_name=None):
+        if model_name is None:
+            self.pool.unload_all()
+            return True
+        return self.pool.unload(model_name)
+
+    @contextmanager
+    def session(self, model_name):
+        with self.pool.acquire(model_name) as (handle, load_time):
+            yield handle
+
+    def _build_chat(self, content):
+        """Переводит OpenAI content (текст + data URL изображений) в lms.Chat"""
+        import lmstudio as lms
+
+        texts, images = [], []
+        for part in content:
+            if part.get('type') == 'text':
+                texts.append(part['text'])
+            elif part.get('type') == 'image_url':
+                header, data = part['image_url']['url'].split(',', 1)
+                ext = header.split('/')[-1].split(';')[0]
+                images.append(self.client().files.prepare_image(base64.b64decode(data), name=f"image.{ext}"))
+
+        chat = lms.Chat()
+        chat.add_user_message("\n".join(texts), images=images)
+        return chat
+
+    def infer(self, model_name, content, max_tokens, temperature=0.2, extra_params=None, job=None):
+        chat = self._build_chat(content)
+        # SDK не позволяет прервать генерацию - проверяем отмену до и после загрузки модели
+        if job is not None:
+            job.check()
+        # Берём модель из пула (загружается только при первом обращении)
+        with self.pool.acquire(model_name) as (model, load_time):
+            if job is not None:
+                job.check()
+            start_time = time.time()
+            response = model.respond(chat, config={"temperature": temperature, "maxTokens": max_tokens})
+            processing_time = round(time.time() - start_time, 3)
+
+        text = response.content if hasattr(response, 'content') else str(response)
+        result = {
+            "choices": [{"message": {"role": "assistant", "content": text}}],
+            "model_load_time": load_time
+        }
+
+        stats = getattr(response, 'stats', None)
+        if stats is not None:
+            prompt_tokens = getattr(stats, 'prompt_tokens_count', None)
+            completion_tokens = getattr(stats, 'predicted_tokens_count', None)
+            if prompt_tokens is not None or completion_tokens is not None:
+                result["usage"] = {
+                    "prompt_tokens": prompt_tokens or 0,
+                    "completion_tokens": completion_tokens or 0,
+                    "total_tokens": getattr(stats, 'total_tokens_count', None) or (prompt_tokens or 0) + (completion_tokens or 0)
+                }
+        return result, processing_time
+
+
+def parse_model_list(value):
+    return [model.strip() for model in value.split(',') if model.strip()]
+
+
+def create_backend(name=None):
+    """Создаёт бэкенд по имени (по умолчанию - из переменной окружения BACKEND)"""
+    name = name or os.getenv('BACKEND', 'corporate')
+
+    if name == 'corporate':
+        hedger = None
+        if os.getenv('HEDGE_REQUESTS', 'false').lower() == 'true':
+            hedger = RequestHedger(
+                percentile=float(os.getenv('HEDGE_PERCENTILE', '95')),
+                # Не больше этой доли дополнительных запросов
+                budget=float(os.getenv('HEDGE_BUDGET', '0.05')),
+                min_samples=int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+            )
+        # Несколько ключей через запятую в API_KEYS, иначе один API_KEY
+        keys = parse_model_list(os.getenv('API_KEYS', '')) or parse_model_list(os.getenv('API_KEY', ''))
+        if not keys:
+            print("⚠ API_KEYS и API_KEY не заданы - запросы к API будут отклонены")
+            keys = ['']
+        rate_limit = os.getenv('API_KEY_RATE_LIMIT')
+        key_pool = APIKeyPool(
+            keys,
+            # Запросов в минуту на ключ (квота шлюза), по умолчанию без ограничения
+            rate_limit=int(rate_limit) if rate_limit else None,
+            auth_quarantine=float(os.getenv('API_KEY_AUTH_QUARANTINE', '300')),
+            rate_quarantine=float(os.getenv('API_KEY_RATE_QUARANTINE', '30'))
+        )
+        return CorporateAPIBackend(
+            os.getenv('CORPORATE_API_URL', 'https://llama.sndi.my'),
+            key_pool,
+            hedger,
+            # Снимок каталога моделей для быстрого старта ('' - не сохранять)
+            os.getenv('CATALOG_SNAPSHOT', 'model_catalog.json') or None
+        )
+
+    if name == 'lmstudio-rest':
+        return LMStudioRESTBackend(
+            os.getenv('LMSTUDIO_BASE_URL', 'http://127.0.0.1:1234'),
+            parse_model_list(os.getenv('LMSTUDIO_MODELS', DEFAULT_LOCAL_MODELS)),
+            float(os.getenv('LMS_ACTIVE_MODEL_REFRESH', '15'))
+        )
+
+    if name == 'lmstudio-sdk':
+        return LMStudioSDKBackend(
+            parse_model_list(os.getenv('LMSTUDIO_MODELS', DEFAULT_LOCAL_MODELS)),
+            # Бюджет памяти под одновременно загруженные модели
+            int(float(os.getenv('LMS_MEMORY_BUDGET_GB', '16')) * 1024 ** 3),
+            # Оценка размера модели, если LM Studio не сообщил размер файла
+            int(float(os.getenv('LMS_DEFAULT_MODEL_SIZE_GB', '4')) * 1024 ** 3),
+            {
+                "contextLength": 8192,
+                "gpu": {
+                    "ratio": 1.0  # Используем всю доступную GPU память
+                }
+            }
+        )
+
+    raise ValueError(f"Неизвестный бэкенд: {name} (доступны: corporate, lmstudio-rest, lmstudio-sdk)")
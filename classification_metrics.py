@@ -0,0 +1,226 @@
+"""Метрики бинарной классификации по ответам и вероятностям моделей.
+
+Все расчёты векторные (NumPy): матрицы ошибок всех моделей считаются за
+один проход по матрице меток изображения x модели, попарные тесты
+Макнемара - произведением матриц правильности, ROC-кривая строится одной
+сортировкой и кумулятивными суммами, перебор порогов - сравнением
+матрицы порогов x изображения, без циклов по результатам.
+"""
+import math
+
+import numpy as np
+
+# Метки в матрицах: положительный, отрицательный класс и "нет ответа / не распознан"
+POSITIVE, NEGATIVE, MISSING = 1, 0, -1
+# До скольких расхождений тест Макнемара считается точно (биномиально)
+MCNEMAR_EXACT_LIMIT = 50
+
+# Пороги для перебора: 0.00, 0.05, ..., 1.00
+DEFAULT_THRESHOLDS = np.linspace(0, 1, 21)
+
+
+def roc_curve(labels, scores):
+    """ROC-кривая: (fpr, tpr, пороги) для меток 0/1 и вероятностей положительного класса"""
+    labels = np.asarray(labels, dtype=np.int8)
+    scores = np.asarray(scores, dtype=np.float64)
+
+    order = np.argsort(-scores, kind='mergesort')
+    sorted_scores = scores[order]
+    sorted_labels = labels[order]
+
+    # Точки кривой - только там, где меняется порог (одинаковые вероятности идут одним шагом)
+    distinct = np.r_[np.flatnonzero(np.diff(sorted_scores)), sorted_labels.size - 1]
+    true_positives = np.cumsum(sorted_labels)[distinct]
+    false_positives = (distinct + 1) - true_positives
+
+    positives = true_positives[-1]
+    negatives = false_positives[-1]
+    tpr = np.r_[0.0, true_positives / positives] if positives else np.zeros(distinct.size + 1)
+    fpr = np.r_[0.0, false_positives / negatives] if negatives else np.zeros(distinct.size + 1)
+    thresholds = np.r_[np.inf, sorted_scores[distinct]]
+    return fpr, tpr, thresholds
+
+
+def roc_auc(fpr, tpr):
+    """Площадь под ROC-кривой (метод трапеций)"""
+    return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+
+def threshold_sweep(labels, scores, thresholds=DEFAULT_THRESHOLDS):
+    """Accuracy, precision, recall и F1 для каждого порога сразу"""
+    labels = np.asarray(labels, dtype=bool)
+    scores = np.asarray(scores, dtype=np.float64)
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+
+    # predicted[t, i] - предсказание для изображения i при пороге t
+    predicted = scores[None, :] >= thresholds[:, None]
+    tp = np.sum(predicted & labels, axis=1)
+    fp = np.sum(predicted & ~labels, axis=1)
+    fn = np.sum(~predicted & labels, axis=1)
+    tn = labels.size - tp - fp - fn
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        recall = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    accuracy = (tp + tn) / labels.size if labels.size else np.zeros(thresholds.size)
+
+    return {
+        'thresholds': thresholds,
+        'accuracy': accuracy,
+        'precision': precision,
+        'recall': recall,
+        'f1': f1
+    }
+
+
+def score_report(labels, scores):
+    """Сводка для /api/model-comparison: ROC, AUC и перебор порогов (в JSON-совместимом виде)"""
+    labels = np.asarray(labels, dtype=np.int8)
+    report = {'scored_images': int(labels.size)}
+    if labels.size == 0:
+        return report
+
+    sweep = threshold_sweep(labels, scores)
+    best = int(np.argmax(sweep['f1']))
+    report['threshold_sweep'] = [
+        {
+            'threshold': round(float(sweep['thresholds'][i]), 2),
+            'accuracy': round(float(sweep['accuracy'][i]) * 100, 2),
+            'precision': round(float(sweep['precision'][i]) * 100, 2),
+            'recall': round(float(sweep['recall'][i]) * 100, 2),
+            'f1': round(float(sweep['f1'][i]) * 100, 2)
+        }
+        for i in range(sweep['thresholds'].size)
+    ]
+    report['best_threshold'] = report['threshold_sweep'][best]
+
+    # ROC и AUC определены, только если есть изображения обоих классов
+    if 0 < labels.sum() < labels.size:
+        fpr, tpr, thresholds = roc_curve(labels, scores)
+        report['auc'] = round(roc_auc(fpr, tpr), 4)
+        report['roc'] = {
+            'fpr': np.round(fpr, 4).tolist(),
+            'tpr': np.round(tpr, 4).tolist(),
+            'thresholds': [None if np.isinf(t) else round(float(t), 4) for t in thresholds]
+        }
+    return report
+
+
+def _ratio(numerator, denominator):
+    """numerator / denominator поэлементно, 0 там, где знаменатель равен 0"""
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+
+def confusion_report(truth, predicted):
+    """Матрицы ошибок и метрики всех моделей за один проход.
+
+    truth - (изображения,) метки ground truth, predicted - (изображения,
+    модели) метки ответов; MISSING в truth - изображение без разметки,
+    в predicted - ошибка или ответ, не похожий ни на один класс. Такой
+    ответ считается ошибкой: для положительного изображения - FN, для
+    отрицательного - FP. Возвращает словарь массивов длины "модели".
+
+    Проверка на известных значениях (F1 и MCC совпадают с sklearn):
+
+    >>> report = confusion_report([1] * 111 + [0] * 100, [1] * 43 + [0] * 68 + [1] * 54 + [0] * 46)
+    >>> [int(report[k][0]) for k in ('tp', 'fn', 'fp', 'tn')]
+    [43, 68, 54, 46]
+    >>> round(float(report['f1'][0]), 4), round(float(report['mcc'][0]), 4)
+    (0.4135, -0.1529)
+    >>> report = confusion_report([1, 1, 0, 0], [1, 1, 0, 0])
+    >>> float(report['f1'][0]), float(report['mcc'][0])
+    (1.0, 1.0)
+    """
+    truth = np.asarray(truth, dtype=np.int8)
+    predicted = np.asarray(predicted, dtype=np.int8).reshape(truth.size, -1)
+
+    positive = (truth == POSITIVE)[:, None]
+    negative = (truth == NEGATIVE)[:, None]
+    said_positive = predicted == POSITIVE
+    tp = np.sum(positive & said_positive, axis=0)
+    fn = np.sum(positive & ~said_positive, axis=0)
+    tn = np.sum(negative & (predicted == NEGATIVE), axis=0)
+    fp = np.sum(negative, axis=0) - tn
+    unmatched = np.sum((positive | negative) & (predicted == MISSING), axis=0)
+
+    precision = _ratio(tp, tp + fp)
+    recall = _ratio(tp, tp + fn)
+    specificity = _ratio(tn, tn + fp)
+    f1 = _ratio(2 * precision * recall, precision + recall)
+    tp_f, fp_f, fn_f, tn_f = (x.astype(np.float64) for x in (tp, fp, fn, tn))
+    mcc = _ratio(
+        tp_f * tn_f - fp_f * fn_f,
+        np.sqrt((tp_f + fp_f) * (tp_f + fn_f) * (tn_f + fp_f) * (tn_f + fn_f))
+    )
+    return {
+        'labeled': int(np.sum(positive | negative)),
+        'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn,
+        'unmatched': unmatched,
+        'accuracy': _ratio(tp + tn, tp + tn + fp + fn),
+        'precision': precision,
+        'recall': recall,
+        'specificity': specificity,
+        'f1': f1,
+        'mcc': mcc
+    }
+
+
+def _mcnemar_p_value(b, c):
+    """p-значение теста Макнемара по числам расхождений b и c"""
+    n = b + c
+    if n == 0:
+        return 1.0
+    if n <= MCNEMAR_EXACT_LIMIT:
+        # Точный двусторонний биномиальный тест
+        tail = sum(math.comb(n, k) for k in range(min(b, c) + 1)) / 2 ** n
+        return min(1.0, 2 * tail)
+    # Хи-квадрат с одной степенью свободы и поправкой на непрерывность
+    statistic = (abs(b - c) - 1) ** 2 / n
+    return math.erfc(math.sqrt(statistic / 2))
+
+
+def mcnemar_tests(truth, predicted, alpha=0.05):
+    """Попарные тесты Макнемара между моделями на размеченных изображениях.
+
+    b[i, j] - изображения, где модель i права, а j ошибается; матрица
+    считается одним произведением матриц правильности.
+    """
+    truth = np.asarray(truth, dtype=np.int8)
+    predicted = np.asarray(predicted, dtype=np.int8).reshape(truth.size, -1)
+    labeled = truth != MISSING
+    correct = (predicted[labeled] == truth[labeled, None]).astype(np.int64)
+    only_first = correct.T @ (1 - correct)
+
+    tests = []
+    models = predicted.shape[1]
+    for i in range(models):
+        for j in range(i + 1, models):
+            b, c = int(only_first[i, j]), int(only_first[j, i])
+            p_value = _mcnemar_p_value(b, c)
+            tests.append({
+                'first': i,
+                'second': j,
+                'first_only_correct': b,
+                'second_only_correct': c,
+                'p_value': round(p_value, 4),
+                'significant': p_value < alpha
+            })
+    return tests
+
+
+def agreement_counts(codes):
+    """Матрица согласия: сколько изображений обе модели ответили одинаково.
+
+    codes - (изображения, модели) коды нормализованных ответов, -1 - нет
+    ответа. На диагонали - число ответов модели.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    answered = codes >= 0
+    # По строке на модель: память - изображения x модели, а не x модели^2
+    return np.stack([
+        np.sum((codes == codes[:, [i]]) & answered & answered[:, [i]], axis=0)
+        for i in range(codes.shape[1])
+    ]) if codes.size else np.zeros((codes.shape[1], codes.shape[1]), dtype=np.int64)
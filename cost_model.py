@@ -0,0 +1,169 @@
+"""Прогноз стоимости и длительности запросов к моделям.
+
+По каждому ответу модели онлайн-регрессией уточняются две зависимости:
+размер изображения (пиксели или байты файла) -> prompt_tokens и
+prompt_tokens -> время ответа. По ним до запуска оцениваются токены и
+длительность обработки (ETA), а изображения, которые заведомо не
+поместятся в контекст модели (max_context из каталога), отклоняются
+без запроса к API.
+"""
+import threading
+
+# Общая модель по всем ответам - прогноз для моделей без собственных наблюдений
+ALL_MODELS = '*'
+
+
+class LinearFit:
+    """Онлайн МНК-регрессия y = a + b * x с экспоненциальным забыванием.
+
+    decay < 1 постепенно уменьшает вес старых наблюдений, чтобы прогноз
+    следовал за изменениями шлюза (нагрузка, версия модели).
+    """
+
+    __slots__ = ('decay', 'n', 'sx', 'sy', 'sxx', 'sxy')
+
+    def __init__(self, decay=0.995):
+        self.decay = decay
+        self.n = self.sx = self.sy = self.sxx = self.sxy = 0.0
+
+    def add(self, x, y):
+        self.n = self.n * self.decay + 1
+        self.sx = self.sx * self.decay + x
+        self.sy = self.sy * self.decay + y
+        self.sxx = self.sxx * self.decay + x * x
+        self.sxy = self.sxy * self.decay + x * y
+
+    def predict(self, x):
+        if self.n == 0:
+            return None
+        mean_x, mean_y = self.sx / self.n, self.sy / self.n
+        variance = self.sxx / self.n - mean_x ** 2
+        if variance <= 1e-9 * max(1.0, mean_x ** 2):
+            return mean_y
+        slope = (self.sxy / self.n - mean_x * mean_y) / variance
+        # Отрицательный наклон физически невозможен - это шум малой выборки
+        if slope < 0:
+            return mean_y
+        return max(0.0, mean_y + slope * (x - mean_x))
+
+
+class CostPredictor:
+    """Прогноз prompt_tokens и времени ответа по моделям.
+
+    Отклонение по контексту требует не меньше min_samples наблюдений
+    модели: до этого прогноз используется только для оценки запуска.
+    """
+
+    def __init__(self, min_samples=5, decay=0.995):
+        self.min_samples = min_samples
+        self.decay = decay
+        self.rejected = 0
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _fits(self, model_name):
+        if model_name not in self._models:
+            self._models[model_name] = {
+                'samples': 0,
+                'pixels_tokens': LinearFit(self.decay),
+                'bytes_tokens': LinearFit(self.decay),
+                'tokens_latency': LinearFit(self.decay)
+            }
+        return self._models[model_name]
+
+    def observe(self, model_name, pixels, nbytes, prompt_tokens, latency):
+        """Учитывает ответ модели на одно изображение"""
+        with self._lock:
+            for name in (model_name, ALL_MODELS):
+                fits = self._fits(name)
+                fits['samples'] += 1
+                if pixels:
+                    fits['pixels_tokens'].add(pixels, prompt_tokens)
+                if nbytes:
+                    fits['bytes_tokens'].add(nbytes, prompt_tokens)
+                fits['tokens_latency'].add(prompt_tokens, latency)
+
+    def _source(self, model_name):
+        """Наблюдения модели, а без них - общие по всем моделям"""
+        fits = self._models.get(model_name)
+        if fits and fits['samples']:
+            return fits
+        fits = self._models.get(ALL_MODELS)
+        return fits if fits and fits['samples'] else None
+
+    def predict(self, model_name, pixels=None, nbytes=None):
+        """(prompt_tokens, время ответа) для изображения; None - прогноза нет"""
+        with self._lock:
+            fits = self._source(model_name)
+            if fits is None:
+                return None, None
+            tokens = None
+            if pixels:
+                tokens = fits['pixels_tokens'].predict(pixels)
+            if tokens is None and nbytes:
+                tokens = fits['bytes_tokens'].predict(nbytes)
+            if tokens is None:
+                return None, None
+            return round(tokens), fits['tokens_latency'].predict(tokens)
+
+    def _exceeds(self, model_name, tokens, max_context):
+        if not max_context or tokens is None or tokens <= max_context:
+            return False
+        with self._lock:
+            fits = self._models.get(model_name)
+            return bool(fits) and fits['samples'] >= self.min_samples
+
+    def check_context(self, model_name, pixels, nbytes, max_context):
+        """Прогноз prompt_tokens, если изображение не поместится в контекст, иначе None"""
+        if not max_context:
+            return None
+        tokens, _ = self.predict(model_name, pixels, nbytes)
+        if not self._exceeds(model_name, tokens, max_context):
+            return None
+        with self._lock:
+            self.rejected += 1
+        return tokens
+
+    def estimate(self, model_name, images, max_context=0):
+        """Оценка запуска: images - [{'width', 'height', 'bytes'}]"""
+        prompt_tokens = latency = 0.0
+        unknown = 0
+        over_context = []
+        for index, image in enumerate(images):
+            width, height = image.get('width'), image.get('height')
+            pixels = width * height if width and height else None
+            tokens, seconds = self.predict(model_name, pixels, image.get('bytes'))
+            if tokens is None or seconds is None:
+                unknown += 1
+                continue
+            prompt_tokens += tokens
+            latency += seconds
+            if self._exceeds(model_name, tokens, max_context):
+                over_context.append(index)
+        with self._lock:
+            fits = self._models.get(model_name)
+            samples = fits['samples'] if fits else 0
+        known = len(images) - unknown
+        # Изображения без прогноза оцениваем по среднему остальных
+        scale = len(images) / known if known else None
+        return {
+            'samples': samples,
+            'prompt_tokens': round(prompt_tokens * scale) if scale else None,
+            'latency': round(latency * scale, 2) if scale else None,
+            'over_context': over_context
+        }
+
+    def stats(self):
+        with self._lock:
+            models = {}
+            for name, fits in self._models.items():
+                if name == ALL_MODELS:
+                    continue
+                pixels_fit = fits['pixels_tokens']
+                latency_fit = fits['tokens_latency']
+                models[name] = {
+                    'samples': fits['samples'],
+                    'avg_prompt_tokens': round(pixels_fit.sy / pixels_fit.n) if pixels_fit.n else None,
+                    'avg_latency': round(latency_fit.sy / latency_fit.n, 3) if latency_fit.n else None
+                }
+            return {'context_rejections': self.rejected, 'models': models}
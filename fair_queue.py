@@ -0,0 +1,199 @@
+"""Справедливая очередь запросов к API между пользователями.
+
+Несколько человек могут одновременно запускать обработку на одном
+сервере. Чтобы первый запущенный пакет не занимал весь API, запросы к
+моделям проходят через общий ограничитель параллелизма с отдельной
+очередью на каждого пользователя (tenant) и взвешенной справедливой
+очередью (WFQ) между ними. Интерактивные запросы (одно изображение)
+идут по приоритетной полосе - впереди пакетных.
+"""
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class _Ticket:
+    __slots__ = ('tenant', 'interactive', 'start', 'finish', 'order', 'enqueued_at', 'granted')
+
+    def __init__(self, tenant, interactive, start, finish, order):
+        self.tenant = tenant
+        self.interactive = interactive
+        self.start = start
+        self.finish = finish
+        self.order = order
+        self.enqueued_at = time.time()
+        self.granted = False
+
+
+class FairScheduler:
+    """Не больше capacity одновременных запросов; очередь - по WFQ между пользователями.
+
+    Каждому запросу пользователя назначается виртуальное время окончания
+    start + cost / weight, где start - не раньше окончания предыдущего
+    запроса этого пользователя. Освободившийся слот получает запрос с
+    наименьшим временем окончания, поэтому пользователь с весом 2 получает
+    вдвое больше слотов, а пакет из тысячи изображений не блокирует
+    остальных. Интерактивные запросы обслуживаются раньше всех.
+
+    Пользователь без запросов дольше idle_ttl секунд забывается вместе со
+    статистикой и виртуальным временем - состояние не растёт с числом
+    когда-либо обращавшихся пользователей.
+    """
+
+    def __init__(self, capacity, weights=None, default_weight=1.0, idle_ttl=3600, prune_interval=60):
+        self.capacity = capacity
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self.idle_ttl = idle_ttl
+        self.prune_interval = prune_interval
+        self._pruned_at = time.time()
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._interactive = deque()
+        self._queues = {}
+        self._last_finish = {}
+        self._virtual_time = 0.0
+        self._order = itertools.count()
+        self._stats = {}
+
+    def _tenant_stats(self, tenant):
+        if tenant not in self._stats:
+            self._stats[tenant] = {
+                'queued': 0,
+                'in_flight': 0,
+                'served': 0,
+                'interactive_served': 0,
+                'total_wait': 0.0,
+                'max_wait': 0.0,
+                'last_active': time.time()
+            }
+        return self._stats[tenant]
+
+    def _prune(self):
+        """Забывает пользователей, простаивающих дольше idle_ttl"""
+        now = time.time()
+        if now - self._pruned_at < self.prune_interval:
+            return
+        self._pruned_at = now
+        for tenant, stats in list(self._stats.items()):
+            if not stats['queued'] and not stats['in_flight'] and now - stats['last_active'] > self.idle_ttl:
+                del self._stats[tenant]
+                self._last_finish.pop(tenant, None)
+
+    def _enqueue(self, tenant, interactive, cost):
+        weight = self.weights.get(tenant, self.default_weight)
+        start = max(self._virtual_time, self._last_finish.get(tenant, 0.0))
+        ticket = _Ticket(tenant, interactive, start, start + cost / weight, next(self._order))
+        if interactive:
+            self._interactive.append(ticket)
+        else:
+            self._last_finish[tenant] = ticket.finish
+            self._queues.setdefault(tenant, deque()).append(ticket)
+        self._tenant_stats(tenant)['queued'] += 1
+        return ticket
+
+    def _next_ticket(self):
+        if self._interactive:
+            return self._interactive.popleft()
+        heads = [queue[0] for queue in self._queues.values() if queue]
+        if not heads:
+            return None
+        ticket = min(heads, key=lambda t: (t.finish, t.order))
+        self._queues[ticket.tenant].popleft()
+        if not self._queues[ticket.tenant]:
+            del self._queues[ticket.tenant]
+        self._virtual_time = max(self._virtual_time, ticket.start)
+        return ticket
+
+    def _dispatch(self):
+        granted = False
+        while self._in_flight < self.capacity:
+            ticket = self._next_ticket()
+            if ticket is None:
+                break
+            ticket.granted = True
+            self._in_flight += 1
+            wait = time.time() - ticket.enqueued_at
+            stats = self._tenant_stats(ticket.tenant)
+            stats['queued'] -= 1
+            stats['in_flight'] += 1
+            stats['served'] += 1
+            stats['interactive_served'] += int(ticket.interactive)
+            stats['total_wait'] += wait
+            stats['max_wait'] = max(stats['max_wait'], wait)
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _withdraw(self, ticket):
+        """Убирает из очереди запрос, который перестал ждать (отмена)"""
+        queue = self._interactive if ticket.interactive else self._queues.get(ticket.tenant)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not ticket.interactive and not queue:
+                del self._queues[ticket.tenant]
+            self._tenant_stats(ticket.tenant)['queued'] -= 1
+
+    def _release(self, tenant):
+        with self._cond:
+            self._in_flight -= 1
+            stats = self._tenant_stats(tenant)
+            stats['in_flight'] -= 1
+            stats['last_active'] = time.time()
+            self._dispatch()
+            self._prune()
+
+    @contextmanager
+    def slot(self, tenant, interactive=False, check=None, cost=1.0):
+        """Ждёт своей очереди и держит слот на время запроса.
+
+        check() вызывается во время ожидания и может бросить исключение
+        (например, при отмене задания) - тогда запрос покидает очередь.
+        """
+        with self._cond:
+            ticket = self._enqueue(tenant, interactive, cost)
+            self._dispatch()
+            try:
+                while not ticket.granted:
+                    if check is not None:
+                        check()
+                    self._cond.wait(0.5)
+            except BaseException:
+                if ticket.granted:
+                    self._in_flight -= 1
+                    self._tenant_stats(tenant)['in_flight'] -= 1
+                    self._dispatch()
+                else:
+                    self._withdraw(ticket)
+                raise
+        try:
+            yield
+        finally:
+            self._release(tenant)
+
+    def stats(self):
+        with self._cond:
+            now = time.time()
+            oldest = {}
+            for ticket in itertools.chain(self._interactive, *self._queues.values()):
+                oldest[ticket.tenant] = max(oldest.get(ticket.tenant, 0.0), now - ticket.enqueued_at)
+            return {
+                'capacity': self.capacity,
+                'in_flight': self._in_flight,
+                'interactive_queued': len(self._interactive),
+                'tenants': {
+                    tenant: {
+                        'weight': self.weights.get(tenant, self.default_weight),
+                        'queued': stats['queued'],
+                        'in_flight': stats['in_flight'],
+                        'served': stats['served'],
+                        'interactive_served': stats['interactive_served'],
+                        'avg_wait': round(stats['total_wait'] / stats['served'], 3) if stats['served'] else 0,
+                        'max_wait': round(stats['max_wait'], 3),
+                        'oldest_wait': round(oldest.get(tenant, 0.0), 3)
+                    }
+                    for tenant, stats in self._stats.items()
+                }
+            }
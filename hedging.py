@@ -0,0 +1,158 @@
+"""Хеджирование запросов к API для сокращения хвостовых задержек.
+
+Если запрос к модели не вернулся за время, которое укладывается в
+заданный перцентиль задержек этой модели, отправляется дубликат и
+используется ответ, пришедший первым. Число дубликатов ограничено
+бюджетом (доля от всех запросов), чтобы не создавать лишнюю нагрузку.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
+
+from jobs import Job
+
+
+def percentile(samples, q):
+    """Перцентиль q (0-100) по методу ближайшего ранга"""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class RequestHedger:
+    """Отправляет дубликат запроса, если ответ задерживается дольше перцентиля.
+
+    send(attempt) - функция одной попытки, возвращает requests.Response;
+    attempt - своя часть задания (jobs.Job) у каждой попытки. Как только
+    пришёл ответ победителя, проигравшая попытка отменяется: если она ещё
+    не началась, её не будет, иначе её соединение закрывается на уровне
+    сокета и слот шлюза сразу освобождается.
+    """
+
+    def __init__(self, percentile=95, budget=0.05, min_samples=20, window=200, max_workers=64):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.window = window
+        self.latencies = {}
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.skipped_by_budget = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+
+    def record(self, model_name, seconds):
+        with self._lock:
+            self.latencies.setdefault(model_name, deque(maxlen=self.window)).append(seconds)
+
+    def delay(self, model_name):
+        """Через сколько секунд отправлять дубликат (None - мало данных о модели)"""
+        with self._lock:
+            samples = list(self.latencies.get(model_name, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return percentile(samples, self.percentile)
+
+    def _take_budget(self):
+        # Один дубликат сверх доли: иначе первый дубликат был бы возможен
+        # только после 1 / budget запросов (20 при 5 %), даже когда у модели
+        # уже набралось min_samples задержек
+        with self._lock:
+            if self.budget <= 0 or self.hedged > self.budget * self.requests:
+                self.skipped_by_budget += 1
+                return False
+            self.hedged += 1
+            return True
+
+    @staticmethod
+    def _attempt(send, attempt, guard=None):
+        try:
+            with guard(attempt) if guard else nullcontext():
+                started = time.time()
+                return send(attempt), time.time() - started
+        finally:
+            attempt.close()
+
+    @staticmethod
+    def _discard(future, attempt):
+        """Отменяет проигравшую попытку: не начатую - снимает, идущую - обрывает"""
+        if future.cancel():
+            attempt.close()
+        else:
+            attempt.cancel()
+
+    def call(self, model_name, send, job=None, guard=None):
+        """Выполняет запрос с хеджированием, возвращает requests.Response.
+
+        guard(attempt) - контекстный менеджер, под которым идёт дубликат:
+        место в очереди к API и память под тело запроса, как у любого
+        другого запроса к шлюзу (первая попытка уже идёт под ними).
+        """
+        with self._lock:
+            self.requests += 1
+
+        hedge_after = self.delay(model_name)
+        if hedge_after is None:
+            started = time.time()
+            response = send(job)
+            self.record(model_name, time.time() - started)
+            return response
+
+        # В статистику идёт задержка первой попытки: если побеждает дубликат,
+        # она цензурируется временем до его ответа. Задержки победителей
+        # занижали бы перцентиль, и дубликаты отправлялись бы всё раньше
+        attempts = {}
+        primary_started = time.time()
+        primary_job = job.child() if job else Job()
+        primary = self._executor.submit(self._attempt, send, primary_job)
+        attempts[primary] = primary_job
+        done, _ = wait([primary], timeout=hedge_after)
+        if done or not self._take_budget():
+            response, elapsed = primary.result()
+            self.record(model_name, elapsed)
+            return response
+
+        print(f"⏱ Хедж: {model_name} не ответила за {hedge_after:.2f} с, отправляем дубликат")
+        hedge_job = job.child() if job else Job()
+        hedge = self._executor.submit(self._attempt, send, hedge_job, guard)
+        attempts[hedge] = hedge_job
+        pending = {primary, hedge}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    first_error = first_error or future.exception()
+                    continue
+                for other in pending:
+                    self._discard(other, attempts[other])
+                response, elapsed = future.result()
+                self.record(model_name, elapsed if future is primary else time.time() - primary_started)
+                if future is hedge:
+                    with self._lock:
+                        self.hedge_wins += 1
+                return response
+        raise first_error
+
+    def stats(self):
+        with self._lock:
+            models = {
+                model_name: {
+                    'samples': len(samples),
+                    f'p{self.percentile}_latency': round(percentile(samples, self.percentile), 3) if samples else None
+                }
+                for model_name, samples in self.latencies.items()
+            }
+            return {
+                'percentile': self.percentile,
+                'budget': self.budget,
+                'requests': self.requests,
+                'hedged': self.hedged,
+                'hedge_wins': self.hedge_wins,
+                'skipped_by_budget': self.skipped_by_budget,
+                'hedge_rate': round(self.hedged / self.requests * 100, 2) if self.requests else 0,
+                'models': models
+            }
@@ -0,0 +1,81 @@
+"""Перцептивное хеширование изображений и поиск почти-дубликатов.
+
+dHash считается через Pillow + NumPy: изображение уменьшается до (N+1)xN
+в оттенках серого, и каждый бит хеша - это сравнение соседних пикселей.
+Пересохранённые копии и почти одинаковые кадры дают хеши, отличающиеся
+на несколько бит, поэтому сравнение идёт по расстоянию Хэмминга.
+"""
+import threading
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8  # 8x8 = 64 бита, хеш помещается в один uint64
+
+# Таблица popcount для байтов - NumPy < 2.0 не умеет считать биты напрямую
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def dhash(image_source, hash_size=HASH_SIZE):
+    """Вычисляет dHash изображения (путь или файловый объект) как int"""
+    with Image.open(image_source) as image:
+        # draft() позволяет JPEG-декодеру сразу декодировать в уменьшенном масштабе,
+        # это основной выигрыш по скорости на больших фотографиях
+        image.draft('L', (hash_size * 8, hash_size * 8))
+        small = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+        pixels = np.asarray(small, dtype=np.int16)
+
+    diff = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(diff.ravel()).tobytes(), 'big')
+
+
+def hamming_distances(hashes, target):
+    """Векторно считает расстояния от target до каждого хеша из массива uint64"""
+    xored = np.bitwise_xor(hashes, np.uint64(target))
+    return _POPCOUNT_TABLE[xored.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class PerceptualIndex:
+    """Индекс перцептивных хешей с поиском ближайшего соседа по Хэммингу.
+
+    Хеши хранятся в непрерывном массиве uint64, поэтому поиск - это один
+    XOR + popcount по всему массиву, без циклов на Python. Для каждого хеша
+    хранится произвольный payload (например, результат анализа).
+    """
+
+    def __init__(self, capacity=1024, max_items=None):
+        self._hashes = np.zeros(capacity, dtype=np.uint64)
+        self._payloads = []
+        self._size = 0
+        self._max_items = max_items
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def add(self, image_hash, payload):
+        with self._lock:
+            if self._max_items and self._size >= self._max_items:
+                # Вытесняем самую старую половину, чтобы не копировать массив на каждой вставке
+                keep = self._size // 2
+                self._hashes[:keep] = self._hashes[self._size - keep:self._size]
+                self._payloads = self._payloads[self._size - keep:]
+                self._size = keep
+            if self._size == len(self._hashes):
+                self._hashes = np.concatenate([self._hashes, np.zeros_like(self._hashes)])
+            self._hashes[self._size] = np.uint64(image_hash)
+            self._payloads.append(payload)
+            self._size += 1
+
+    def find(self, image_hash, threshold):
+        """Возвращает (payload, distance) ближайшего хеша в пределах порога или None"""
+        with self._lock:
+            if not self._size:
+                return None
+            distances = hamming_distances(self._hashes[:self._size], image_hash)
+            best = int(np.argmin(distances))
+            distance = int(distances[best])
+            if distance > threshold:
+                return None
+            return self._payloads[best], distance
+
@@ -0,0 +1,360 @@
+"""Задания обработки: дедлайны и отмена запросов к моделям.
+
+Запуск на клиенте - это задание (jobId), а каждый HTTP-запрос к серверу -
+его часть со своим дедлайном. Дедлайн превращается в таймауты запросов к
+API, а отмена задания (кнопкой, при закрытии страницы или по истечении
+аренды, если клиент пропал) прерывает и очередь, и уже идущие HTTP-запросы:
+соединения задания закрываются на уровне сокетов. Часть задания, чей
+клиент закрыл соединение, отменяется сразу (DisconnectWatcher).
+"""
+import selectors
+import socket
+import ssl
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Причина отмены части задания, чей клиент закрыл соединение
+DISCONNECTED = 'disconnected'
+
+
+class JobCancelledError(Exception):
+    """Задание отменено или его дедлайн истёк"""
+
+    def __init__(self, job_id, reason):
+        self.job_id = job_id
+        self.reason = reason
+        if reason == 'cancelled':
+            message = f"Задание {job_id} отменено"
+        elif reason == DISCONNECTED:
+            message = f"Клиент задания {job_id} закрыл соединение"
+        else:
+            message = f"Истекло время задания {job_id}"
+        super().__init__(message)
+
+
+def _tracking_pool(pool_cls, job):
+    """Пул соединений urllib3, сообщающий заданию о выданных соединениях"""
+
+    class TrackingPool(pool_cls):
+        def _get_conn(self, timeout=None):
+            conn = super()._get_conn(timeout)
+            job._track(conn)
+            return conn
+
+        def _put_conn(self, conn):
+            job._untrack(conn)
+            super()._put_conn(conn)
+
+    return TrackingPool
+
+
+class _CancellableAdapter(HTTPAdapter):
+    def __init__(self, job):
+        self._job = job
+        super().__init__()
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: _tracking_pool(pool_cls, self._job)
+            for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+
+class Job:
+    """Задание или его часть (parent) с дедлайном и отменой.
+
+    Отмена задания отменяет все его части; истечение дедлайна части
+    отменяет только её. tenant и interactive - чей это запрос и идёт ли
+    он по приоритетной полосе справедливой очереди (см. fair_queue).
+    """
+
+    def __init__(self, job_id=None, deadline=None, parent=None, tenant='anonymous', interactive=False):
+        self.id = job_id or (parent.id if parent else 'anonymous')
+        self.parent = parent
+        self.tenant = tenant
+        self.interactive = interactive
+        self.deadline = deadline
+        if parent and parent.deadline is not None:
+            self.deadline = parent.deadline if deadline is None else min(deadline, parent.deadline)
+        self.reason = None
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._children = set()
+        self._sessions = {}
+
+    @property
+    def cancelled(self):
+        if not self._cancelled.is_set() and self.parent is not None and self.parent.cancelled:
+            self.cancel(self.parent.reason)
+        return self._cancelled.is_set()
+
+    def remaining(self):
+        return None if self.deadline is None else self.deadline - time.time()
+
+    def check(self):
+        """Бросает JobCancelledError, если задание отменено или дедлайн истёк"""
+        if not self.cancelled and self.deadline is not None and time.time() >= self.deadline:
+            self.cancel('deadline')
+        if self.cancelled:
+            raise JobCancelledError(self.id, self.reason)
+
+    def timeout(self, default):
+        """Таймаут запроса к API: не больше default и не дольше дедлайна"""
+        self.check()
+        remaining = self.remaining()
+        return default if remaining is None else max(0.1, min(default, remaining))
+
+    def child(self, deadline=None, tenant=None, interactive=False):
+        """Часть задания (например, один HTTP-запрос клиента) со своим дедлайном"""
+        child = Job(deadline=deadline, parent=self, tenant=tenant or self.tenant, interactive=interactive)
+        with self._lock:
+            self._children.add(child)
+        if self._cancelled.is_set():
+            child.cancel(self.reason)
+        return child
+
+    @property
+    def busy(self):
+        """Есть ли у задания незавершённые части (идущие HTTP-запросы клиента)"""
+        with self._lock:
+            return bool(self._children)
+
+    def session(self):
+        """requests.Session потока, чьи соединения закрываются при отмене
+
+        requests.Session не потокобезопасна, а части задания обращаются к API
+        из пула потоков (batch_infer), поэтому у каждого потока своя сессия.
+        """
+        thread_id = threading.get_ident()
+        with self._lock:
+            session = self._sessions.get(thread_id)
+            if session is None:
+                session = requests.Session()
+                adapter = _CancellableAdapter(self)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[thread_id] = session
+            return session
+
+    def _track(self, conn):
+        with self._lock:
+            self._connections.add(conn)
+        if self._cancelled.is_set():
+            self._abort(conn)
+
+    def _untrack(self, conn):
+        with self._lock:
+            self._connections.discard(conn)
+
+    @staticmethod
+    def _abort(conn):
+        # shutdown() будит поток, заблокированный на чтении ответа (close() - нет)
+        sock = getattr(conn, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def cancel(self, reason='cancelled'):
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self.reason = reason
+            self._cancelled.set()
+            connections = list(self._connections)
+            children = list(self._children)
+        for conn in connections:
+            self._abort(conn)
+        for child in children:
+            child.cancel(reason)
+
+    def close(self):
+        """Завершает часть задания и освобождает её соединения"""
+        if self.parent is not None:
+            with self.parent._lock:
+                self.parent._children.discard(self)
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            session.close()
+
+
+class JobRegistry:
+    """Задания клиентов по jobId с арендой.
+
+    Каждый запрос задания и heartbeat продлевают аренду; задание, которое
+    клиент не продлил вовремя (страница закрыта без sendBeacon, сеть
+    пропала), отменяется фоновым потоком. Пока у задания идут запросы,
+    аренда продлевается сама: клиент, который не шлёт heartbeat, всё ещё
+    ждёт ответа, а пропавшего клиента такого запроса отменяет DisconnectWatcher.
+    """
+
+    def __init__(self, lease_seconds=30, sweep_interval=5):
+        self.lease_seconds = lease_seconds
+        self.sweep_interval = sweep_interval
+        self._jobs = {}
+        self._leases = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_reaper(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._reap_loop, name='job-reaper', daemon=True)
+            self._thread.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            now = time.time()
+            with self._lock:
+                jobs = []
+                for job_id, lease in list(self._leases.items()):
+                    if lease >= now:
+                        continue
+                    job = self._jobs[job_id]
+                    if not job.cancelled and job.busy:
+                        self._leases[job_id] = now + self.lease_seconds
+                        continue
+                    jobs.append(self._jobs.pop(job_id))
+                    del self._leases[job_id]
+            for job in jobs:
+                job.cancel()
+                job.close()
+
+    def begin(self, job_id=None, job_deadline=None, request_deadline=None, tenant='anonymous', interactive=False):
+        """Часть задания для одного HTTP-запроса; дедлайны - в секундах от текущего момента
+
+        Без job_id создаётся отдельное задание только для этого запроса.
+        Дедлайн задания задаётся первым запросом задания. interactive
+        действует только для первого запроса задания (разовая проверка) -
+        следующие запросы того же задания идут как пакетные.
+        """
+        now = time.time()
+        if not job_id:
+            return Job(deadline=now + request_deadline if request_deadline else None, tenant=tenant, interactive=interactive)
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = Job(job_id, now + job_deadline if job_deadline else None, tenant=tenant)
+                self._jobs[job_id] = job
+            else:
+                interactive = False
+            if not job.cancelled:
+                self._leases[job_id] = now + self.lease_seconds
+            self._ensure_reaper()
+        return job.child(now + request_deadline if request_deadline else None, tenant, interactive)
+
+    def heartbeat(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.cancelled:
+                return False
+            self._leases[job_id] = time.time() + self.lease_seconds
+            return True
+
+    def cancel(self, job_id):
+        # Отменённое задание остаётся в реестре до конца аренды, чтобы
+        # запоздавшие запросы с тем же jobId сразу получали отмену
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        print(f"⏹ Задание {job_id} отменено клиентом")
+        job.cancel()
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active_jobs': sum(1 for job in self._jobs.values() if not job.cancelled),
+                'cancelled_jobs': sum(1 for job in self._jobs.values() if job.cancelled)
+            }
+
+
+class DisconnectWatcher:
+    """Отменяет часть задания, как только клиент закрыл её HTTP-соединение.
+
+    WSGI-сервер узнаёт о разрыве только при записи ответа, поэтому сокеты
+    запросов, которые ещё обрабатываются, опрашиваются фоновым потоком:
+    закрытое клиентом соединение читается как EOF. Сокет берётся из
+    WSGI-окружения (werkzeug.socket - сервер разработки, gunicorn.socket -
+    gunicorn). Без доступа к сокету (другой сервер, TLS на самом сервере)
+    разрыв обнаруживается по истечении аренды задания.
+    """
+
+    SOCKET_KEYS = ('werkzeug.socket', 'gunicorn.socket')
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.disconnects = 0
+        self._watched = {}  # часть задания -> сокет клиента
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, environ, job):
+        """Следит за соединением запроса; False - сокет недоступен"""
+        sock = next((environ[key] for key in self.SOCKET_KEYS if environ.get(key) is not None), None)
+        # Заглянуть в TLS-сокет без чтения (MSG_PEEK) нельзя
+        if sock is None or isinstance(sock, ssl.SSLSocket):
+            return False
+        with self._lock:
+            self._watched[job] = sock
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._watch_loop, name='disconnect-watcher', daemon=True)
+                self._thread.start()
+        return True
+
+    def unwatch(self, job):
+        with self._lock:
+            self._watched.pop(job, None)
+
+    @staticmethod
+    def _closed(sock):
+        # Тело запроса уже прочитано: читаемый сокет без данных - это EOF
+        try:
+            return sock.recv(1, socket.MSG_PEEK) == b''
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+
+    def _sweep(self):
+        with self._lock:
+            watched = list(self._watched.items())
+        if not watched:
+            return
+        disconnected = []
+        with selectors.DefaultSelector() as selector:
+            for job, sock in watched:
+                try:
+                    selector.register(sock, selectors.EVENT_READ, job)
+                except (ValueError, OSError):
+                    # Сокет уже закрыт сервером - запрос завершается сам
+                    continue
+            for key, _ in selector.select(timeout=0):
+                if self._closed(key.fileobj):
+                    disconnected.append(key.data)
+        for job in disconnected:
+            self.unwatch(job)
+            if not job.cancelled:
+                with self._lock:
+                    self.disconnects += 1
+                print(f"⚠ Клиент задания {job.id} закрыл соединение - запрос отменён")
+                job.cancel(DISCONNECTED)
+
+    def _watch_loop(self):
+        while True:
+            time.sleep(self.interval)
+            self._sweep()
+
+    def stats(self):
+        with self._lock:
+            return {'watched_requests': len(self._watched), 'disconnects': self.disconnects}
@@ -0,0 +1,117 @@
+"""Пул API-ключей корпоративного API.
+
+Квота шлюза считается на ключ, поэтому при нескольких ключах запросы
+распределяются между ними: выбирается наименее загруженный ключ, ключ,
+получивший 401/403 или 429, временно выводится из ротации (карантин).
+"""
+import threading
+import time
+from collections import deque
+
+# Коды ответа, после которых ключ уходит в карантин
+AUTH_ERROR_CODES = (401, 403)
+RATE_LIMIT_CODE = 429
+# Коды, при которых запрос имеет смысл повторить другим ключом
+REKEY_STATUS_CODES = AUTH_ERROR_CODES + (RATE_LIMIT_CODE,)
+
+
+class APIKeyPool:
+    """Выбор ключа по нагрузке с карантином и учётом частоты запросов.
+
+    rate_limit - запросов в минуту на ключ (None - без ограничения): ключ,
+    исчерпавший минутную квоту, выбирается только если других нет.
+    """
+
+    def __init__(self, keys, rate_limit=None, auth_quarantine=300, rate_quarantine=30):
+        self.rate_limit = rate_limit
+        self.auth_quarantine = auth_quarantine
+        self.rate_quarantine = rate_quarantine
+        self._lock = threading.Lock()
+        self._keys = [
+            {
+                'key': key,
+                'in_flight': 0,
+                'requests': 0,
+                'recent': deque(),
+                'auth_errors': 0,
+                'rate_limited': 0,
+                'quarantined_until': 0.0
+            }
+            for key in dict.fromkeys(keys)
+        ]
+
+    def __len__(self):
+        return len(self._keys)
+
+    @staticmethod
+    def _label(key):
+        return f"…{key[-4:]}" if len(key) > 8 else "…"
+
+    def _recent_count(self, state, now):
+        while state['recent'] and state['recent'][0] < now - 60:
+            state['recent'].popleft()
+        return len(state['recent'])
+
+    def acquire(self, exclude=()):
+        """Выдаёт наименее загруженный доступный ключ (и отмечает запрос)"""
+        now = time.time()
+        with self._lock:
+            candidates = [s for s in self._keys if s['key'] not in exclude] or self._keys
+
+            def rank(state):
+                quarantined = state['quarantined_until'] > now
+                over_quota = self.rate_limit is not None and self._recent_count(state, now) >= self.rate_limit
+                # Ключи в карантине - только если других нет, и тот, что выйдет раньше
+                return (
+                    quarantined,
+                    state['quarantined_until'] if quarantined else 0,
+                    over_quota,
+                    state['in_flight'],
+                    self._recent_count(state, now)
+                )
+
+            state = min(candidates, key=rank)
+            state['in_flight'] += 1
+            state['requests'] += 1
+            state['recent'].append(now)
+            return state['key']
+
+    def release(self, key, status_code=None, retry_after=None):
+        """Запрос ключом завершён; по коду ответа ключ может уйти в карантин"""
+        with self._lock:
+            state = next(s for s in self._keys if s['key'] == key)
+            state['in_flight'] -= 1
+            if status_code in AUTH_ERROR_CODES:
+                state['auth_errors'] += 1
+                state['quarantined_until'] = time.time() + self.auth_quarantine
+                print(f"⚠ Ключ {self._label(key)} отклонён шлюзом ({status_code}), карантин {self.auth_quarantine} с")
+            elif status_code == RATE_LIMIT_CODE:
+                state['rate_limited'] += 1
+                pause = retry_after if retry_after else self.rate_quarantine
+                state['quarantined_until'] = time.time() + pause
+                print(f"⚠ Ключ {self._label(key)} упёрся в лимит шлюза, карантин {pause} с")
+
+    def has_alternative(self, exclude):
+        """Есть ли ключ не из exclude и не в карантине"""
+        now = time.time()
+        with self._lock:
+            return any(s['key'] not in exclude and s['quarantined_until'] <= now for s in self._keys)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                'rate_limit_per_minute': self.rate_limit,
+                'keys': [
+                    {
+                        'key': self._label(state['key']),
+                        'in_flight': state['in_flight'],
+                        'requests': state['requests'],
+                        'requests_last_minute': self._recent_count(state, now),
+                        'auth_errors': state['auth_errors'],
+                        'rate_limited': state['rate_limited'],
+                        'quarantined_for': round(max(0.0, state['quarantined_until'] - now), 1)
+                    }
+                    for state in self._keys
+                ]
+            }
@@ -0,0 +1,134 @@
+"""Сопоставление ответа модели с классами бинарной классификации.
+
+Ответ и названия классов нормализуются (Unicode NFKC, регистр, ё -> е,
+пунктуация), разбиваются на слова и сравниваются по словам с учётом
+окончаний ("самолёта", "самолеты" - это "самолет"). Отрицание перед
+названием класса ("не самолёт", "это не птица") засчитывается
+противоположному классу. Сопоставитель строится один раз на конфигурацию
+классов (matcher_for) и кеширует ответы, поэтому пересчёт метрик по
+большому числу результатов не разбирает одни и те же строки заново.
+"""
+import re
+import unicodedata
+from functools import lru_cache
+
+POSITIVE = 'positive'
+NEGATIVE = 'negative'
+
+# Слова-отрицания и сколько слов между отрицанием и названием класса допускается
+NEGATION_WORDS = frozenset({'не', 'нет', 'ни', 'без', 'no', 'not', 'non', 'without'})
+NEGATION_WINDOW = 2
+
+# Конечные гласные, отбрасываемые при сравнении слов ("птица" / "птицы")
+_FLEXION_ENDINGS = 'аяоеёиыуюьй'
+# Сколько букв окончания может быть у слова ответа сверх основы класса
+_MAX_SUFFIX = 3
+_WORD_RE = re.compile(r'\w+')
+_CACHE_LIMIT = 65536
+
+
+def normalize(text):
+    """Слова текста в нормальной форме: NFKC, casefold, ё -> е"""
+    text = unicodedata.normalize('NFKC', text or '').casefold().replace('ё', 'е')
+    return _WORD_RE.findall(text)
+
+
+def normalize_answer(text):
+    """Ответ для сравнения как строка: 'Самолёт!' и 'самолет' совпадают"""
+    return ' '.join(normalize(text))
+
+
+def _stem(word):
+    if len(word) > 4 and word[-1] in _FLEXION_ENDINGS:
+        return word[:-1]
+    return word
+
+
+def split_synonyms(value):
+    """Синонимы класса из строки через запятую или списка"""
+    if isinstance(value, str):
+        value = value.split(',')
+    return tuple(item.strip() for item in value or () if item.strip())
+
+
+class LabelMatcher:
+    """Определяет, к какому классу относится ответ: 'positive', 'negative' или None.
+
+    None - ответ не похож ни на один класс или упоминает оба без отрицания.
+    Название класса, само начинающееся с отрицания ("Не самолет"),
+    сопоставляется целиком и не считается отрицанием другого класса.
+    """
+
+    def __init__(self, positive_class, negative_class, positive_synonyms=(), negative_synonyms=()):
+        phrases = []
+        for label, names in ((POSITIVE, (positive_class, *positive_synonyms)), (NEGATIVE, (negative_class, *negative_synonyms))):
+            for name in names:
+                words = tuple(_stem(word) for word in normalize(name))
+                if words:
+                    phrases.append((words, label))
+        # Длинные фразы первыми: "не самолет" должна поглотить вложенное "самолет"
+        self._phrases = sorted(set(phrases), key=lambda phrase: -len(phrase[0]))
+        self._cache = {}
+
+    @staticmethod
+    def _word_matches(word, stem):
+        word = _stem(word)
+        if word == stem:
+            return True
+        return len(stem) >= 4 and word.startswith(stem) and len(word) - len(stem) <= _MAX_SUFFIX
+
+    def _occurrences(self, words, phrase):
+        size = len(phrase)
+        for start in range(len(words) - size + 1):
+            if all(self._word_matches(words[start + k], phrase[k]) for k in range(size)):
+                yield start, start + size
+
+    def _classify(self, answer):
+        words = normalize(answer)
+        covered = [False] * len(words)
+        votes = set()
+        for phrase, label in self._phrases:
+            for start, end in self._occurrences(words, phrase):
+                if any(covered[start:end]):
+                    continue
+                covered[start:end] = [True] * (end - start)
+                negated = phrase[0] not in NEGATION_WORDS and any(
+                    word in NEGATION_WORDS for word in words[max(0, start - NEGATION_WINDOW):start]
+                )
+                if negated:
+                    label = NEGATIVE if label == POSITIVE else POSITIVE
+                votes.add(label)
+        return votes.pop() if len(votes) == 1 else None
+
+    def match(self, answer):
+        """Класс ответа модели ('positive' / 'negative') или None"""
+        label = self._cache.get(answer, False)
+        if label is False:
+            label = self._classify(answer)
+            if len(self._cache) >= _CACHE_LIMIT:
+                self._cache.clear()
+            self._cache[answer] = label
+        return label
+
+    def match_many(self, answers):
+        """Классы для списка ответов (одинаковые ответы разбираются один раз)"""
+        return [self.match(answer) for answer in answers]
+
+    def is_correct(self, answer, ground_truth):
+        return ground_truth in (POSITIVE, NEGATIVE) and self.match(answer) == ground_truth
+
+
+@lru_cache(maxsize=64)
+def _cached_matcher(positive_class, negative_class, positive_synonyms, negative_synonyms):
+    return LabelMatcher(positive_class, negative_class, positive_synonyms, negative_synonyms)
+
+
+def matcher_for(classification_settings):
+    """Сопоставитель для настроек классификации (один на конфигурацию классов)"""
+    settings = classification_settings or {}
+    return _cached_matcher(
+        settings.get('positiveClass', 'Самолет'),
+        settings.get('negativeClass', 'Не самолет'),
+        split_synonyms(settings.get('positiveSynonyms')),
+        split_synonyms(settings.get('negativeSynonyms'))
+    )
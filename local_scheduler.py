@@ -0,0 +1,111 @@
+"""Планировщик пакетной обработки для локальных бэкендов LM Studio.
+
+У локального LM Studio в памяти помещается одна (или несколько) моделей,
+а загрузка 4B VLM занимает секунды. Поэтому пакет обрабатывается
+"по моделям": каждая модель загружается один раз и прогоняет все
+изображения, после чего планировщик переходит к следующей.
+"""
+import threading
+import time
+
+
+class ModelMajorScheduler:
+    """Группирует работу по моделям и упорядочивает модели по стоимости.
+
+    Для каждой модели запоминается среднее время загрузки и инференса
+    (экспоненциальное сглаживание), по ним оценивается стоимость пакета.
+    Общее время пакета сокращается тем, что каждая модель загружается
+    ровно один раз, а уже загруженные модели идут первыми - для них
+    загрузка бесплатна, и их не приходится вытеснять и загружать снова.
+    Остальные сортируются по возрастанию оценки времени (кратчайшая
+    задача первой), чтобы результаты первых моделей приходили раньше.
+    """
+
+    def __init__(self, default_load_time=10.0, default_inference_time=2.0, smoothing=0.3):
+        self.default_load_time = default_load_time
+        self.default_inference_time = default_inference_time
+        self.smoothing = smoothing
+        self.load_times = {}
+        self.inference_times = {}
+        self._lock = threading.Lock()
+
+    def _update(self, table, model_name, value):
+        with self._lock:
+            previous = table.get(model_name)
+            table[model_name] = value if previous is None else previous + self.smoothing * (value - previous)
+
+    def record_load(self, model_name, seconds):
+        self._update(self.load_times, model_name, seconds)
+
+    def record_inference(self, model_name, seconds):
+        self._update(self.inference_times, model_name, seconds)
+
+    def estimate(self, model_name, images_count, loaded=False):
+        """Оценка времени обработки пакета моделью в секундах"""
+        load_time = 0 if loaded else self.load_times.get(model_name, self.default_load_time)
+        return load_time + images_count * self.inference_times.get(model_name, self.default_inference_time)
+
+    def order_models(self, models, images_count, loaded_models=()):
+        """Порядок моделей, минимизирующий число загрузок и время до первых результатов"""
+        loaded = [m for m in models if m in loaded_models]
+        others = sorted(
+            (m for m in models if m not in loaded_models),
+            key=lambda m: self.estimate(m, images_count)
+        )
+        return loaded + others
+
+    def run_batches(self, models, images_count, load_model, process, loaded_models=(), cancelled=None):
+        """Обрабатывает пакет всеми моделями, загружая каждую модель один раз.
+
+        load_model(model_name) - контекстный менеджер, выдающий handle модели
+        (или бросающий исключение, если модель недоступна);
+        process(handle, model_name) возвращает список из images_count
+        результатов - так модель может сама упаковывать запросы.
+        cancelled() - признак отмены: оставшиеся модели не загружаются.
+        Возвращает (results[model_name] - список результатов, статистика).
+        """
+        order = self.order_models(models, images_count, loaded_models)
+        results = {}
+        stats = {
+            'order': order,
+            'estimated_time': round(sum(self.estimate(m, images_count, m in loaded_models) for m in order), 2),
+            'models': {}
+        }
+        started = time.time()
+
+        for model_name in order:
+            model_stats = {'load_time': 0, 'inference_time': 0, 'images': 0}
+            stats['models'][model_name] = model_stats
+            if cancelled is not None and cancelled():
+                model_stats['error'] = 'cancelled'
+                results[model_name] = [{
+                    "error": "Обработка отменена",
+                    "cancelled": True,
+                    "model": model_name
+                } for _ in range(images_count)]
+                continue
+            load_started = time.time()
+            try:
+                with load_model(model_name) as handle:
+                    model_stats['load_time'] = round(time.time() - load_started, 3)
+                    if model_name not in loaded_models:
+                        self.record_load(model_name, model_stats['load_time'])
+
+                    inference_started = time.time()
+                    results[model_name] = process(handle, model_name)
+                    elapsed = time.time() - inference_started
+                    successful = sum(1 for r in results[model_name] if "error" not in r)
+                    if successful:
+                        self.record_inference(model_name, elapsed / len(results[model_name]))
+                    model_stats['inference_time'] = round(elapsed, 3)
+                    model_stats['images'] = len(results[model_name])
+            except Exception as e:
+                print(f"✗ Модель {model_name} недоступна: {e}")
+                model_stats['error'] = str(e)
+                results[model_name] = [{
+                    "error": f"Модель {model_name} недоступна: {e}",
+                    "model": model_name
+                } for _ in range(images_count)]
+
+        stats['total_time'] = round(time.time() - started, 3)
+        return results, stats
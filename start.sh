@@ -74,10 +74,10 @@ echo ""
 
 # Запуск приложения
 echo -e "${BLUE}🌐 Запуск Flask приложения...${NC}"
-echo -e "${YELLOW}   Откройте браузер: http://127.0.0.1:5001${NC}"
+echo -e "${YELLOW}   Откройте браузер: http://127.0.0.1:${PORT:-5003}${NC}"
 echo ""
 echo -e "${GREEN}💡 Возможности:${NC}"
-echo "   • Загрузка до 35 изображений одновременно"
+echo "   • Загрузка датасетов до ${MAX_UPLOAD_FILES:-20000} изображений"
 echo "   • Автоматический выбор всех доступных VLM-моделей с vision"
 echo "   • Управление моделями из веб-интерфейса"
 echo "   • Последовательное сравнение всех моделей"
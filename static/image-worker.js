@@ -0,0 +1,40 @@
+// Web Worker для обработки изображений вне основного потока.
+// Сообщения:
+//   { id, type: 'thumbnail', file, maxSize }
+//   { id, type: 'resize', file, maxSize, format, quality }
+// Ответ: { id, blob, width, height, scaledWidth, scaledHeight } (исходные
+// размеры и размеры blob) или { id, error }
+
+async function scaleImage(file, maxSize, format, quality) {
+    const bitmap = await createImageBitmap(file);
+    const scale = Math.min(1, maxSize / Math.max(bitmap.width, bitmap.height));
+    const width = Math.max(1, Math.round(bitmap.width * scale));
+    const height = Math.max(1, Math.round(bitmap.height * scale));
+
+    const canvas = new OffscreenCanvas(width, height);
+    const ctx = canvas.getContext('2d');
+    ctx.drawImage(bitmap, 0, 0, width, height);
+    const originalWidth = bitmap.width;
+    const originalHeight = bitmap.height;
+    bitmap.close();
+
+    const blob = await canvas.convertToBlob({ type: format, quality });
+    return { blob, width: originalWidth, height: originalHeight, scaledWidth: width, scaledHeight: height };
+}
+
+self.onmessage = async (e) => {
+    const { id, type, file, maxSize } = e.data;
+    try {
+        if (type === 'thumbnail') {
+            const result = await scaleImage(file, maxSize, 'image/jpeg', 0.8);
+            self.postMessage({ id, ...result });
+        } else if (type === 'resize') {
+            const result = await scaleImage(file, maxSize, e.data.format, e.data.quality);
+            self.postMessage({ id, ...result });
+        } else {
+            self.postMessage({ id, error: `Неизвестный тип задачи: ${type}` });
+        }
+    } catch (error) {
+        self.postMessage({ id, error: error.message });
+    }
+};
@@ -33,24 +33,81 @@ const refreshModelsBtn = document.getElementById('refreshModelsBtn');
 const modeSection = document.getElementById('modeSelection');
 const descriptionModeBtn = document.getElementById('descriptionModeBtn');
 const classificationModeBtn = document.getElementById('classificationModeBtn');
+const combinedModeBtn = document.getElementById('combinedModeBtn');
 const classificationSetup = document.getElementById('classificationSetup');
 const positiveClassInput = document.getElementById('positiveClass');
 const negativeClassInput = document.getElementById('negativeClass');
+const positiveSynonymsInput = document.getElementById('positiveSynonyms');
+const negativeSynonymsInput = document.getElementById('negativeSynonyms');
 const groundTruthSetup = document.getElementById('groundTruthSetup');
 const groundTruthImages = document.getElementById('groundTruthImages');
 
+// Параметры обработки
+const reuseNearDuplicatesInput = document.getElementById('reuseNearDuplicates');
+const nearDuplicateThresholdInput = document.getElementById('nearDuplicateThreshold');
+const packImagesInput = document.getElementById('packImages');
+const packSizeInput = document.getElementById('packSize');
+const concurrencyInput = document.getElementById('concurrency');
+const perModelConcurrencyInput = document.getElementById('perModelConcurrency');
+const cancelProcessingBtn = document.getElementById('cancelProcessingBtn');
+const resizeBeforeUploadInput = document.getElementById('resizeBeforeUpload');
+const uploadMaxDimensionInput = document.getElementById('uploadMaxDimension');
+const uploadFormatInput = document.getElementById('uploadFormat');
+const uploadQualityInput = document.getElementById('uploadQuality');
+const ensembleModeInput = document.getElementById('ensembleMode');
+const ensembleQuorumInput = document.getElementById('ensembleQuorum');
+const cascadeModeInput = document.getElementById('cascadeMode');
+const cascadeSizeInput = document.getElementById('cascadeSize');
+const scoringModeInput = document.getElementById('scoringMode');
+const jobDeadlineInput = document.getElementById('jobDeadline');
+const uploadLimitsHint = document.getElementById('uploadLimitsHint');
+
 let selectedFiles = [];
 let selectedModels = []; // Выбранные модели для обработки
 let availableModels = []; // Все доступные VLM модели
-let imagePreviews = {}; // Хранение base64 данных изображений для миниатюр
+let backendInfo = null; // Бэкенд сервера и его возможности (из /api/vlm-models)
+let imagePreviews = {}; // Object URL миниатюр изображений (отзываются при смене датасета)
 let groundTruth = {}; // Хранение правильных классов для изображений в режиме классификации
-const MAX_FILES = 35;
+let allResults = []; // Результаты последнего запуска: [изображение].models_results[модель]
+let processingController = null; // AbortController текущего запуска
+let currentJobId = null; // Задание текущего запуска на сервере (для отмены и дедлайна)
+let jobHeartbeatTimer = null;
+let warmupPollTimer = null; // Опрос /ready, пока сервер прогревает модели
+let resultsView = null; // Виртуализированный список результатов текущего запуска
+let uploadLimits = { max_files: 20000, max_total_mb: 0, max_pack_size: 8, max_request_mb: 128 }; // Лимиты загрузки (из /api/vlm-models, 0 - без ограничения)
+let selectedFilesByName = new Map(); // Имя файла -> File (миниатюры по требованию)
+let pendingThumbnails = new Set(); // Миниатюры, которые сейчас готовит Worker
+const PREVIEW_GRID_LIMIT = 200; // Сколько изображений показывать в сетке предпросмотра
+const JOB_HEARTBEAT_INTERVAL = 10000; // Продление аренды задания на сервере, мс
+const WARMUP_POLL_INTERVAL = 5000; // Опрос состояния прогрева моделей, мс
+const OVERLOAD_MAX_RETRIES = 6; // Повторы запроса, отклонённого сервером из-за перегрузки (429)
+const OVERLOAD_MAX_DELAY = 60000; // Максимальная пауза перед повтором, мс
+const THUMBNAIL_SIZE = 240; // Максимальная сторона миниатюры, px
+const RESULT_ROW_HEIGHT = 560; // Высота строки в виртуализированном списке результатов, px
+const RESULT_OVERSCAN = 2; // Сколько строк рендерить сверх видимых
+const ESCALATION_REASONS = {
+    error: 'ошибка',
+    no_class_match: 'ответ не совпал с классом',
+    low_confidence: 'неуверенный ответ',
+    disagreement: 'модели разошлись'
+};
+const MULTI_MODEL_CHUNK_SIZE = 8; // Изображений в одном запросе сразу ко всем моделям (ансамбль, каскад)
+
+// Web Worker для миниатюр
+let imageWorker = null; // null - ещё не создан, false - не поддерживается браузером
+let imageWorkerTasks = {};
+let imageWorkerTaskId = 0;
+let previewGeneration = 0; // Меняется при смене датасета, чтобы отбросить устаревшие миниатюры
+let preparedUploads = new Map(); // File -> { key, file, width, height } - копии для отправки на сервер и их размеры
+let originalDimensions = new WeakMap(); // File -> { width, height } - размеры оригинала (известны после миниатюры)
 
 // Переменные режима работы
-let currentMode = 'description'; // 'description' или 'classification'
+let currentMode = 'description'; // 'description', 'classification' или 'combined' (описание + классификация)
 let classificationSettings = {
     positiveClass: 'Самолет',
-    negativeClass: 'Не самолет'
+    negativeClass: 'Не самолет',
+    positiveSynonyms: '', // Синонимы классов через запятую (для проверки ответов на сервере)
+    negativeSynonyms: ''
 };
 
 // Загрузка списка VLM-моделей при старте
@@ -81,11 +138,15 @@ if (classificationModeBtn) {
     classificationModeBtn.addEventListener('click', () => setMode('classification'));
 }
 
+if (combinedModeBtn) {
+    combinedModeBtn.addEventListener('click', () => setMode('combined'));
+}
+
 // Обработчики настроек классификации
 if (positiveClassInput) {
     positiveClassInput.addEventListener('input', (e) => {
         classificationSettings.positiveClass = e.target.value.trim();
-        if (currentMode === 'classification') {
+        if (usesClassification()) {
             updateGroundTruthInterface(); // Обновляем интерфейс с новыми названиями классов
         }
     });
@@ -94,12 +155,24 @@ if (positiveClassInput) {
 if (negativeClassInput) {
     negativeClassInput.addEventListener('input', (e) => {
         classificationSettings.negativeClass = e.target.value.trim();
-        if (currentMode === 'classification') {
+        if (usesClassification()) {
             updateGroundTruthInterface(); // Обновляем интерфейс с новыми названиями классов
         }
     });
 }
 
+if (positiveSynonymsInput) {
+    positiveSynonymsInput.addEventListener('input', (e) => {
+        classificationSettings.positiveSynonyms = e.target.value.trim();
+    });
+}
+
+if (negativeSynonymsInput) {
+    negativeSynonymsInput.addEventListener('input', (e) => {
+        classificationSettings.negativeSynonyms = e.target.value.trim();
+    });
+}
+
 // Проверка активной модели
 if (checkModelBtn) {
     checkModelBtn.addEventListener('click', showActiveModel);
@@ -139,6 +212,11 @@ async function loadVLMModels() {
                     
                     if (data.status === 'ok') {
                         availableModels = data.models;
+                        backendInfo = data.backend || null;
+                        if (data.upload_limits) {
+                            uploadLimits = { ...uploadLimits, ...data.upload_limits };
+                            updateUploadLimitsHint();
+                        }
                         displayModelsSelection(data.models);
                         updateStatus('ready', `Найдено ${data.total} VLM-моделей`);
                         console.log('✅ Модели успешно загружены:', data.models);
@@ -227,7 +305,10 @@ function displayModelsSelection(models) {
                             <span class="model-quant">${model.quantization}</span>
                         </div>
                     </div>
-                    <div class="model-status-badge ${statusClass}">${statusText}</div>
+                    <div class="model-badges">
+                        <div class="model-warmup-badge" data-warmup-model="${model.id}"></div>
+                        <div class="model-status-badge ${statusClass}">${statusText}</div>
+                    </div>
                 </label>
             </div>
         `;
@@ -241,6 +322,50 @@ function displayModelsSelection(models) {
     });
     
     updateControlButtons();
+    loadWarmupStatus();
+}
+
+async function loadWarmupStatus() {
+    // Состояние прогрева моделей на сервере; /ready отвечает 503, пока прогрев не завершён
+    clearTimeout(warmupPollTimer);
+    let data = null;
+    try {
+        const response = await fetch('/ready', { headers: { 'Accept': 'application/json' } });
+        data = await response.json();
+    } catch (error) {
+        console.warn('Не удалось получить состояние прогрева:', error);
+    }
+    if (data) {
+        updateWarmupBadges(data.models || {});
+    }
+    if (!data || data.warming || Object.keys(data.models || {}).length === 0) {
+        warmupPollTimer = setTimeout(loadWarmupStatus, WARMUP_POLL_INTERVAL);
+    }
+}
+
+function updateWarmupBadges(models) {
+    document.querySelectorAll('.model-warmup-badge').forEach(badge => {
+        const entry = models[badge.dataset.warmupModel];
+        badge.className = 'model-warmup-badge';
+        if (!entry) {
+            badge.textContent = '';
+            badge.removeAttribute('title');
+            return;
+        }
+        const latency = value => value === null || value === undefined ? '—' : `${value.toFixed(1)} с`;
+        const labels = {
+            warming: 'Прогрев…',
+            ready: `⚡ ${latency(entry.warm_latency)}`,
+            degraded: `🐢 ${latency(entry.warm_latency)}`,
+            unavailable: 'Не отвечает'
+        };
+        badge.classList.add(entry.state);
+        badge.textContent = labels[entry.state] || entry.state;
+        badge.title = entry.state === 'warming'
+            ? 'Модель прогревается'
+            : `Первый запрос: ${latency(entry.cold_latency)}, повторный: ${latency(entry.warm_latency)}`
+                + (entry.error ? `\n${entry.error}` : '');
+    });
 }
 
 function handleModelSelection(e) {
@@ -276,14 +401,14 @@ function updateSelectedModelsInfo() {
 function updateStartButton() {
     const hasFiles = selectedFiles.length > 0;
     const hasModels = selectedModels.length > 0;
-    const hasGroundTruth = currentMode !== 'classification' || Object.keys(groundTruth).length === selectedFiles.length;
+    const hasGroundTruth = !usesClassification() || Object.keys(groundTruth).length === selectedFiles.length;
     startProcessingBtn.disabled = !(hasFiles && hasModels && hasGroundTruth);
 }
 
 function updateGroundTruthInterface() {
     console.log('updateGroundTruthInterface called, mode:', currentMode, 'files:', selectedFiles.length);
     
-    if (currentMode !== 'classification' || !selectedFiles.length) {
+    if (!usesClassification() || !selectedFiles.length) {
         console.log('Hiding ground truth interface');
         groundTruthImages.innerHTML = '';
         return;
@@ -315,7 +440,7 @@ function updateGroundTruthInterface() {
         console.log('Creating item for file:', file.name, 'preview exists:', !!imagePreview);
         
         imageItem.innerHTML = `
-            <img src="${imagePreview}" alt="${file.name}" style="width: 100%; height: 120px; object-fit: cover; border-radius: 6px; margin-bottom: 10px; border: 1px solid #ddd;">
+            ${imagePreview ? `<img src="${imagePreview}" alt="${file.name}" style="width: 100%; height: 120px; object-fit: cover; border-radius: 6px; margin-bottom: 10px; border: 1px solid #ddd;">` : ''}
             <div style="font-size: 12px; color: #666; margin-bottom: 10px; text-align: center; font-weight: 500;">${index + 1}. ${file.name.length > 15 ? file.name.substring(0, 12) + '...' : file.name}</div>
             <div style="display: flex; gap: 8px; justify-content: center;">
                 <label style="display: flex; align-items: center; gap: 4px; cursor: pointer; font-size: 13px; color: #28a745; font-weight: 500; padding: 4px 8px; border-radius: 4px; transition: all 0.2s ease;">
@@ -363,12 +488,15 @@ function setMode(mode) {
     // Обновляем активные кнопки
     descriptionModeBtn.classList.toggle('active', mode === 'description');
     classificationModeBtn.classList.toggle('active', mode === 'classification');
+    if (combinedModeBtn) {
+        combinedModeBtn.classList.toggle('active', mode === 'combined');
+    }
     
     // Показываем/скрываем настройки классификации
-    classificationSetup.style.display = mode === 'classification' ? 'block' : 'none';
+    classificationSetup.style.display = usesClassification(mode) ? 'block' : 'none';
     
     // Показываем/скрываем ground truth setup и обновляем его
-    if (mode === 'classification') {
+    if (usesClassification(mode)) {
         groundTruthSetup.style.display = 'block';
         updateGroundTruthInterface();
     } else {
@@ -376,12 +504,27 @@ function setMode(mode) {
     }
     
     // Обновляем плейсхолдеры в настройках
-    if (mode === 'classification') {
+    if (usesClassification(mode)) {
         positiveClassInput.value = classificationSettings.positiveClass;
         negativeClassInput.value = classificationSettings.negativeClass;
     }
     
-    showNotification(`Режим переключен на: ${mode === 'description' ? 'Описание объектов' : 'Бинарная классификация'}`, 'info');
+    const modeNames = {
+        description: 'Описание объектов',
+        classification: 'Бинарная классификация',
+        combined: 'Описание + классификация'
+    };
+    showNotification(`Режим переключен на: ${modeNames[mode]}`, 'info');
+}
+
+// Нужны ли в режиме классы и разметка ground truth
+function usesClassification(mode = currentMode) {
+    return mode === 'classification' || mode === 'combined';
+}
+
+// Оценка вероятности одним токеном - только в режиме классификации
+function usesScoring() {
+    return currentMode === 'classification' && Boolean(scoringModeInput && scoringModeInput.checked);
 }
 
 function updateModelStatus(modelId, loaded) {
@@ -512,7 +655,8 @@ fileInput.addEventListener('change', (e) => {
 
 removeBtn.addEventListener('click', () => {
     selectedFiles = [];
-    imagePreviews = {};
+    revokeImagePreviews();
+    preparedUploads = new Map();
     groundTruth = {}; // Очищаем ground truth
     previewContainer.style.display = 'none';
     dropZoneContent.style.display = 'flex';
@@ -527,6 +671,162 @@ removeBtn.addEventListener('click', () => {
 
 // Обработка запуска обработки
 startProcessingBtn.addEventListener('click', processDatasetWithModels);
+if (cancelProcessingBtn) {
+    cancelProcessingBtn.addEventListener('click', cancelProcessing);
+}
+
+// Web Worker для обработки изображений (создаётся при первом обращении)
+function getImageWorker() {
+    if (imageWorker === null) {
+        if (typeof Worker === 'undefined' || typeof OffscreenCanvas === 'undefined') {
+            imageWorker = false;
+            return null;
+        }
+        imageWorker = new Worker('/static/image-worker.js');
+        imageWorker.onmessage = (e) => {
+            const task = imageWorkerTasks[e.data.id];
+            delete imageWorkerTasks[e.data.id];
+            if (!task) {
+                return;
+            }
+            if (e.data.error) {
+                task.reject(new Error(e.data.error));
+            } else {
+                task.resolve(e.data);
+            }
+        };
+    }
+    return imageWorker || null;
+}
+
+function runImageWorkerTask(message) {
+    const worker = getImageWorker();
+    if (!worker) {
+        return Promise.reject(new Error('Web Worker недоступен'));
+    }
+    return new Promise((resolve, reject) => {
+        const id = ++imageWorkerTaskId;
+        imageWorkerTasks[id] = { resolve, reject };
+        worker.postMessage({ ...message, id });
+    });
+}
+
+// Миниатюра файла как object URL: декодирование и уменьшение идут в Worker,
+// в памяти страницы остаётся только маленький JPEG, а не base64 всего файла
+async function createThumbnailUrl(file) {
+    try {
+        const { blob, width, height } = await runImageWorkerTask({ type: 'thumbnail', file, maxSize: THUMBNAIL_SIZE });
+        originalDimensions.set(file, { width, height });
+        return URL.createObjectURL(blob);
+    } catch (error) {
+        // Без Worker/OffscreenCanvas показываем сам файл - тоже без копии в base64
+        return URL.createObjectURL(file);
+    }
+}
+
+function revokeImagePreviews() {
+    previewGeneration++;
+    Object.values(imagePreviews).forEach(url => URL.revokeObjectURL(url));
+    imagePreviews = {};
+    pendingThumbnails = new Set();
+}
+
+// Миниатюра изображения вне сетки предпросмотра: готовится, когда строка
+// результата впервые становится видимой, onReady перерисовывает строку
+function requestThumbnail(filename, onReady) {
+    const file = selectedFilesByName.get(filename);
+    if (!file || imagePreviews[filename] || pendingThumbnails.has(filename)) {
+        return;
+    }
+    pendingThumbnails.add(filename);
+    const generation = previewGeneration;
+    createThumbnailUrl(file).then(url => {
+        if (generation !== previewGeneration) {
+            URL.revokeObjectURL(url);
+            return;
+        }
+        pendingThumbnails.delete(filename);
+        imagePreviews[filename] = url;
+        onReady();
+    });
+}
+
+function updateUploadLimitsHint() {
+    const limits = [];
+    if (uploadLimits.max_files) {
+        limits.push(`До ${uploadLimits.max_files.toLocaleString('ru-RU')} фото`);
+    }
+    if (uploadLimits.max_total_mb) {
+        limits.push(`Макс. ${uploadLimits.max_total_mb} МБ`);
+    }
+    uploadLimitsHint.textContent = ['PNG, JPG, JPEG, GIF, BMP, WEBP', ...limits].join(' • ');
+}
+
+// Параметры предобработки перед отправкой или null, если она выключена
+function getUploadSettings() {
+    if (!resizeBeforeUploadInput || !resizeBeforeUploadInput.checked) {
+        return null;
+    }
+    return {
+        maxSize: Math.max(64, parseInt(uploadMaxDimensionInput.value) || 1536),
+        format: uploadFormatInput.value || 'image/jpeg',
+        quality: Math.min(100, Math.max(10, parseInt(uploadQualityInput.value) || 85)) / 100
+    };
+}
+
+// Уменьшает и перекодирует файл в Worker; если это не уменьшило файл, отправляется оригинал
+async function prepareUpload(file, settings) {
+    const key = `${settings.maxSize}|${settings.format}|${settings.quality}`;
+    const cached = preparedUploads.get(file);
+    if (cached && cached.key === key) {
+        return cached.file;
+    }
+
+    const entry = { key, file, width: null, height: null };
+    try {
+        const result = await runImageWorkerTask({ type: 'resize', file, ...settings });
+        originalDimensions.set(file, { width: result.width, height: result.height });
+        if (result.blob.size < file.size) {
+            // Имя оставляем исходным - по нему сопоставляются ground truth и результаты
+            entry.file = new File([result.blob], file.name, { type: result.blob.type });
+            entry.width = result.scaledWidth;
+            entry.height = result.scaledHeight;
+        } else {
+            entry.width = result.width;
+            entry.height = result.height;
+        }
+    } catch (error) {
+        console.warn('Предобработка недоступна, отправляем оригинал:', file.name, error);
+    }
+    preparedUploads.set(file, entry);
+    return entry.file;
+}
+
+// Подготовленная копия файла для текущих настроек предобработки или null
+function getPreparedUpload(file) {
+    const settings = getUploadSettings();
+    const cached = preparedUploads.get(file);
+    if (settings && cached && cached.key === `${settings.maxSize}|${settings.format}|${settings.quality}`) {
+        return cached;
+    }
+    return null;
+}
+
+// Файл, который реально уходит на сервер
+function getUploadFile(file) {
+    const prepared = getPreparedUpload(file);
+    return prepared ? prepared.file : file;
+}
+
+// Размеры отправляемого изображения для прогноза токенов
+// ({} - неизвестны, тогда сервер оценивает по размеру файла)
+function getUploadDimensions(file) {
+    const prepared = getPreparedUpload(file);
+    if (prepared) {
+        return prepared.width ? { width: prepared.width, height: prepared.height } : {};
+    }
+    return originalDimensions.get(file) || {};
+}
 
 function handleFiles(files) {
     const validTypes = ['image/png', 'image/jpeg', 'image/jpg', 'image/gif', 'image/bmp', 'image/webp'];
@@ -537,39 +837,44 @@ function handleFiles(files) {
         return;
     }
     
-    if (imageFiles.length > MAX_FILES) {
-        showError(`Превышен лимит изображений. Максимум: ${MAX_FILES}, загружено: ${imageFiles.length}`);
+    if (uploadLimits.max_files && imageFiles.length > uploadLimits.max_files) {
+        showError(`Превышен лимит изображений. Максимум: ${uploadLimits.max_files}, загружено: ${imageFiles.length}`);
         return;
     }
     
     const totalSize = imageFiles.reduce((sum, file) => sum + file.size, 0);
-    if (totalSize > 100 * 1024 * 1024) {
-        showError('Общий размер файлов превышает 100 МБ.');
+    if (uploadLimits.max_total_mb && totalSize > uploadLimits.max_total_mb * 1024 * 1024) {
+        showError(`Общий размер файлов превышает ${uploadLimits.max_total_mb} МБ.`);
         return;
     }
     
     selectedFiles = imageFiles;
+    selectedFilesByName = new Map(imageFiles.map(file => [file.name, file]));
     
-    // Сохраняем base64 данные для миниатюр
-    imagePreviews = {};
-    let loadedCount = 0;
+    // Миниатюры и подготовленные копии прошлого датасета больше не нужны
+    revokeImagePreviews();
+    preparedUploads = new Map();
+    const generation = previewGeneration;
+    displayImagePreviews(imageFiles);
     
-    imageFiles.forEach((file, index) => {
-        const reader = new FileReader();
-        reader.onload = (e) => {
-            imagePreviews[file.name] = e.target.result;
-            loadedCount++;
-            
-            // Когда все изображения загружены, отображаем превью
-            if (loadedCount === imageFiles.length) {
-                displayImagePreviews(imageFiles);
-                // Обновляем ground truth интерфейс, если в режиме классификации
-                if (currentMode === 'classification') {
-                    updateGroundTruthInterface();
-                }
-            }
-        };
-        reader.readAsDataURL(file);
+    // Миниатюры заранее - только для сетки предпросмотра, остальные по требованию
+    Promise.all(imageFiles.slice(0, PREVIEW_GRID_LIMIT).map(async (file, index) => {
+        const url = await createThumbnailUrl(file);
+        if (generation !== previewGeneration) {
+            // Датасет сменился, пока миниатюра готовилась
+            URL.revokeObjectURL(url);
+            return;
+        }
+        imagePreviews[file.name] = url;
+        const img = imagesGrid.querySelector(`img[data-index="${index}"]`);
+        if (img) {
+            img.src = url;
+        }
+    })).then(() => {
+        // Обновляем ground truth интерфейс, если в режиме классификации
+        if (generation === previewGeneration && usesClassification()) {
+            updateGroundTruthInterface();
+        }
     });
     
     dropZoneContent.style.display = 'none';
@@ -584,29 +889,44 @@ function handleFiles(files) {
 function displayImagePreviews(files) {
     imagesGrid.innerHTML = '';
     
-    files.forEach((file, index) => {
-        const reader = new FileReader();
-        reader.onload = (e) => {
-            const imgWrapper = document.createElement('div');
-            imgWrapper.className = 'preview-image-wrapper';
-            
-            const img = document.createElement('img');
-            img.src = e.target.result;
-            img.className = 'preview-image';
-            img.alt = file.name;
-            
-            const imgLabel = document.createElement('div');
-            imgLabel.className = 'preview-image-label';
-            imgLabel.textContent = `${index + 1}. ${file.name.length > 20 ? file.name.substring(0, 17) + '...' : file.name}`;
-            
-            imgWrapper.appendChild(img);
-            imgWrapper.appendChild(imgLabel);
-            imagesGrid.appendChild(imgWrapper);
-        };
-        reader.readAsDataURL(file);
+    files.slice(0, PREVIEW_GRID_LIMIT).forEach((file, index) => {
+        const imgWrapper = document.createElement('div');
+        imgWrapper.className = 'preview-image-wrapper';
+        
+        // Миниатюра подставляется, когда Worker её подготовит
+        const img = document.createElement('img');
+        img.className = 'preview-image';
+        img.alt = file.name;
+        img.dataset.index = index;
+        if (imagePreviews[file.name]) {
+            img.src = imagePreviews[file.name];
+        }
+        
+        const imgLabel = document.createElement('div');
+        imgLabel.className = 'preview-image-label';
+        imgLabel.textContent = `${index + 1}. ${file.name.length > 20 ? file.name.substring(0, 17) + '...' : file.name}`;
+        
+        imgWrapper.appendChild(img);
+        imgWrapper.appendChild(imgLabel);
+        imagesGrid.appendChild(imgWrapper);
     });
+
+    if (files.length > PREVIEW_GRID_LIMIT) {
+        const more = document.createElement('div');
+        more.className = 'preview-more';
+        more.textContent = `…и ещё ${files.length - PREVIEW_GRID_LIMIT} изображений`;
+        imagesGrid.appendChild(more);
+    }
     
+    updateDatasetStats(files);
+}
+
+function updateDatasetStats(files) {
     const totalSize = (files.reduce((sum, file) => sum + file.size, 0) / (1024 * 1024)).toFixed(2);
+    const sentFiles = files.map(getUploadFile);
+    const sentSize = (sentFiles.reduce((sum, file) => sum + file.size, 0) / (1024 * 1024)).toFixed(2);
+    const isPrepared = sentFiles.some((file, index) => file !== files[index]);
+
     datasetInfo.innerHTML = `
         <div class="dataset-stats">
             <div class="stat-item">
@@ -619,10 +939,386 @@ function displayImagePreviews(files) {
                 <span class="stat-value">${totalSize} МБ</span>
                 <span class="stat-label">общий размер</span>
             </div>
+            ${isPrepared ? `
+            <div class="stat-item">
+                <span class="stat-icon">📤</span>
+                <span class="stat-value">${sentSize} МБ</span>
+                <span class="stat-label">отправляется после сжатия</span>
+            </div>
+            ` : ''}
         </div>
     `;
 }
 
+// Преобразует результат сервера в элемент models_results
+function buildModelResult(modelId, modelShort, result) {
+    if (!result.success) {
+        return {
+            model: modelId,
+            model_short: modelShort,
+            success: false,
+            error: result.error || 'Ошибка анализа'
+        };
+    }
+    return {
+        model: modelId,
+        model_short: modelShort,
+        success: true,
+        entity: result.entity,
+        processing_time: result.processing_time,
+        tokens_per_second: result.tokens_per_second,
+        total_tokens: result.total_tokens,
+        prompt_tokens: result.prompt_tokens,
+        completion_tokens: result.completion_tokens,
+        temperature: result.temperature,
+        max_tokens: result.max_tokens,
+        model_info: result.model_info,
+        request_info: result.request_info,
+        classification: result.classification,
+        combined_fallback: result.combined_fallback,
+        classification_correct: result.classification_correct,
+        near_duplicate_of: result.near_duplicate_of,
+        hamming_distance: result.hamming_distance,
+        packed: result.packed,
+        pack_size: result.pack_size,
+        resolution: result.resolution,
+        cascade_escalated: result.cascade_escalated,
+        escalation_reason: result.escalation_reason,
+        low_res_answer: result.low_res_answer,
+        positive_probability: result.positive_probability,
+        scoring: result.scoring
+    };
+}
+
+// Пул промисов с ограничением параллелизма: общим и для каждого ключа (модели).
+// Задачи запускаются в порядке очереди; задача, чей ключ исчерпал свой лимит,
+// пропускается, пока не освободится слот этого ключа.
+function runPromisePool(tasks, { concurrency, perKeyLimit, keyOf, signal }) {
+    return new Promise(resolve => {
+        const queue = tasks.slice();
+        const inFlightByKey = {};
+        let inFlight = 0;
+
+        const launchNext = () => {
+            if (signal && signal.aborted) {
+                queue.length = 0;
+            }
+            while (inFlight < concurrency && queue.length > 0) {
+                const index = queue.findIndex(task => (inFlightByKey[keyOf(task)] || 0) < perKeyLimit);
+                if (index === -1) {
+                    break;
+                }
+                const [task] = queue.splice(index, 1);
+                const key = keyOf(task);
+                inFlight++;
+                inFlightByKey[key] = (inFlightByKey[key] || 0) + 1;
+
+                task.run().finally(() => {
+                    inFlight--;
+                    inFlightByKey[key]--;
+                    launchNext();
+                });
+            }
+            if (inFlight === 0 && queue.length === 0) {
+                resolve();
+            }
+        };
+
+        launchNext();
+    });
+}
+
+// Ожидание с учётом отмены запуска
+function sleep(ms, signal) {
+    return new Promise((resolve, reject) => {
+        if (signal && signal.aborted) {
+            reject(new DOMException('Aborted', 'AbortError'));
+            return;
+        }
+        const timer = setTimeout(resolve, ms);
+        if (signal) {
+            signal.addEventListener('abort', () => {
+                clearTimeout(timer);
+                reject(new DOMException('Aborted', 'AbortError'));
+            }, { once: true });
+        }
+    });
+}
+
+// fetch с повтором при перегрузке сервера: пауза не меньше Retry-After,
+// с экспоненциальным ростом и случайным разбросом, чтобы клиенты не вернулись разом
+async function fetchWithOverloadRetry(url, options) {
+    for (let attempt = 0; ; attempt++) {
+        const response = await fetch(url, options);
+        if (response.status !== 429 || attempt >= OVERLOAD_MAX_RETRIES) {
+            return response;
+        }
+        const retryAfter = (parseInt(response.headers.get('Retry-After'), 10) || 1) * 1000;
+        const backoff = Math.min(OVERLOAD_MAX_DELAY, Math.max(retryAfter, 1000 * 2 ** attempt));
+        const delay = backoff * (0.8 + Math.random() * 0.4);
+        loadingSubtext.textContent = `⏳ Сервер перегружен, повтор через ${Math.round(delay / 1000)} с`;
+        await sleep(delay, options.signal);
+    }
+}
+
+// Прогноз токенов и длительности запуска (null - у сервера нет статистики)
+async function fetchRunEstimate(models, files, concurrency, perModelConcurrency) {
+    try {
+        const response = await fetch('/api/estimate', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                models,
+                images: files.map(file => ({ bytes: getUploadFile(file).size, ...getUploadDimensions(file) })),
+                concurrency,
+                perModelConcurrency
+            })
+        });
+        const data = await response.json();
+        return data.success ? data : null;
+    } catch (error) {
+        console.warn('Не удалось получить прогноз запуска:', error);
+        return null;
+    }
+}
+
+function remainingSeconds(estimate, startedAt, completed, total) {
+    const elapsed = (Date.now() - startedAt) / 1000;
+    const eta = estimate ? estimate.eta_seconds : null;
+    if (!completed) {
+        return eta === null ? null : Math.max(0, eta - elapsed);
+    }
+    const observed = elapsed / completed * (total - completed);
+    if (eta === null) {
+        return observed;
+    }
+    // Доверие фактическому темпу растёт с числом готовых результатов
+    const weight = Math.min(1, completed / Math.max(4, total * 0.2));
+    return weight * observed + (1 - weight) * eta * (1 - completed / total);
+}
+
+function formatDuration(seconds) {
+    const total = Math.max(0, Math.round(seconds));
+    if (total < 60) {
+        return `${total} с`;
+    }
+    const minutes = Math.floor(total / 60);
+    return minutes < 60 ? `${minutes} мин ${total % 60} с` : `${Math.floor(minutes / 60)} ч ${minutes % 60} мин`;
+}
+
+// Ответ сервера как JSON. Ошибки без JSON (413 от Flask или прокси, 502/504
+// прокси) превращаются в исключение с читаемым текстом, а не в ошибку разбора
+async function readJsonResponse(response) {
+    const contentType = response.headers.get('Content-Type') || '';
+    if (contentType.includes('application/json')) {
+        return response.json();
+    }
+    if (response.status === 413) {
+        throw new Error(`Запрос больше ${uploadLimits.max_request_mb} МБ - уменьшите пачку или включите сжатие изображений`);
+    }
+    throw new Error(`Сервер ответил ${response.status} ${response.statusText}`.trim());
+}
+
+// Делит файлы на чанки не больше maxCount изображений и не больше
+// max_request_mb по размеру отправляемых (после сжатия) файлов;
+// изображение больше лимита уходит отдельным чанком
+function splitIntoChunks(files, maxCount) {
+    const maxBytes = uploadLimits.max_request_mb * 1024 * 1024;
+    const chunks = [];
+    let current = null;
+    files.forEach((file, index) => {
+        const size = getUploadFile(file).size;
+        if (!current || current.files.length >= maxCount || (maxBytes && current.bytes + size > maxBytes)) {
+            current = { start: index, files: [], bytes: 0 };
+            chunks.push(current);
+        }
+        current.files.push(file);
+        current.bytes += size;
+    });
+    return chunks;
+}
+
+// Отправляет одно изображение или пачку изображений одной модели на сервер
+// modelId - одна модель или массив моделей (тогда весь чанк идёт одним
+// запросом к /api/analyze-batch, а упаковка задаётся packSize)
+async function analyzeChunk(modelId, chunkFiles, signal, packSize = chunkFiles.length) {
+    const multiModel = Array.isArray(modelId);
+    const formData = new FormData();
+    if (chunkFiles.length === 1 && !multiModel) {
+        formData.append('image', getUploadFile(chunkFiles[0]));
+    } else {
+        chunkFiles.forEach(file => formData.append('images', getUploadFile(file)));
+        formData.append('packSize', packSize);
+    }
+    if (multiModel) {
+        formData.append('models', JSON.stringify(modelId));
+    } else {
+        formData.append('model', modelId);
+    }
+    formData.append('mode', currentMode);
+    
+    // Добавляем настройки классификации, если режим classification
+    if (usesClassification()) {
+        formData.append('positiveClass', classificationSettings.positiveClass);
+        formData.append('negativeClass', classificationSettings.negativeClass);
+        formData.append('positiveSynonyms', classificationSettings.positiveSynonyms);
+        formData.append('negativeSynonyms', classificationSettings.negativeSynonyms);
+        if (chunkFiles.length === 1 && !multiModel) {
+            formData.append('groundTruth', groundTruth[chunkFiles[0].name] || '');
+        } else {
+            const chunkGroundTruth = {};
+            chunkFiles.forEach(file => { chunkGroundTruth[file.name] = groundTruth[file.name] || ''; });
+            formData.append('groundTruth', JSON.stringify(chunkGroundTruth));
+        }
+        if (usesScoring()) {
+            formData.append('scoring', 'true');
+        }
+    }
+
+    if (reuseNearDuplicatesInput && reuseNearDuplicatesInput.checked) {
+        formData.append('reuseNearDuplicates', 'true');
+        formData.append('nearDuplicateThreshold', nearDuplicateThresholdInput.value || '5');
+    }
+
+    if (cascadeModeInput && cascadeModeInput.checked) {
+        formData.append('cascade', 'true');
+        formData.append('cascadeSize', cascadeSizeInput.value || '384');
+    }
+    appendJobParams(formData);
+
+    const response = await fetchWithOverloadRetry(chunkFiles.length === 1 && !multiModel ? '/api/analyze' : '/api/analyze-batch', {
+        method: 'POST',
+        body: formData,
+        signal
+    });
+    return readJsonResponse(response);
+}
+
+async function analyzeEnsembleChunk(modelIds, chunkFiles, packSize, signal) {
+    const formData = new FormData();
+    chunkFiles.forEach(file => formData.append('images', getUploadFile(file)));
+    formData.append('models', JSON.stringify(modelIds));
+    formData.append('quorum', ensembleQuorumInput.value || '0');
+    formData.append('packSize', packSize);
+    formData.append('mode', currentMode);
+
+    if (usesClassification()) {
+        formData.append('positiveClass', classificationSettings.positiveClass);
+        formData.append('negativeClass', classificationSettings.negativeClass);
+        formData.append('positiveSynonyms', classificationSettings.positiveSynonyms);
+        formData.append('negativeSynonyms', classificationSettings.negativeSynonyms);
+        const chunkGroundTruth = {};
+        chunkFiles.forEach(file => { chunkGroundTruth[file.name] = groundTruth[file.name] || ''; });
+        formData.append('groundTruth', JSON.stringify(chunkGroundTruth));
+        if (usesScoring()) {
+            formData.append('scoring', 'true');
+        }
+    }
+
+    if (reuseNearDuplicatesInput && reuseNearDuplicatesInput.checked) {
+        formData.append('reuseNearDuplicates', 'true');
+        formData.append('nearDuplicateThreshold', nearDuplicateThresholdInput.value || '5');
+    }
+    appendJobParams(formData);
+
+    const response = await fetchWithOverloadRetry('/api/ensemble', {
+        method: 'POST',
+        body: formData,
+        signal
+    });
+    return readJsonResponse(response);
+}
+
+// Раскладывает ответ ансамбля по слотам моделей; модели, пропущенные
+// после достижения кворума, помечаются skipped и не идут в сравнение
+function applyEnsembleResult(imgRes, models, image) {
+    models.forEach((modelId, modelIndex) => {
+        const modelShort = modelId.split('/').pop();
+        const result = image.results.find(r => r.model === modelId);
+        if (result) {
+            imgRes.models_results[modelIndex] = buildModelResult(modelId, modelShort, result);
+        } else if (image.models_skipped.includes(modelId)) {
+            imgRes.models_results[modelIndex] = {
+                model: modelId,
+                model_short: modelShort,
+                success: false,
+                skipped: true,
+                error: 'Пропущено: кворум достигнут'
+            };
+        }
+    });
+    imgRes.ensemble = {
+        answer: image.ensemble_answer,
+        agreed: image.agreed,
+        votes: image.votes,
+        correct: image.ensemble_correct
+    };
+}
+
+function generateId() {
+    return window.crypto && crypto.randomUUID
+        ? crypto.randomUUID()
+        : `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+}
+
+// Идентификатор браузера - по нему сервер делит API поровну между пользователями
+function getClientId() {
+    let clientId = localStorage.getItem('clientId');
+    if (!clientId) {
+        clientId = generateId();
+        localStorage.setItem('clientId', clientId);
+    }
+    return clientId;
+}
+
+// Задание на сервере: связывает запросы запуска, задаёт дедлайн и позволяет
+// прервать уже отправленные запросы к моделям
+function startJob() {
+    currentJobId = generateId();
+    const jobId = currentJobId;
+    jobHeartbeatTimer = setInterval(() => {
+        fetch(`/api/jobs/${jobId}/heartbeat`, { method: 'POST' }).catch(() => {});
+    }, JOB_HEARTBEAT_INTERVAL);
+}
+
+function finishJob() {
+    clearInterval(jobHeartbeatTimer);
+    jobHeartbeatTimer = null;
+    currentJobId = null;
+}
+
+function appendJobParams(formData) {
+    if (!currentJobId) {
+        return;
+    }
+    formData.append('jobId', currentJobId);
+    formData.append('tenant', getClientId());
+    const deadline = parseInt(jobDeadlineInput && jobDeadlineInput.value, 10) || 0;
+    if (deadline > 0) {
+        formData.append('jobDeadline', deadline);
+    }
+}
+
+function cancelProcessing() {
+    if (processingController) {
+        if (currentJobId) {
+            // Останавливаем и запросы, уже идущие на сервере
+            fetch(`/api/jobs/${currentJobId}/cancel`, { method: 'POST', keepalive: true }).catch(() => {});
+        }
+        processingController.abort();
+        showNotification('⏹ Обработка отменена', 'warning');
+    }
+}
+
+// Страницу закрыли или ушли с неё - результаты никто не прочитает, отменяем задание.
+// Идущие запросы сервер отменяет и сам по разрыву соединения, beacon
+// (доставляется не всегда) снимает и ещё не отправленную часть задания
+window.addEventListener('pagehide', () => {
+    if (currentJobId) {
+        navigator.sendBeacon(`/api/jobs/${currentJobId}/cancel`);
+    }
+});
+
 async function processDatasetWithModels() {
     if (!selectedFiles || selectedFiles.length === 0) {
         showError('Загрузите изображения для обработки');
@@ -637,27 +1333,44 @@ async function processDatasetWithModels() {
     startProcessingBtn.disabled = true;
     loadingSection.style.display = 'flex';
     errorSection.style.display = 'none';
+    processingController = new AbortController();
+    const signal = processingController.signal;
+    startJob();
     
-    // Перестроим обход: для каждой модели — обрабатываем все изображения.
-    const allResults = selectedFiles.map((file, idx) => ({
+    // Результаты раскладываются по слотам [изображение][модель] по мере поступления
+    const files = selectedFiles.slice();
+    const models = selectedModels.slice();
+    allResults = files.map((file, idx) => ({
         image_index: idx,
         filename: file.name,
-        models_results: []
+        models_results: models.map(modelId => ({
+            model: modelId,
+            model_short: modelId.split('/').pop(),
+            pending: true
+        }))
     }));
+    displayImageComparisonResults(allResults);
 
-    for (let modelIndex = 0; modelIndex < selectedModels.length; modelIndex++) {
-        const modelId = selectedModels[modelIndex];
-        const modelInfo = availableModels.find(m => m.id === modelId);
-        const modelShort = modelId.split('/').pop();
-
-        showNotification(`🔁 Обработка моделью ${modelShort} (${modelIndex + 1}/${selectedModels.length})`, 'info');
+    const failModel = (modelIndex, modelShort, error) => {
+        allResults.forEach(imgRes => {
+            imgRes.models_results[modelIndex] = {
+                model: models[modelIndex],
+                model_short: modelShort,
+                success: false,
+                error
+            };
+        });
+    };
 
-        // Загрузка модели (в Ollama API модели всегда доступны)
+    // Проверка доступности всех моделей (в Ollama API модели всегда доступны)
+    const readyModels = await Promise.all(models.map(async (modelId, modelIndex) => {
+        const modelShort = modelId.split('/').pop();
         try {
             const loadResponse = await fetch('/api/load-model', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ model_id: modelId })
+                body: JSON.stringify({ model_id: modelId }),
+                signal
             });
 
             const loadData = await loadResponse.json();
@@ -665,107 +1378,249 @@ async function processDatasetWithModels() {
             if (!loadData.success) {
                 showNotification(`❌ Ошибка доступа к ${modelShort}: ${loadData.error}`, 'error');
                 // Пропускаем все изображения для этой модели
-                allResults.forEach(imgRes => imgRes.models_results.push({
-                    model: modelId,
-                    model_short: modelShort,
-                    success: false,
-                    error: loadData.error
-                }));
-                continue;
+                failModel(modelIndex, modelShort, loadData.error);
+                resultsView.refresh();
+                return false;
             }
 
             updateModelStatus(modelId, true);
-            showNotification(`✅ ${modelShort} готова`, 'success');
+            return true;
 
         } catch (error) {
             showNotification(`❌ Ошибка проверки ${modelShort}: ${error.message}`, 'error');
-            allResults.forEach(imgRes => imgRes.models_results.push({
-                model: modelId,
-                model_short: modelShort,
-                success: false,
-                error: error.message
-            }));
-            continue;
+            failModel(modelIndex, modelShort, error.message);
+            resultsView.refresh();
+            return false;
         }
+    }));
 
-        // Обработка всех изображений этой моделью
-        for (let imgIndex = 0; imgIndex < selectedFiles.length; imgIndex++) {
-            const currentFile = selectedFiles[imgIndex];
-            loadingText.textContent = `🖼️ ${modelShort} обрабатывает ${imgIndex + 1}/${selectedFiles.length}`;
-            loadingSubtext.textContent = `${currentFile.name}`;
-
-            try {
-                const formData = new FormData();
-                formData.append('image', currentFile);
-                formData.append('model', modelId);
-                formData.append('mode', currentMode);
-                
-                // Добавляем настройки классификации, если режим classification
-                if (currentMode === 'classification') {
-                    formData.append('positiveClass', classificationSettings.positiveClass);
-                    formData.append('negativeClass', classificationSettings.negativeClass);
-                    formData.append('groundTruth', groundTruth[currentFile.name] || '');
-                }
+    // Предобработка: уменьшаем и перекодируем изображения один раз для всех моделей
+    const uploadSettings = getUploadSettings();
+    if (uploadSettings) {
+        let preparedCount = 0;
+        loadingText.textContent = `🗜️ Подготовка изображений 0/${files.length}`;
+        await Promise.all(files.map(async file => {
+            await prepareUpload(file, uploadSettings);
+            preparedCount++;
+            loadingText.textContent = `🗜️ Подготовка изображений ${preparedCount}/${files.length}`;
+        }));
+        updateDatasetStats(files);
+    }
 
-                const response = await fetch('/api/analyze', {
-                    method: 'POST',
-                    body: formData
-                });
+    // Задачи: пачки изображений (или по одному), чередуя модели, чтобы все модели
+    // продвигались одновременно и лимит на модель не простаивал.
+    // Локальный бэкенд держит в памяти ограниченное число моделей - там задачи
+    // идут по моделям по очереди, чтобы каждая модель загружалась один раз
+    const sequentialModels = Boolean(backendInfo && !backendInfo.capabilities.parallel_requests);
+    const packSize = packImagesInput && packImagesInput.checked ? Math.max(1, parseInt(packSizeInput.value) || 1) : 1;
+    const concurrency = sequentialModels ? 1 : Math.max(1, parseInt(concurrencyInput && concurrencyInput.value) || 4);
+    const perModelConcurrency = sequentialModels ? 1 : Math.max(1, parseInt(perModelConcurrencyInput && perModelConcurrencyInput.value) || 2);
+    const tasks = [];
+    let completedImages = 0;
+    let totalImages = 0;
+    let progressText = () => `🖼️ Обработано ${completedImages}/${totalImages}`;
 
-                const data = await response.json();
-
-                if (data.success && data.results && data.results.length > 0) {
-                    const result = data.results[0];
-                    allResults[imgIndex].models_results.push({
-                        model: modelId,
-                        model_short: modelShort,
-                        success: true,
-                        entity: result.entity,
-                        processing_time: result.processing_time,
-                        tokens_per_second: result.tokens_per_second,
-                        total_tokens: result.total_tokens,
-                        prompt_tokens: result.prompt_tokens,
-                        completion_tokens: result.completion_tokens,
-                        temperature: result.temperature,
-                        max_tokens: result.max_tokens,
-                        model_info: result.model_info,
-                        request_info: result.request_info,
-                        classification_correct: result.classification_correct
-                    });
-                    showNotification(`✅ ${modelShort}: "${result.entity}"`, 'success');
-                } else {
-                    allResults[imgIndex].models_results.push({
-                        model: modelId,
-                        model_short: modelShort,
-                        success: false,
-                        error: data.error || 'Ошибка анализа'
+    // Пачки ограничены и числом изображений, и размером запроса
+    const chunks = splitIntoChunks(files, Math.min(packSize, uploadLimits.max_pack_size));
+
+    // Ансамбль и каскад: все модели по чанку изображений в одном запросе - сервер
+    // останавливается по кворуму или сравнивает ответы моделей для эскалации
+    const activeModels = models.filter((modelId, modelIndex) => readyModels[modelIndex]);
+    const useEnsemble = Boolean(ensembleModeInput && ensembleModeInput.checked) && activeModels.length >= 2;
+    const useCascade = Boolean(cascadeModeInput && cascadeModeInput.checked) && !useEnsemble;
+    const multiModelChunks = useEnsemble || useCascade;
+    const ensembleCalls = { made: 0, max: 0 };
+
+    // Прогноз длительности по статистике сервера; по мере поступления результатов
+    // ETA всё больше опирается на фактический темп
+    const runEstimate = await fetchRunEstimate(activeModels, files, concurrency, perModelConcurrency);
+
+    // Локальный бэкенд: модели в порядке планировщика сервера (загруженная
+    // первой, остальные по оценке времени), каждая по всем пачкам подряд
+    let taskOrder = [];
+    if (!multiModelChunks) {
+        const modelOrder = runEstimate && runEstimate.model_order ? runEstimate.model_order : activeModels;
+        taskOrder = sequentialModels
+            ? modelOrder.flatMap(modelId => chunks.map(chunk => [chunk, modelId, models.indexOf(modelId)]))
+            : chunks.flatMap(chunk => models.map((modelId, modelIndex) => [chunk, modelId, modelIndex]));
+    }
+
+    // Чанк ансамбля или каскада уходит одним запросом с оригиналами
+    // изображений, поэтому ограничен и по числу, и по размеру
+    const multiModelChunkList = multiModelChunks
+        ? splitIntoChunks(files, Math.min(MULTI_MODEL_CHUNK_SIZE, uploadLimits.max_pack_size))
+        : [];
+
+    multiModelChunkList.forEach(chunk => {
+        const chunkStart = chunk.start;
+        const chunkFiles = chunk.files;
+        totalImages += chunkFiles.length;
+        tasks.push({
+            modelId: `chunk-${chunkStart}`,
+            run: async () => {
+                let error = null;
+                try {
+                    if (useEnsemble) {
+                        const data = await analyzeEnsembleChunk(activeModels, chunkFiles, packSize, signal);
+                        if (data.images) {
+                            data.images.forEach(image => applyEnsembleResult(allResults[chunkStart + image.index], models, image));
+                            ensembleCalls.made += data.calls_made;
+                            ensembleCalls.max += data.calls_max;
+                        } else {
+                            error = data.error || 'Ошибка анализа';
+                        }
+                    } else {
+                        const data = await analyzeChunk(activeModels, chunkFiles, signal, packSize);
+                        if (data.results && data.results.length > 0) {
+                            data.results.forEach(result => {
+                                const modelIndex = models.indexOf(result.model);
+                                const modelShort = result.model.split('/').pop();
+                                allResults[chunkStart + result.index].models_results[modelIndex] = buildModelResult(result.model, modelShort, result);
+                            });
+                        } else {
+                            error = data.error || 'Ошибка анализа';
+                        }
+                    }
+                } catch (e) {
+                    error = e.name === 'AbortError' ? 'Отменено' : e.message;
+                }
+
+                if (error) {
+                    chunkFiles.forEach((file, offset) => {
+                        models.forEach((modelId, modelIndex) => {
+                            if (readyModels[modelIndex]) {
+                                allResults[chunkStart + offset].models_results[modelIndex] = {
+                                    model: modelId,
+                                    model_short: modelId.split('/').pop(),
+                                    success: false,
+                                    error
+                                };
+                            }
+                        });
                     });
-                    showNotification(`❌ ${modelShort}: ${data.error || 'Ошибка анализа'}`, 'error');
+                    if (error !== 'Отменено') {
+                        showNotification(`❌ Ошибка обработки: ${error}`, 'error');
+                    }
                 }
 
-            } catch (error) {
-                allResults[imgIndex].models_results.push({
-                    model: modelId,
-                    model_short: modelShort,
-                    success: false,
-                    error: error.message
-                });
-                showNotification(`❌ Ошибка обработки ${modelShort}: ${error.message}`, 'error');
+                chunkFiles.forEach((file, offset) => resultsView.update(chunkStart + offset));
+                completedImages += chunkFiles.length;
+                loadingText.textContent = progressText();
+                loadingSubtext.textContent = `${useEnsemble ? 'Ансамбль' : 'Каскад'}: ${chunkFiles.map(file => file.name).join(', ')}`;
             }
+        });
+    });
 
-            // Короткая пауза между изображениями
-            await new Promise(resolve => setTimeout(resolve, 300));
+    taskOrder.forEach(([chunk, modelId, modelIndex]) => {
+        if (!readyModels[modelIndex]) {
+            return;
         }
+        const chunkStart = chunk.start;
+        const chunkFiles = chunk.files;
+        const modelShort = modelId.split('/').pop();
+        totalImages += chunkFiles.length;
+        tasks.push({
+            modelId,
+            run: async () => {
+                try {
+                    // Пачки локального бэкенда идут через пакетную обработку
+                    // сервера - его планировщик учится на временах загрузки и ответа
+                    const data = await analyzeChunk(sequentialModels ? [modelId] : modelId, chunkFiles, signal);
+
+                    if (data.results && data.results.length > 0) {
+                        data.results.forEach(result => {
+                            const modelResult = buildModelResult(modelId, modelShort, result);
+                            allResults[chunkStart + result.index].models_results[modelIndex] = modelResult;
+                            if (!modelResult.success) {
+                                showNotification(`❌ ${modelShort}: ${modelResult.error}`, 'error');
+                            }
+                        });
+                    } else {
+                        chunkFiles.forEach((file, offset) => {
+                            allResults[chunkStart + offset].models_results[modelIndex] = {
+                                model: modelId,
+                                model_short: modelShort,
+                                success: false,
+                                error: data.error || 'Ошибка анализа'
+                            };
+                        });
+                        showNotification(`❌ ${modelShort}: ${data.error || 'Ошибка анализа'}`, 'error');
+                    }
+
+                } catch (error) {
+                    const cancelled = error.name === 'AbortError';
+                    chunkFiles.forEach((file, offset) => {
+                        allResults[chunkStart + offset].models_results[modelIndex] = {
+                            model: modelId,
+                            model_short: modelShort,
+                            success: false,
+                            error: cancelled ? 'Отменено' : error.message
+                        };
+                    });
+                    if (!cancelled) {
+                        showNotification(`❌ Ошибка обработки ${modelShort}: ${error.message}`, 'error');
+                    }
+                }
+
+                chunkFiles.forEach((file, offset) => resultsView.update(chunkStart + offset));
+                completedImages += chunkFiles.length;
+                loadingText.textContent = progressText();
+                loadingSubtext.textContent = `${modelShort}: ${chunkFiles.map(file => file.name).join(', ')}`;
+            }
+        });
+    });
 
-        // После обработки всех изображений этой моделью — уведомляем о завершении (выгрузка не требуется)
-        showNotification(`✅ ${modelShort} завершила обработку всех изображений`, 'success');
+    if (runEstimate) {
+        Object.entries(runEstimate.models).forEach(([modelId, estimate]) => {
+            if (estimate.over_context.length > 0) {
+                showNotification(`⚠ ${modelId.split('/').pop()}: ${estimate.over_context.length} изобр. не поместятся в контекст модели`, 'warning');
+            }
+        });
+    }
+    const runStartedAt = Date.now();
+    progressText = () => {
+        const remaining = remainingSeconds(runEstimate, runStartedAt, completedImages, totalImages);
+        const eta = remaining !== null && completedImages < totalImages ? ` · осталось ~${formatDuration(remaining)}` : '';
+        return `🖼️ Обработано ${completedImages}/${totalImages}${eta}`;
+    };
+    loadingText.textContent = progressText();
+    loadingSubtext.textContent = `Параллельно до ${concurrency} запросов, до ${perModelConcurrency} на модель`
+        + (runEstimate && runEstimate.prompt_tokens !== null ? `, ~${runEstimate.prompt_tokens} токенов запроса` : '');
+    const etaTimer = setInterval(() => {
+        loadingText.textContent = progressText();
+    }, 1000);
+    try {
+        await runPromisePool(tasks, {
+            concurrency,
+            perKeyLimit: perModelConcurrency,
+            keyOf: task => task.modelId,
+            signal
+        });
+    } finally {
+        clearInterval(etaTimer);
     }
+
+    // Слоты, до которых не дошла очередь (отмена), помечаем как отменённые
+    allResults.forEach(imgRes => {
+        for (let modelIndex = 0; modelIndex < models.length; modelIndex++) {
+            if (imgRes.models_results[modelIndex].pending) {
+                imgRes.models_results[modelIndex] = {
+                    model: models[modelIndex],
+                    model_short: models[modelIndex].split('/').pop(),
+                    success: false,
+                    error: 'Отменено'
+                };
+            }
+        }
+    });
+    processingController = null;
+    finishJob();
     
     loadingSection.style.display = 'none';
     startProcessingBtn.disabled = false;
     
     if (allResults.length > 0) {
-        displayImageComparisonResults(allResults);
+        resultsView.refresh();
         
         // Получаем детальные метрики сравнения моделей
         try {
@@ -774,14 +1629,18 @@ async function processDatasetWithModels() {
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ 
                     results: allResults.flatMap(img => 
-                        img.models_results.map(modelResult => ({
+                        img.models_results.filter(modelResult => !modelResult.skipped).map(modelResult => ({
                             filename: img.filename,
                             model: modelResult.model,
                             entity: modelResult.entity,
+                            classification: modelResult.classification,
                             success: modelResult.success,
                             processing_time: modelResult.processing_time,
                             tokens_per_second: modelResult.tokens_per_second,
-                            total_tokens: modelResult.total_tokens
+                            total_tokens: modelResult.total_tokens,
+                            resolution: modelResult.resolution,
+                            cascade_escalated: modelResult.cascade_escalated,
+                            positive_probability: modelResult.positive_probability
                         }))
                     ),
                     mode: currentMode,
@@ -799,6 +1658,9 @@ async function processDatasetWithModels() {
         }
         
         showNotification(`Обработка завершена! Проанализировано ${allResults.length} изображений`, 'success');
+        if (useEnsemble && ensembleCalls.max > 0) {
+            showNotification(`🗳 Ансамбль: ${ensembleCalls.made} из ${ensembleCalls.max} вызовов моделей`, 'info');
+        }
     } else {
         showError('Не удалось обработать ни одно изображение');
     }
@@ -806,7 +1668,7 @@ async function processDatasetWithModels() {
 
 function displayModelComparisonMetrics(comparisonData) {
     const comparisonSummary = document.getElementById('comparisonSummary');
-    const isClassificationMode = comparisonData.mode === 'classification';
+    const isClassificationMode = usesClassification(comparisonData.mode);
 
     // Очищаем предыдущее содержимое и сразу формируем весь HTML
     comparisonSummary.innerHTML = `
@@ -874,6 +1736,32 @@ function displayModelComparisonMetrics(comparisonData) {
             </div>
         </div>
         
+        ${comparisonData.mcnemar && comparisonData.mcnemar.length > 0 ? `
+        <div class="agreement-matrix-section">
+            <h3 class="agreement-matrix-title">⚖️ Тест Макнемара: различие точности моделей</h3>
+            <table class="mcnemar-table">
+                <thead>
+                    <tr>
+                        <th>Модели</th>
+                        <th>Права только первая</th>
+                        <th>Права только вторая</th>
+                        <th>p-значение</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    ${comparisonData.mcnemar.map(test => `
+                        <tr class="${test.significant ? 'mcnemar-significant' : ''}">
+                            <td>${test.first.split('/').pop()} / ${test.second.split('/').pop()}</td>
+                            <td>${test.first_only_correct}</td>
+                            <td>${test.second_only_correct}</td>
+                            <td>${test.p_value}${test.significant ? ' (различие значимо)' : ''}</td>
+                        </tr>
+                    `).join('')}
+                </tbody>
+            </table>
+        </div>
+        ` : ''}
+
         <div class="detailed-metrics-section">
             <h3 class="detailed-metrics-title">📋 Детальные метрики моделей</h3>
             <div class="metrics-comparison-grid">
@@ -922,6 +1810,37 @@ function displayModelComparisonMetrics(comparisonData) {
                                     <div class="detailed-metric-value">${isClassificationMode ? metrics.accuracy : metrics.success_rate}</div>
                                     <div class="detailed-metric-unit">%</div>
                                 </div>
+                                ${metrics.scoring && metrics.scoring.auc !== undefined ? `
+                                <div class="detailed-metric" data-tooltip="Площадь под ROC-кривой по вероятностям положительного класса">
+                                    <div class="detailed-metric-label">ROC AUC</div>
+                                    <div class="detailed-metric-value">${metrics.scoring.auc}</div>
+                                    <div class="detailed-metric-unit">по ${metrics.scoring.scored_images} изобр.</div>
+                                </div>
+                                ` : ''}
+                                ${metrics.scoring && metrics.scoring.best_threshold ? `
+                                <div class="detailed-metric" data-tooltip="Порог вероятности с максимальным F1">
+                                    <div class="detailed-metric-label">Лучший порог</div>
+                                    <div class="detailed-metric-value">${metrics.scoring.best_threshold.threshold}</div>
+                                    <div class="detailed-metric-unit">F1 ${metrics.scoring.best_threshold.f1}%</div>
+                                </div>
+                                ` : ''}
+                                ${metrics.classification ? `
+                                <div class="detailed-metric" data-tooltip="Гармоническое среднее precision и recall по положительному классу">
+                                    <div class="detailed-metric-label">F1</div>
+                                    <div class="detailed-metric-value">${metrics.classification.f1}</div>
+                                    <div class="detailed-metric-unit">P ${metrics.classification.precision}% · R ${metrics.classification.recall}%</div>
+                                </div>
+                                <div class="detailed-metric" data-tooltip="Доля правильно распознанных изображений отрицательного класса">
+                                    <div class="detailed-metric-label">Специфичность</div>
+                                    <div class="detailed-metric-value">${metrics.classification.specificity}</div>
+                                    <div class="detailed-metric-unit">%</div>
+                                </div>
+                                <div class="detailed-metric" data-tooltip="Коэффициент корреляции Мэтьюса (от -1 до 1); нераспознанные ответы считаются ошибками: ${metrics.classification.unmatched_answers}">
+                                    <div class="detailed-metric-label">MCC</div>
+                                    <div class="detailed-metric-value">${metrics.classification.mcc}</div>
+                                    <div class="detailed-metric-unit">TP ${metrics.classification.confusion_matrix.tp} · FP ${metrics.classification.confusion_matrix.fp} · FN ${metrics.classification.confusion_matrix.fn} · TN ${metrics.classification.confusion_matrix.tn}</div>
+                                </div>
+                                ` : ''}
                             </div>
                         </div>
                     `;
@@ -964,17 +1883,83 @@ function displayModelComparisonMetrics(comparisonData) {
             </div>
         </div>
     `;
-}function displayImageComparisonResults(allResults) {
+}
+
+// Виртуализированный список результатов: в DOM только видимые строки (плюс запас),
+// строки фиксированной высоты позиционируются абсолютно внутри блока-распорки.
+// update(index) перерисовывает строку, если она видна, - так результаты
+// появляются по мере поступления без перестроения всего списка.
+function displayImageComparisonResults(allResults) {
     // Очищаем предыдущие результаты
     modelsGrid.innerHTML = '';
     
     // Показываем секцию результатов
     resultsSection.style.display = 'block';
-    
-    // Обрабатываем результаты для каждого изображения
-    allResults.forEach((imageResult, imageIndex) => {
-        displayImageResults(imageResult, imageIndex);
-    });
+
+    const viewport = document.createElement('div');
+    viewport.className = 'results-viewport';
+    const spacer = document.createElement('div');
+    spacer.className = 'results-spacer';
+    spacer.style.height = `${allResults.length * RESULT_ROW_HEIGHT}px`;
+    viewport.appendChild(spacer);
+    modelsGrid.appendChild(viewport);
+
+    const renderedRows = new Map(); // индекс изображения -> элемент строки
+    const dirtyRows = new Set();
+    let framePending = false;
+
+    const render = () => {
+        framePending = false;
+        const first = Math.max(0, Math.floor(viewport.scrollTop / RESULT_ROW_HEIGHT) - RESULT_OVERSCAN);
+        const last = Math.min(allResults.length - 1,
+            Math.ceil((viewport.scrollTop + viewport.clientHeight) / RESULT_ROW_HEIGHT) + RESULT_OVERSCAN);
+
+        renderedRows.forEach((row, index) => {
+            if (index < first || index > last) {
+                row.remove();
+                renderedRows.delete(index);
+            }
+        });
+
+        for (let index = first; index <= last; index++) {
+            if (renderedRows.has(index) && !dirtyRows.has(index)) {
+                continue;
+            }
+            const row = displayImageResults(allResults[index], index);
+            row.style.top = `${index * RESULT_ROW_HEIGHT}px`;
+            if (renderedRows.has(index)) {
+                renderedRows.get(index).replaceWith(row);
+            } else {
+                spacer.appendChild(row);
+            }
+            renderedRows.set(index, row);
+        }
+        dirtyRows.clear();
+    };
+
+    const scheduleRender = () => {
+        if (!framePending) {
+            framePending = true;
+            requestAnimationFrame(render);
+        }
+    };
+
+    viewport.addEventListener('scroll', scheduleRender, { passive: true });
+    scheduleRender();
+
+    resultsView = {
+        update(index) {
+            if (renderedRows.has(index)) {
+                dirtyRows.add(index);
+                scheduleRender();
+            }
+        },
+        refresh() {
+            renderedRows.forEach((row, index) => dirtyRows.add(index));
+            scheduleRender();
+        }
+    };
+    return resultsView;
 }
 
 function displayImageResults(imageResult, imageIndex) {
@@ -983,6 +1968,9 @@ function displayImageResults(imageResult, imageIndex) {
     
     // Получаем миниатюру изображения
     const imageThumbnail = imagePreviews[imageResult.filename] || '';
+    if (!imageThumbnail) {
+        requestThumbnail(imageResult.filename, () => resultsView && resultsView.update(imageIndex));
+    }
     
     section.innerHTML = `
         <div class="image-results-header">
@@ -996,6 +1984,9 @@ function displayImageResults(imageResult, imageIndex) {
                 <div class="image-stats">
                     <span class="stat-badge">Моделей: ${imageResult.models_results.length}</span>
                     <span class="stat-badge">✅ ${imageResult.models_results.filter(r => r.success).length} успешных</span>
+                    ${imageResult.ensemble ? `
+                    <span class="stat-badge">🗳 Ансамбль: ${imageResult.ensemble.answer || '—'} (${imageResult.ensemble.agreed ? 'кворум' : 'без кворума'})${imageResult.ensemble.correct === true ? ' ✓' : imageResult.ensemble.correct === false ? ' ✗' : ''}</span>
+                    ` : ''}
                 </div>
             </div>
         </div>
@@ -1005,8 +1996,21 @@ function displayImageResults(imageResult, imageIndex) {
     const grid = section.querySelector('.image-models-grid');
     
     imageResult.models_results.forEach((modelResult, modelIndex) => {
+        if (modelResult.pending || modelResult.skipped) {
+            const pendingCard = document.createElement('div');
+            pendingCard.className = 'model-result-card pending';
+            pendingCard.innerHTML = `
+                <div class="model-header">
+                    <span class="model-name">${modelResult.model_short}</span>
+                    <span class="model-status">${modelResult.skipped ? 'Пропущено (кворум)' : 'В очереди'}</span>
+                </div>
+            `;
+            grid.appendChild(pendingCard);
+            return;
+        }
+
         // Проверяем ошибку классификации: если режим классификации И classification_correct НЕ равно true
-        const isError = currentMode === 'classification' && modelResult.classification_correct !== true;
+        const isError = usesClassification() && modelResult.classification_correct !== true;
         const resultCard = document.createElement('div');
         resultCard.className = `model-result-card ${modelResult.success ? 'success' : 'failed'} ${isError ? 'error' : ''}`;
         
@@ -1015,7 +2019,7 @@ function displayImageResults(imageResult, imageIndex) {
             let statusText = 'Правильно';
             let statusClass = 'success';
             
-            if (currentMode === 'classification') {
+            if (usesClassification()) {
                 if (modelResult.classification_correct === true) {
                     statusText = 'Правильно';
                     statusClass = 'success';
@@ -1034,6 +2038,27 @@ function displayImageResults(imageResult, imageIndex) {
                     <span class="model-status ${statusClass}">${statusText}</span>
                 </div>
                 <div class="model-entity ${isError ? 'error' : ''}">${modelResult.entity}</div>
+                ${modelResult.classification ? `
+                <div class="model-entity ${isError ? 'error' : ''}">Класс: ${modelResult.classification}</div>
+                ` : ''}
+                ${modelResult.combined_fallback ? `
+                <div class="model-reuse-badge">↩ JSON не разобран, выполнены отдельные запросы</div>
+                ` : ''}
+                ${modelResult.packed ? `
+                <div class="model-reuse-badge">📦 В пачке из ${modelResult.pack_size} изображений (время и токены на одно изображение)</div>
+                ` : ''}
+                ${modelResult.near_duplicate_of ? `
+                <div class="model-reuse-badge">♻ Почти-дубликат ${modelResult.near_duplicate_of} (расстояние ${modelResult.hamming_distance})</div>
+                ` : ''}
+                ${modelResult.positive_probability !== undefined && modelResult.positive_probability !== null ? `
+                <div class="model-reuse-badge">🎯 P(${classificationSettings.positiveClass}) = ${modelResult.positive_probability}${modelResult.scoring === 'token' ? ' (без logprobs, по ответу)' : ''}</div>
+                ` : ''}
+                ${modelResult.resolution === 'low' ? `
+                <div class="model-reuse-badge">🔍 Ответ по уменьшенной копии</div>
+                ` : ''}
+                ${modelResult.cascade_escalated ? `
+                <div class="model-reuse-badge">🔍 Перепроверено в полном разрешении (${ESCALATION_REASONS[modelResult.escalation_reason] || modelResult.escalation_reason})${modelResult.low_res_answer ? `, по уменьшенной: ${modelResult.low_res_answer}` : ''}</div>
+                ` : ''}
                 <div class="model-metrics">
                     <div class="mini-metric">
                         <span class="mini-metric-label">⏱️</span>
@@ -1096,7 +2121,7 @@ function displayImageResults(imageResult, imageIndex) {
         grid.appendChild(resultCard);
     });
     
-    modelsGrid.appendChild(section);
+    return section;
 }
 
 function showError(message) {
@@ -0,0 +1,124 @@
+"""Прогрев моделей и проба готовности.
+
+После запуска процесса и после изменения каталога каждой готовой к
+запросам модели параллельно отправляется крошечный запрос (проба) дважды:
+первый измеряет холодную задержку и принимает на себя холодный старт
+модели и шлюза, второй - тёплую. По результату модель помечается как
+ready (отвечает быстро), degraded (отвечает медленно или нестабильно) или
+unavailable. Сводка отдаётся в /ready - по ней балансировщик направляет
+трафик только на прогретые экземпляры, а интерфейс показывает, какие
+модели сейчас быстрые.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+READY = 'ready'
+DEGRADED = 'degraded'
+UNAVAILABLE = 'unavailable'
+WARMING = 'warming'
+
+
+class ModelWarmup:
+    """Прогрев моделей пробами probe(model_name) -> задержка в секундах.
+
+    slow_latency - тёплая задержка, выше которой модель считается degraded.
+    """
+
+    def __init__(self, probe, concurrency=8, slow_latency=10.0):
+        self.probe = probe
+        self.concurrency = concurrency
+        self.slow_latency = slow_latency
+        self.runs = 0
+        self._models = {}
+        self._target = None
+        self._warmed = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _attempt(self, model_name):
+        started = time.time()
+        try:
+            return round(self.probe(model_name), 3), None
+        except Exception as e:
+            return round(time.time() - started, 3), str(e)
+
+    def _warm_model(self, model_name):
+        cold_latency, cold_error = self._attempt(model_name)
+        warm_latency, warm_error = self._attempt(model_name)
+        if warm_error:
+            state = UNAVAILABLE
+        elif cold_error or warm_latency > self.slow_latency:
+            state = DEGRADED
+        else:
+            state = READY
+        entry = {
+            'state': state,
+            'cold_latency': None if cold_error else cold_latency,
+            'warm_latency': None if warm_error else warm_latency,
+            'error': warm_error or cold_error,
+            'checked_at': time.time()
+        }
+        with self._lock:
+            self._models[model_name] = entry
+        icon = {READY: '✓', DEGRADED: '⚠', UNAVAILABLE: '✗'}[state]
+        print(f"{icon} Прогрев {model_name}: {state}, холодный {entry['cold_latency']} с, тёплый {entry['warm_latency']} с")
+
+    def warm(self, model_names):
+        """Прогревает модели параллельно (блокирующий вызов)"""
+        with self._lock:
+            self._models = {
+                name: dict(self._models.get(name, {}), state=WARMING) for name in model_names
+            }
+        if model_names:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(model_names))) as pool:
+                list(pool.map(self._warm_model, model_names))
+        with self._lock:
+            self.runs += 1
+
+    def schedule(self, model_names):
+        """Прогрев в фоне; повторный вызов с тем же набором моделей ничего не делает"""
+        target = tuple(sorted(set(model_names)))
+        with self._lock:
+            if target == self._target:
+                return
+            self._target = target
+            if self._thread is not None:
+                # Поток прогрева подхватит новый набор после текущего прохода
+                return
+            self._thread = threading.Thread(target=self._loop, name='model-warmup', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                target = self._target
+                if target == self._warmed:
+                    self._thread = None
+                    return
+            print(f"🔄 Прогрев моделей: {len(target)}")
+            self.warm(list(target))
+            with self._lock:
+                self._warmed = target
+
+    def status(self):
+        with self._lock:
+            models = {name: dict(entry) for name, entry in self._models.items()}
+            warming = self._thread is not None
+            warmed = self._warmed
+        # Готов - прогрев завершён и хотя бы одна модель отвечает быстро. Если
+        # прогревать было нечего (локальный бэкенд, модели загружаются по
+        # запросу), готовность означает, что каталог загружен
+        if warmed is None or warming:
+            ready = False
+        elif not warmed:
+            ready = True
+        else:
+            ready = any(m['state'] == READY for m in models.values())
+        return {
+            'ready': ready,
+            'warming': warming,
+            'runs': self.runs,
+            'slow_latency': self.slow_latency,
+            'models': models
+        }